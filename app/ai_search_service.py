@@ -1,10 +1,14 @@
 import os
-import numpy as np
-import tiktoken
-from openai import AzureOpenAI
-from azure.core.credentials import AzureKeyCredential
-from azure.search.documents import SearchClient
+import asyncio
 from azure.search.documents.models import VectorizedQuery
+from app.embedding_service import EmbeddingService
+from app.search_clients import AsyncSearchClientRegistry, SearchClientRegistry
+from app.tokenizer import get_tokenizer
+from app.local_vector_index import local_index_registry
+from app.search_result_cache import search_result_cache
+from app.embedding_cache import normalize_text
+from app.single_flight import SINGLE_FLIGHT_LOCK_DIR, SingleFlight
+from app.metrics import span
 
 # ===============================
 # Azure OpenAI Service の設定
@@ -12,20 +16,29 @@ from azure.search.documents.models import VectorizedQuery
 AZURE_OPENAI_EMBEDDING_ENDPOINT = os.environ.get("AZURE_OPENAI_EMBEDDING_ENDPOINT")
 AZURE_OPENAI_KEY = os.environ.get("AZURE_OPENAI_KEY")
 AZURE_OPENAI_API_VERSION = os.environ.get("AZURE_OPENAI_API_VERSION", "2024-02-01")
+EMBEDDING_MODEL = "text-embedding-3-large"
 
 # ===============================
 # Azure AI Search Service の設定
 # ===============================
 SEARCH_CLIENT_ENDPOINT = os.environ.get("SEARCH_CLIENT_ENDPOINT")
 AZURE_KEY_CREDENTIAL = os.environ.get("AZURE_KEY_CREDENTIAL")
+search_client_registry = SearchClientRegistry(SEARCH_CLIENT_ENDPOINT, AZURE_KEY_CREDENTIAL)
+async_search_client_registry = AsyncSearchClientRegistry(SEARCH_CLIENT_ENDPOINT, AZURE_KEY_CREDENTIAL)
 
 # ===============================
 # クエリ構成設定
 # ===============================
+# select にはプロンプトで使うフィールドだけを指定する
 GET_COMPANY = {
     "vector_fields": "content_vector",
     "select_fields": ["content"],
 }
+# 取得する検索結果の最大件数 (既定は従来どおり上位 3 件。増やす場合は件数をトークン予算で制限する)
+RETRIEVAL_MAX_RESULTS = int(os.environ.get("RETRIEVAL_MAX_RESULTS", 3))
+# 関連情報としてプロンプトに含めるトークン数の上限 (整形後のテキストで数える。0 以下で無制限)
+# 既定値は従来の上位 3 件 (1 件あたり約 500 トークン) と同程度
+RETRIEVAL_TOKEN_BUDGET = int(os.environ.get("RETRIEVAL_TOKEN_BUDGET", 1500))
 
 # ===============================
 # AzureOpenAI クライアント設定
@@ -35,50 +48,161 @@ openai_embedding_client_config = {
     "api_key": AZURE_OPENAI_KEY,
     "api_version": AZURE_OPENAI_API_VERSION,
 }
+embedding_service = EmbeddingService(openai_embedding_client_config, EMBEDDING_MODEL)
+
+# ===============================
+# 同時に実行中の同じ呼び出しのまとめ
+# ===============================
+# 埋め込みは永続キャッシュ (SQLite) をワーカー間で共有しているため、ワーカー間でもまとめる
+embedding_flight = SingleFlight("embedding", lock_dir=SINGLE_FLIGHT_LOCK_DIR)
+search_flight = SingleFlight("search")
 
 # ===============================
 # テキストをベクトルに変換
 # ===============================
 def convert_string_to_vector(string):
-    client = AzureOpenAI(**openai_embedding_client_config)
-    tokenizer = tiktoken.get_encoding("cl100k_base")
-    tokens = tokenizer.encode(string)
-    split_tokens = [tokens[i:i + 8192] for i in range(0, len(tokens), 8192)]
+    # クライアント・トークナイザの再利用とキャッシュは EmbeddingService が担う
+    with span("embedding"):
+        return embedding_flight.do(normalize_text(string), lambda: embedding_service.embed(string))
+
+# ===============================
+# ベクトル検索を実行
+# ===============================
+def _search_flight_key(query, target_index, vector_fields, select_fields, max_results, token_budget):
+    return (target_index, normalize_text(query), vector_fields, tuple(select_fields), max_results, token_budget)
+
+
+def process_vector_search(query, target_index, vector_fields, select_fields,
+                          max_results=RETRIEVAL_MAX_RESULTS, token_budget=RETRIEVAL_TOKEN_BUDGET):
+    key = _search_flight_key(query, target_index, vector_fields, select_fields, max_results, token_budget)
+    results = search_flight.do(key, lambda: _process_vector_search(
+        query, target_index, vector_fields, select_fields, max_results, token_budget
+    ))
+    # 同じ結果を受け取った呼び出し同士で dict を共有しない
+    return [dict(item) for item in results]
+
+
+def _process_vector_search(query, target_index, vector_fields, select_fields, max_results, token_budget):
+    vector = convert_string_to_vector(query)
+
+    with span("search") as timer:
+        results, outcome, cache_key = search_local_or_cached(
+            vector, target_index, select_fields, max_results, token_budget
+        )
+        if results is not None:
+            timer.outcome = outcome
+            return results
+
+        search_client = search_client_registry.get(target_index)
+
+        vector_query = VectorizedQuery(
+            vector=vector,
+            k_nearest_neighbors=max_results,
+            fields=vector_fields,
+        )
 
-    sum_string_vector = [
-        client.embeddings.create(
-            input=tokenizer.decode(chunk),
-            model="text-embedding-3-large"
-        ).data[0].embedding
-        for chunk in split_tokens
-    ]
+        # 結果は遅延取得されるため、予算に達した時点で以降のページは取得しない
+        search_results = search_client.search(
+            search_text="",
+            vector_queries=[vector_query],
+            select=select_fields,
+            top=max_results
+        )
 
-    return np.mean(sum_string_vector, axis=0).tolist() if sum_string_vector else None
+        results = collect_within_token_budget(search_results, select_fields, token_budget)
+        search_result_cache.set(cache_key, results)
+        return results
 
 # ===============================
-# ベクトル検索を実行
+# ローカルインデックスでベクトル検索を実行
+# ===============================
+def process_local_vector_search(vector, target_index, max_results):
+    """
+    ローカルスナップショットがあるインデックスはローカルで検索する。
+    使えない場合は None を返し、呼び出し元は Azure AI Search にフォールバックする。
+    """
+    if vector is None:
+        return None
+    try:
+        local_index = local_index_registry.get(target_index)
+        if local_index is None:
+            return None
+        return local_index.search(vector, max_results)
+    except Exception as e:
+        print(f"ローカル検索に失敗したため Azure AI Search を使用します ({target_index}): {e}")
+        return None
+
+def search_local_or_cached(vector, target_index, select_fields, max_results, token_budget):
+    """
+    ローカルインデックスまたは検索結果キャッシュから結果を返す。
+
+    Returns:
+        tuple: (結果, outcome, キャッシュキー)。どちらにもなければ結果は None
+        (Azure AI Search の結果をキャッシュキーで保存する)
+    """
+    local_results = process_local_vector_search(vector, target_index, max_results)
+    if local_results is not None:
+        return collect_within_token_budget(local_results, select_fields, token_budget), "local", None
+
+    cache_key = search_result_cache.make_key(target_index, vector, max_results, select_fields, token_budget)
+    cached_results = search_result_cache.get(cache_key)
+    if cached_results is not None:
+        return cached_results, "cache_hit", cache_key
+    return None, None, cache_key
+
+# ===============================
+# トークン予算内で検索結果を収集
 # ===============================
-def process_vector_search(query, target_index, vector_fields, select_fields):
-    search_client = SearchClient(
-        endpoint=SEARCH_CLIENT_ENDPOINT,
-        index_name=target_index,
-        credential=AzureKeyCredential(AZURE_KEY_CREDENTIAL),
-    )
+class TokenBudgetCollector:
+    """
+    検索結果を 1 件ずつ受け取り、トークン予算に収まる分だけ保持する。
 
-    vector_query = VectorizedQuery(
-        vector=convert_string_to_vector(query),
-        k_nearest_neighbors=3,
-        fields=vector_fields,
-    )
+    予算は summarize_vector_results で整形したテキスト (区切りの改行を含む) のトークン数で数える。
+    結果ごとのトークン数を足していくため、連結したテキストとは境界で数トークンずれることがあり、
+    その分として境界ごとに BOUNDARY_MARGIN_TOKENS を加える。
+    """
 
-    search_results = search_client.search(
-        search_text="",
-        vector_queries=[vector_query],
-        select=select_fields,
-        top=100
-    )
+    SEPARATOR = "\n\n"
+    BOUNDARY_MARGIN_TOKENS = 1
 
-    return list(search_results)
+    def __init__(self, select_fields, token_budget):
+        self.select_fields = select_fields
+        self.token_budget = token_budget
+        self.collected = []
+        self.used_tokens = 0
+
+    def add(self, result):
+        """結果を追加する。これ以上結果が不要な場合は False を返す。"""
+        item = {field: result.get(field) for field in self.select_fields}
+        if self.token_budget <= 0:
+            self.collected.append(item)
+            return True
+
+        tokenizer = get_tokenizer()
+        tokens = len(tokenizer.encode(format_vector_result(item)))
+        if self.collected:
+            tokens += len(tokenizer.encode(self.SEPARATOR)) + self.BOUNDARY_MARGIN_TOKENS
+        used_tokens = self.used_tokens + tokens
+        if used_tokens > self.token_budget:
+            if not self.collected and "content" in item:
+                # 1 件目だけで予算を超える場合は、予算に収まるよう切り詰めて使う
+                overflow = used_tokens - self.token_budget
+                content_tokens = tokenizer.encode(item["content"] or "")
+                item["content"] = tokenizer.decode(content_tokens[:max(len(content_tokens) - overflow, 0)])
+                self.collected.append(item)
+            return False
+
+        self.collected.append(item)
+        self.used_tokens = used_tokens
+        return True
+
+
+def collect_within_token_budget(search_results, select_fields, token_budget):
+    collector = TokenBudgetCollector(select_fields, token_budget)
+    for result in search_results:
+        if not collector.add(result):
+            break
+    return collector.collected
 
 # ===============================
 # 特定のターゲットインデックスでベクトル検索を実行
@@ -86,13 +210,69 @@ def process_vector_search(query, target_index, vector_fields, select_fields):
 def process_target_index(messages, target_index):
     return process_vector_search(messages, target_index, **GET_COMPANY)
 
+# ===============================
+# 非同期版 (ASGI 用)
+# ===============================
+async def aconvert_string_to_vector(string):
+    with span("embedding"):
+        return await embedding_flight.ado(normalize_text(string), lambda: embedding_service.aembed(string))
+
+
+async def aprocess_vector_search(query, target_index, vector_fields, select_fields,
+                                 max_results=RETRIEVAL_MAX_RESULTS, token_budget=RETRIEVAL_TOKEN_BUDGET):
+    key = _search_flight_key(query, target_index, vector_fields, select_fields, max_results, token_budget)
+    results = await search_flight.ado(key, lambda: _aprocess_vector_search(
+        query, target_index, vector_fields, select_fields, max_results, token_budget
+    ))
+    return [dict(item) for item in results]
+
+
+async def _aprocess_vector_search(query, target_index, vector_fields, select_fields, max_results, token_budget):
+    vector = await aconvert_string_to_vector(query)
+
+    with span("search") as timer:
+        # ローカル検索の行列演算とキャッシュの SQLite 読み取りでイベントループを止めない
+        results, outcome, cache_key = await asyncio.to_thread(
+            search_local_or_cached, vector, target_index, select_fields, max_results, token_budget
+        )
+        if results is not None:
+            timer.outcome = outcome
+            return results
+
+        search_client = async_search_client_registry.get(target_index)
+
+        vector_query = VectorizedQuery(
+            vector=vector,
+            k_nearest_neighbors=max_results,
+            fields=vector_fields,
+        )
+
+        search_results = await search_client.search(
+            search_text="",
+            vector_queries=[vector_query],
+            select=select_fields,
+            top=max_results
+        )
+
+        collector = TokenBudgetCollector(select_fields, token_budget)
+        async for result in search_results:
+            if not collector.add(result):
+                break
+        await asyncio.to_thread(search_result_cache.set, cache_key, collector.collected)
+        return collector.collected
+
+
+async def aprocess_target_index(messages, target_index):
+    return await aprocess_vector_search(messages, target_index, **GET_COMPANY)
+
 # ===============================
 # ベクトル検索結果を整形
 # ===============================
+def format_vector_result(item):
+    return f"- {item.get('title', '')}\n  {item.get('content', '')}"
+
 def summarize_vector_results(results):
+    # 件数はトークン予算で決まるため、取得できた結果をすべて使う
     if isinstance(results, list):
-        return "\n\n".join(
-            f"- {item.get('title', '')}\n  {item.get('content', '')}"
-            for item in results[:3]
-        )
+        return "\n\n".join(format_vector_result(item) for item in results)
     return str(results)
@@ -0,0 +1,187 @@
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+from app.index_versions import index_versions
+
+# ===============================
+# セマンティック回答キャッシュの設定
+# ===============================
+SEMANTIC_CACHE_ENABLED = os.environ.get("SEMANTIC_CACHE_ENABLED", "false").lower() == "true"
+# この値以上のコサイン類似度であれば同じ質問とみなす
+SEMANTIC_CACHE_THRESHOLD = float(os.environ.get("SEMANTIC_CACHE_THRESHOLD", 0.95))
+# テナントごとに保持する回答の数 (0 以下で無効)
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.environ.get("SEMANTIC_CACHE_MAX_ENTRIES", 512))
+SEMANTIC_CACHE_MAX_TENANTS = int(os.environ.get("SEMANTIC_CACHE_MAX_TENANTS", 256))
+SEMANTIC_CACHE_TTL_SECONDS = int(os.environ.get("SEMANTIC_CACHE_TTL_SECONDS", 24 * 60 * 60))
+
+
+def fingerprint_context(context):
+    """検索で得た関連情報のフィンガープリント (16 バイト) を返す。"""
+    return hashlib.blake2b((context or "").encode("utf-8"), digest_size=16).digest()
+
+
+class _TenantAnswers:
+    """1 テナント分のキャッシュ。ベクトルは正規化済みの float32 行列で保持する。"""
+
+    def __init__(self, dim, max_entries, version):
+        self.version = version
+        self.max_entries = max_entries
+        self.vectors = np.zeros((min(16, max_entries), dim), dtype=np.float32)
+        self.fingerprints = np.zeros(len(self.vectors), dtype="S16")
+        self.created_at = np.zeros(len(self.vectors), dtype=np.float64)
+        self.last_used = np.zeros(len(self.vectors), dtype=np.float64)
+        self.answers = [None] * len(self.vectors)
+        self.size = 0
+
+    def _grow(self):
+        capacity = min(len(self.vectors) * 2, self.max_entries)
+        extra = capacity - len(self.vectors)
+        self.vectors = np.vstack([self.vectors, np.zeros((extra, self.vectors.shape[1]), dtype=np.float32)])
+        self.fingerprints = np.concatenate([self.fingerprints, np.zeros(extra, dtype="S16")])
+        self.created_at = np.concatenate([self.created_at, np.zeros(extra)])
+        self.last_used = np.concatenate([self.last_used, np.zeros(extra)])
+        self.answers.extend([None] * extra)
+
+    def lookup(self, vector, fingerprint, threshold, ttl_seconds, now):
+        if self.size == 0:
+            return None
+        scores = self.vectors[:self.size] @ vector
+        valid = (self.fingerprints[:self.size] == fingerprint) & (self.created_at[:self.size] >= now - ttl_seconds)
+        scores = np.where(valid, scores, -np.inf)
+        best = int(np.argmax(scores))
+        if scores[best] < threshold:
+            return None
+        self.last_used[best] = now
+        return self.answers[best]
+
+    def store(self, vector, fingerprint, answer, ttl_seconds, now):
+        """回答を保存する。既存の行を追い出した場合は True を返す。"""
+        evicted = False
+        if self.size < len(self.vectors):
+            row = self.size
+            self.size += 1
+        elif len(self.vectors) < self.max_entries:
+            self._grow()
+            row = self.size
+            self.size += 1
+        else:
+            # 期限切れの行があればそれを、なければ最も長く使われていない行を再利用する
+            expired = np.flatnonzero(self.created_at[:self.size] < now - ttl_seconds)
+            row = int(expired[0]) if len(expired) else int(np.argmin(self.last_used[:self.size]))
+            evicted = True
+        self.vectors[row] = vector
+        self.fingerprints[row] = fingerprint
+        self.created_at[row] = now
+        self.last_used[row] = now
+        self.answers[row] = answer
+        return evicted
+
+
+class SemanticAnswerCache:
+    """
+    テナント (検索インデックス) ごとの回答キャッシュ。
+
+    質問の埋め込みと関連情報のフィンガープリントが一致し、コサイン類似度が
+    閾値以上の過去の回答があれば、LLM を呼ばずにその回答を返す。
+    """
+
+    def __init__(self, enabled=SEMANTIC_CACHE_ENABLED, threshold=SEMANTIC_CACHE_THRESHOLD,
+                 max_entries=SEMANTIC_CACHE_MAX_ENTRIES, max_tenants=SEMANTIC_CACHE_MAX_TENANTS,
+                 ttl_seconds=SEMANTIC_CACHE_TTL_SECONDS, versions=index_versions):
+        # 保存できる件数が 0 以下の場合は無効にする
+        self.enabled = enabled and max_entries > 0
+        self.versions = versions
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.max_tenants = max_tenants
+        self.ttl_seconds = ttl_seconds
+        self._tenants = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"lookups": 0, "hits": 0, "misses": 0, "stores": 0, "evictions": 0, "invalidations": 0}
+
+    @staticmethod
+    def _normalize(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, tenant, vector, context):
+        """キャッシュ済みの回答を返す。見つからなければ None。"""
+        if not self.enabled or vector is None:
+            return None
+        query = self._normalize(vector)
+        fingerprint = fingerprint_context(context)
+        version = self.versions.get(tenant)
+        with self._lock:
+            self._stats["lookups"] += 1
+            answers = self._tenants.get(tenant)
+            if answers is not None and answers.version != version:
+                # インデックスが更新されたため、このテナントの回答はすべて破棄する
+                del self._tenants[tenant]
+                self._stats["invalidations"] += 1
+                answers = None
+            answer = None
+            if answers is not None and answers.vectors.shape[1] == len(query):
+                self._tenants.move_to_end(tenant)
+                answer = answers.lookup(query, fingerprint, self.threshold, self.ttl_seconds, time.time())
+            self._stats["hits" if answer is not None else "misses"] += 1
+            return answer
+
+    def store(self, tenant, vector, context, answer):
+        """回答を保存する。"""
+        if not self.enabled or vector is None or not answer:
+            return
+        query = self._normalize(vector)
+        fingerprint = fingerprint_context(context)
+        version = self.versions.get(tenant)
+        with self._lock:
+            answers = self._tenants.get(tenant)
+            if answers is None or answers.version != version or answers.vectors.shape[1] != len(query):
+                answers = _TenantAnswers(len(query), self.max_entries, version)
+                self._tenants[tenant] = answers
+            self._tenants.move_to_end(tenant)
+            if answers.store(query, fingerprint, answer, self.ttl_seconds, time.time()):
+                self._stats["evictions"] += 1
+            while len(self._tenants) > self.max_tenants:
+                _, dropped = self._tenants.popitem(last=False)
+                self._stats["evictions"] += dropped.size
+            self._stats["stores"] += 1
+
+    def invalidate(self, tenant=None):
+        """
+        テナント (省略時は全テナント) のキャッシュを破棄する。
+
+        インデックスのバージョンが進んだ場合は、次回の参照時に自動で破棄される。
+        """
+        with self._lock:
+            if tenant is None:
+                self._tenants.clear()
+            else:
+                self._tenants.pop(tenant, None)
+            self._stats["invalidations"] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["tenants"] = len(self._tenants)
+            stats["entries"] = sum(answers.size for answers in self._tenants.values())
+        stats["hit_rate"] = stats["hits"] / stats["lookups"] if stats["lookups"] else 0.0
+        return stats
+
+
+semantic_answer_cache = SemanticAnswerCache()
+
+
+def is_cacheable_conversation(messages):
+    """
+    キャッシュ対象の会話かどうか。
+
+    回答は会話履歴にも依存するため、ユーザーの質問が 1 つだけの最初のターンに限る。
+    """
+    if not isinstance(messages, list):
+        return False
+    roles = [message.get("role") for message in messages if message.get("role") != "system"]
+    return roles == ["user"]
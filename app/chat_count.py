@@ -3,24 +3,10 @@ import datetime
 from django.http import JsonResponse
 from rest_framework.views import APIView
 from rest_framework.permissions import IsAuthenticated
-from azure.cosmos import CosmosClient, exceptions
+from azure.cosmos import exceptions
 from new_oshietena.authentication import AzureADJWTAuthentication
-
-# --- 環境変数から Cosmos DB の接続情報を取得 ---
-ENDPOINT = os.environ.get("COSMOS_DB_ENDPOINT")
-KEY = os.environ.get("COSMOS_DB_KEY")
-DATABASE_NAME = os.environ.get("DATABASE_NAME")
-CONTAINER_NAME = os.environ.get("CONTAINER_NAME")
-
-# --- Cosmos DB クライアントの初期化 ---
-# アプリ起動時に一度だけ初期化するのが効率的
-try:
-    client = CosmosClient(ENDPOINT, KEY)
-    database = client.get_database_client(DATABASE_NAME)
-    container = database.get_container_client(CONTAINER_NAME)
-except Exception as e:
-    print(f"Cosmos DB client initialization failed: {e}")
-    client = None
+from app.cosmos_repository import cosmos_repository
+from app.usage_counter import fetch_available_term, read_usage_count
 
 
 class ChatCountView(APIView):
@@ -28,7 +14,7 @@ class ChatCountView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        if not client:
+        if not cosmos_repository.is_available():
             return JsonResponse({"error": "Database connection failed"}, status=500)
 
         user_id = request.user.username
@@ -36,27 +22,14 @@ class ChatCountView(APIView):
 
         try:
             # --- 1. まず共通の利用期間を一度だけ取得する ---
-            query_term = (
-                "SELECT c.AvailableTerm FROM c "
-                "WHERE c.AvailableuserId = @userId"
-            )
-            parameters = [{"name": "@userId", "value": user_id}]
-
-            items = list(container.query_items(
-                query=query_term,
-                parameters=parameters,
-                partition_key=user_id
-            ))
-
-            if not items:
+            term = fetch_available_term(user_id)
+            if not term:
                 raise ValueError(f"AvailableTerm not found for user_id={user_id}")
 
-            term = items[0]['AvailableTerm']
             start_iso_string = term['start'] # "2025-08-22T00:00:00Z"
-            end_iso_string = term['end']
 
             # --- 2. URLのnameに応じて処理を分岐 ---
-            if url_name == 'get_startday':
+            if url_name in ('get_startday', 'usage'):
                 # 'Z'を削除してPythonのdatetimeオブジェクトに変換
                 start_datetime_obj = datetime.datetime.fromisoformat(start_iso_string.replace('Z', '+00:00'))
                 
@@ -64,29 +37,18 @@ class ChatCountView(APIView):
                 start_day_formatted = start_datetime_obj.strftime('%Y-%m-%d')
                 
                 response_data = {"start_day": start_day_formatted}
+                if url_name == 'get_startday':
+                    return JsonResponse(response_data)
+
+                # 開始日・利用回数・上限を 1 回のリクエストで返す
+                response_data["count"] = read_usage_count(user_id, term)
+                response_data["limit"] = int(os.environ.get("CHAT_USAGE_LIMIT", 0))
                 return JsonResponse(response_data)
 
             elif url_name == 'checkcount':
-                # 利用期間内のチャット回数を取得
-                query_count = (
-                    "SELECT VALUE COUNT(1) FROM c "
-                    "WHERE c.userId = @userId "
-                    "AND c.createdAt >= @start_date "
-                    "AND c.createdAt <= @end_date"
-                )
-                parameters_count = [
-                    {"name": "@userId", "value": user_id},
-                    {"name": "@start_date", "value": start_iso_string},
-                    {"name": "@end_date", "value": end_iso_string},
-                ]
+                # 利用期間内のチャット回数をカウンターから取得
+                count = read_usage_count(user_id, term)
 
-                count_items = list(container.query_items(
-                    query=query_count,
-                    parameters=parameters_count,
-                    partition_key=user_id
-                ))
-                count = count_items[0] if count_items else 0
-                
                 limit = int(os.environ.get("CHAT_USAGE_LIMIT", 0))
 
                 response_data = {
@@ -0,0 +1,265 @@
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from app.cosmos_repository import CONVERSATION_SUMMARY_TYPE, cosmos_repository
+from app.tokenizer import count_tokens
+
+# ===============================
+# 会話ウィンドウの設定
+# ===============================
+CONVERSATION_WINDOW_ENABLED = os.environ.get("CONVERSATION_WINDOW_ENABLED", "false").lower() == "true"
+# モデルに送る会話履歴 (要約を除く) のトークン数の上限
+CONVERSATION_TOKEN_BUDGET = int(os.environ.get("CONVERSATION_TOKEN_BUDGET", 4000))
+# 古い会話を要約する際の要約の最大トークン数
+CONVERSATION_SUMMARY_MAX_TOKENS = int(os.environ.get("CONVERSATION_SUMMARY_MAX_TOKENS", 500))
+CONVERSATION_SUMMARY_CACHE_SIZE = int(os.environ.get("CONVERSATION_SUMMARY_CACHE_SIZE", 2048))
+CONVERSATION_SUMMARY_TTL_SECONDS = int(os.environ.get("CONVERSATION_SUMMARY_TTL_SECONDS", 24 * 60 * 60))
+# メッセージごとに role などで消費されるトークン数の概算
+MESSAGE_OVERHEAD_TOKENS = 4
+
+SUMMARY_PREFIX = "これまでの会話の要約:\n"
+
+
+def count_message_tokens(message):
+    return count_tokens(str(message.get("content") or "")) + MESSAGE_OVERHEAD_TOKENS
+
+
+def fingerprint_messages(messages):
+    digest = hashlib.blake2b(digest_size=16)
+    for message in messages:
+        digest.update(f"{message.get('role')}\x00{message.get('content')}\x01".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def split_conversation(messages, token_budget):
+    """
+    会話を (system メッセージ, 要約に回す古いメッセージ, 直近のメッセージ) に分ける。
+
+    直近のメッセージは新しい順にトークン予算に収まるだけ残す。
+    最新のメッセージ (今回の質問) は予算を超えても必ず残す。
+    """
+    system_messages = [message for message in messages if message.get("role") == "system"]
+    conversation = [message for message in messages if message.get("role") != "system"]
+
+    used_tokens = 0
+    start = len(conversation)
+    while start > 0:
+        tokens = count_message_tokens(conversation[start - 1])
+        if used_tokens + tokens > token_budget and start < len(conversation):
+            break
+        used_tokens += tokens
+        start -= 1
+    # 直近の履歴が回答から始まらないよう、質問と回答の組を崩さない
+    while start < len(conversation) - 1 and conversation[start].get("role") == "assistant":
+        start += 1
+    return system_messages, conversation[:start], conversation[start:]
+
+
+class ConversationSummaryCache:
+    """
+    historyBoxId ごとに、要約済みの古いメッセージ数とその要約を保持する。
+
+    プロセス内のキャッシュにない (または古い) 場合は loader で永続化した要約を読み込む。
+    """
+
+    def __init__(self, max_entries=CONVERSATION_SUMMARY_CACHE_SIZE, ttl_seconds=CONVERSATION_SUMMARY_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "partial_hits": 0, "misses": 0}
+
+    @staticmethod
+    def _covered_count(entry, folded_messages):
+        """entry が folded_messages の先頭何件の要約か。使えなければ 0。"""
+        if entry is None or entry["count"] > len(folded_messages) \
+                or entry["fingerprint"] != fingerprint_messages(folded_messages[:entry["count"]]):
+            return 0
+        return entry["count"]
+
+    def get(self, key, folded_messages, loader=None):
+        """
+        folded_messages の先頭部分に対する要約を返す。
+
+        Args:
+            loader (callable): キャッシュで全件を要約済みでない場合に、永続化した要約
+                ({"count", "fingerprint", "summary"}) を返す関数。なければ None を返す。
+
+        Returns:
+            tuple: (要約, 要約済みのメッセージ数)。使える要約がなければ ("", 0)。
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.time() - entry["updated_at"] > self.ttl_seconds:
+                del self._entries[key]
+                entry = None
+            count = self._covered_count(entry, folded_messages)
+
+        if count < len(folded_messages) and loader is not None:
+            # 別のワーカーで要約が進んでいる場合や、再起動・TTL 切れの後は永続化した要約を使う
+            loaded = loader()
+            loaded_count = self._covered_count(loaded, folded_messages)
+            if loaded_count > count:
+                entry, count = dict(loaded, updated_at=time.time()), loaded_count
+                with self._lock:
+                    self._put(key, entry)
+
+        with self._lock:
+            if not count:
+                self._stats["misses"] += 1
+                return "", 0
+            self._stats["hits" if count == len(folded_messages) else "partial_hits"] += 1
+            return entry["summary"], count
+
+    def set(self, key, folded_messages, summary):
+        with self._lock:
+            self._put(key, {
+                "count": len(folded_messages),
+                "fingerprint": fingerprint_messages(folded_messages),
+                "summary": summary,
+                "updated_at": time.time(),
+            })
+
+    def _put(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+        return stats
+
+
+conversation_summary_cache = ConversationSummaryCache()
+
+
+def _summary_key(history_box_id, folded_messages):
+    if history_box_id:
+        return f"box:{history_box_id}"
+    # historyBoxId がない場合は会話の先頭のやり取りで識別する
+    return "head:" + fingerprint_messages(folded_messages[:2])
+
+
+# ===============================
+# 要約の永続化 (Cosmos DB)
+# ===============================
+# gunicorn のワーカー間や再起動後も要約を使えるよう、historyBoxId ごとに 1 件のドキュメントに保存する。
+# createdAt と historyBoxId を持たせないため、利用回数の COUNT や履歴の一覧・個別チャットには含まれない
+def conversation_summary_id(history_box_id):
+    """historyBoxId に対応する要約ドキュメントの ID を返します。"""
+    return f"{CONVERSATION_SUMMARY_TYPE}-{history_box_id}"
+
+
+def load_persisted_summary(user_id, history_box_id):
+    """保存済みの要約 ({"count", "fingerprint", "summary"}) を返す。なければ None。"""
+    if not user_id or not history_box_id or not cosmos_repository.is_available():
+        return None
+    try:
+        document = cosmos_repository.read_item(
+            conversation_summary_id(history_box_id), user_id, name="conversation_summary_read"
+        )
+    except Exception as e:
+        # 読めない場合は、要約されていないメッセージをそのまま送る
+        print(f"会話の要約の読み込みに失敗しました: {e}")
+        return None
+    if document is None:
+        return None
+    return {key: document[key] for key in ("count", "fingerprint", "summary")}
+
+
+def persist_summary(user_id, history_box_id, folded_messages, summary):
+    if not user_id or not history_box_id or not cosmos_repository.is_available():
+        return
+    cosmos_repository.upsert({
+        "id": conversation_summary_id(history_box_id),
+        "type": CONVERSATION_SUMMARY_TYPE,
+        "userId": user_id,
+        "summarizedBoxId": history_box_id,
+        "count": len(folded_messages),
+        "fingerprint": fingerprint_messages(folded_messages),
+        "summary": summary,
+        "updatedAt": datetime.now(timezone.utc).isoformat(),
+    }, name="conversation_summary_upsert")
+
+
+def _assemble(system_messages, summary, recent_messages):
+    summary_messages = [{"role": "system", "content": SUMMARY_PREFIX + summary}] if summary else []
+    return system_messages + summary_messages + recent_messages
+
+
+def window_messages(messages, user_id, history_box_id, token_budget=CONVERSATION_TOKEN_BUDGET):
+    """
+    会話履歴をトークン予算に収め、古いやり取りは保存済みの要約 1 件にまとめる。
+
+    リクエストの処理中には LLM を呼ばない。まだ要約されていない古いメッセージは
+    落とさずにそのまま送り、回答の後に refresh_conversation_summary で要約を進める
+    (次のターンから使われる)。
+
+    Args:
+        messages (list): クライアントから受け取った会話履歴
+        user_id (str): ユーザーID (要約ドキュメントのパーティションキー)
+        history_box_id (str): 要約を保存する単位 (チャットの一塊)
+
+    Returns:
+        list: モデルに送るメッセージ (messages とは別のリスト)
+    """
+    if not isinstance(messages, list):
+        return messages
+    if not CONVERSATION_WINDOW_ENABLED:
+        return list(messages)
+    system_messages, folded, recent = split_conversation(messages, token_budget)
+    if not folded:
+        return list(messages)
+
+    summary, summarized_count = conversation_summary_cache.get(
+        _summary_key(history_box_id, folded), folded,
+        loader=lambda: load_persisted_summary(user_id, history_box_id),
+    )
+    if not summarized_count:
+        return list(messages)
+    return _assemble(system_messages, summary, folded[summarized_count:] + recent)
+
+
+def refresh_conversation_summary(messages, answer, user_id, history_box_id, summarize,
+                                 token_budget=CONVERSATION_TOKEN_BUDGET):
+    """
+    回答の後 (write-behind のスレッド) で呼び出し、次のターンで要約に回る古いメッセージまで要約を進める。
+
+    Args:
+        messages (list): クライアントから受け取った会話履歴
+        answer (str): 今回の回答
+        user_id (str): ユーザーID (要約ドキュメントのパーティションキー)
+        history_box_id (str): 要約を保存する単位 (チャットの一塊)
+        summarize (callable): summarize(previous_summary, new_messages) -> str
+    """
+    if not CONVERSATION_WINDOW_ENABLED or not isinstance(messages, list):
+        return
+    conversation = messages + [{"role": "assistant", "content": answer}]
+    _, folded, _ = split_conversation(conversation, token_budget)
+    if not folded:
+        return
+
+    key = _summary_key(history_box_id, folded)
+    summary, summarized_count = conversation_summary_cache.get(
+        key, folded, loader=lambda: load_persisted_summary(user_id, history_box_id)
+    )
+    if summarized_count >= len(folded):
+        return
+    try:
+        summary = summarize(summary, folded[summarized_count:])
+    except Exception as e:
+        # 要約に失敗した場合は、次のターンも要約されていないメッセージをそのまま送る (LLM の呼び出しはリトライしない)
+        print(f"会話の要約に失敗しました: {e}")
+        return
+    conversation_summary_cache.set(key, folded, summary)
+    try:
+        persist_summary(user_id, history_box_id, folded, summary)
+    except Exception as e:
+        # 保存できなかった場合、他のワーカーでは要約されていないメッセージをそのまま送る
+        print(f"会話の要約の保存に失敗しました: {e}")
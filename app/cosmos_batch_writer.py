@@ -0,0 +1,223 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from azure.cosmos import exceptions
+from app.cosmos_repository import cosmos_repository
+from app.metrics import observe_dropped_writes
+
+# ===============================
+# Cosmos DB バッチ書き込みの設定
+# ===============================
+COSMOS_BATCH_WRITES_ENABLED = os.environ.get("COSMOS_BATCH_WRITES_ENABLED", "false").lower() == "true"
+# 1 回のトランザクショナルバッチに含める件数 (Cosmos DB の上限は 100)
+COSMOS_BATCH_MAX_SIZE = min(int(os.environ.get("COSMOS_BATCH_MAX_SIZE", 100)), 100)
+# 最初のアイテムを受け取ってからバッチを送るまでの最大待ち時間 (ミリ秒)
+COSMOS_BATCH_FLUSH_MS = int(os.environ.get("COSMOS_BATCH_FLUSH_MS", 50))
+# 送信待ちのアイテム数の上限。超えた場合は submit が空きを待つ
+COSMOS_BATCH_MAX_PENDING = int(os.environ.get("COSMOS_BATCH_MAX_PENDING", 5000))
+COSMOS_BATCH_MAX_RETRIES = int(os.environ.get("COSMOS_BATCH_MAX_RETRIES", 3))
+COSMOS_BATCH_RETRY_SECONDS = float(os.environ.get("COSMOS_BATCH_RETRY_SECONDS", 0.5))
+# submit が空きを待つ最大秒数。超えた場合は呼び出し元で直接書き込む
+COSMOS_BATCH_SUBMIT_TIMEOUT = float(os.environ.get("COSMOS_BATCH_SUBMIT_TIMEOUT", 5))
+COSMOS_BATCH_SHUTDOWN_TIMEOUT = float(os.environ.get("COSMOS_BATCH_SHUTDOWN_TIMEOUT", 10))
+
+
+class CosmosBatchWriter:
+    """
+    新規アイテムをパーティションキーごとにまとめ、トランザクショナルバッチで作成するライター。
+
+    件数が max_batch_size に達するか、最初のアイテムから flush_ms 経過した時点で
+    バックグラウンドのスレッドがバッチを送る。作成済みのアイテムは on_committed に
+    パーティションごとのリストで渡す (サマリーやカウンターの更新に使う)。
+    """
+
+    def __init__(self, on_committed=None, max_batch_size=COSMOS_BATCH_MAX_SIZE, flush_ms=COSMOS_BATCH_FLUSH_MS,
+                 max_pending=COSMOS_BATCH_MAX_PENDING, max_retries=COSMOS_BATCH_MAX_RETRIES,
+                 retry_seconds=COSMOS_BATCH_RETRY_SECONDS, submit_timeout=COSMOS_BATCH_SUBMIT_TIMEOUT,
+                 repository=cosmos_repository):
+        self.on_committed = on_committed
+        self.max_batch_size = max_batch_size
+        self.flush_seconds = flush_ms / 1000
+        self.max_pending = max_pending
+        self.max_retries = max_retries
+        self.retry_seconds = retry_seconds
+        self.submit_timeout = submit_timeout
+        self.repository = repository
+        # パーティションキー -> (最初のアイテムを受け取った時刻, アイテムのリスト)
+        self._partitions = OrderedDict()
+        self._pending = 0
+        self._in_flight = 0
+        self._condition = threading.Condition()
+        self._thread = None
+        self._pid = None
+        self._stats = {
+            "items": 0, "batches": 0, "batched_items": 0, "retries": 0,
+            "fallbacks": 0, "duplicates": 0, "failed": 0, "inline": 0,
+        }
+
+    def _ensure_thread(self):
+        # fork 後はスレッドとバッファを作り直す
+        if self._pid == os.getpid():
+            return
+        with self._condition:
+            if self._pid == os.getpid():
+                return
+            self._partitions = OrderedDict()
+            self._pending = 0
+            self._in_flight = 0
+            self._thread = threading.Thread(target=self._run, name="cosmos-batch-writer", daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def submit(self, partition_key, item):
+        """
+        作成するアイテムを追加する。
+
+        送信待ちが max_pending に達している場合は空きを待ち (バックプレッシャー)、
+        submit_timeout 内に空かなければ呼び出し元で直接書き込む。
+        """
+        self._ensure_thread()
+        with self._condition:
+            deadline = time.monotonic() + self.submit_timeout
+            while self._pending >= self.max_pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats["inline"] += 1
+                    break
+                self._condition.wait(remaining)
+            else:
+                started_at, items = self._partitions.setdefault(partition_key, (time.monotonic(), []))
+                items.append(item)
+                self._pending += 1
+                self._stats["items"] += 1
+                self._condition.notify_all()
+                return True
+        self._write(partition_key, [item])
+        return False
+
+    def _take_ready(self):
+        """送信できるパーティションのバッチを取り出す。なければ次に確認するまでの秒数を返す。"""
+        now = time.monotonic()
+        wait = None
+        for partition_key, (started_at, items) in list(self._partitions.items()):
+            due = started_at + self.flush_seconds
+            if len(items) >= self.max_batch_size or due <= now:
+                batch = items[:self.max_batch_size]
+                rest = items[self.max_batch_size:]
+                if rest:
+                    # 残りも最初のアイテムの時刻のまま待つ (flush で 0 にした期限を延ばさない)
+                    self._partitions[partition_key] = (started_at, rest)
+                    self._partitions.move_to_end(partition_key)
+                else:
+                    del self._partitions[partition_key]
+                self._pending -= len(batch)
+                self._in_flight += len(batch)
+                return partition_key, batch, 0
+            wait = due - now if wait is None else min(wait, due - now)
+        return None, None, wait
+
+    def _run(self):
+        while True:
+            with self._condition:
+                partition_key, batch, wait = self._take_ready()
+                if batch is None:
+                    self._condition.wait(wait)
+                    continue
+                # 空きができたことを submit に知らせる
+                self._condition.notify_all()
+            try:
+                self._write(partition_key, batch)
+            finally:
+                with self._condition:
+                    self._in_flight -= len(batch)
+                    self._condition.notify_all()
+
+    def _count(self, name, value=1):
+        with self._condition:
+            self._stats[name] += value
+
+    def _write(self, partition_key, items):
+        # 途中まで作成できた場合も、リトライでは残りのアイテムだけを送る
+        committed = []
+        remaining = items
+        for attempt in range(self.max_retries + 1):
+            try:
+                self._write_batch(partition_key, remaining, committed, retry=attempt > 0)
+                remaining = []
+                break
+            except Exception as e:
+                committed_ids = {item["id"] for item in committed}
+                remaining = [item for item in remaining if item["id"] not in committed_ids]
+                if attempt == self.max_retries:
+                    print(
+                        f"❌ バッチ書き込みに失敗したため {len(remaining)} 件を破棄しました "
+                        f"(ID: {', '.join(item['id'] for item in remaining)}): {e}"
+                    )
+                    self._count("failed", len(remaining))
+                    observe_dropped_writes("cosmos_batch", "retries_exhausted", len(remaining))
+                    break
+                self._count("retries")
+                time.sleep(self.retry_seconds * (2 ** attempt))
+
+        if committed and self.on_committed:
+            try:
+                self.on_committed(partition_key, committed)
+            except Exception as e:
+                print(f"❌ バッチ書き込み後の処理に失敗しました: {e}")
+
+    def _write_batch(self, partition_key, items, committed, retry=False):
+        """items を作成し、作成できたアイテムを committed に追加する。"""
+        if len(items) == 1:
+            self._create_each(items, committed, retry)
+            return
+        try:
+            self.repository.execute_batch(
+                partition_key, [("create", (item,)) for item in items], name="conversation_batch_create"
+            )
+            self._count("batches")
+            self._count("batched_items", len(items))
+            committed.extend(items)
+        except exceptions.CosmosBatchOperationError:
+            # 保存済みの ID が含まれているとバッチ全体が失敗するため、1 件ずつ作成し直す
+            self._count("fallbacks")
+            self._create_each(items, committed, retry)
+
+    def _create_each(self, items, committed, retry=False):
+        for item in items:
+            try:
+                self.repository.create(item, name="conversation_create")
+                committed.append(item)
+            except exceptions.CosmosResourceExistsError:
+                if retry:
+                    # 前回の試行で作成済み (応答だけが失敗した場合など) のため、作成できたものとして扱う
+                    committed.append(item)
+                else:
+                    # クライアントのリトライなどで保存済みの場合は、後続の処理を重複させない
+                    self._count("duplicates")
+
+    def flush(self, timeout=COSMOS_BATCH_SHUTDOWN_TIMEOUT):
+        """送信待ちのアイテムをすぐに送り、すべて書き込まれるまで (最大 timeout 秒) 待つ。"""
+        if self._pid != os.getpid():
+            return True
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            for partition_key, (started_at, items) in list(self._partitions.items()):
+                # 待ち時間を 0 にして、すぐに送信させる
+                self._partitions[partition_key] = (0.0, items)
+            self._condition.notify_all()
+            while self._pending or self._in_flight:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    print(f"⚠️ 未送信のアイテムが {self._pending + self._in_flight} 件あります")
+                    return False
+                self._condition.wait(remaining)
+        return True
+
+    def stats(self):
+        with self._condition:
+            stats = dict(self._stats)
+            stats["pending"] = self._pending
+            stats["in_flight"] = self._in_flight
+        stats["items_per_batch"] = stats["batched_items"] / stats["batches"] if stats["batches"] else 0.0
+        return stats
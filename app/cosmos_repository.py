@@ -0,0 +1,196 @@
+import os
+import importlib
+import threading
+from collections.abc import Iterator
+import requests
+from requests.adapters import HTTPAdapter
+from azure.core.pipeline.transport import RequestsTransport
+from azure.cosmos import CosmosClient, exceptions
+from app.cosmos_usage import cosmos_usage_tracker
+
+# ===============================
+# Cosmos DB の接続設定
+# ===============================
+ENDPOINT = os.environ.get("COSMOS_DB_ENDPOINT")
+KEY = os.environ.get("COSMOS_DB_KEY")
+DATABASE_NAME = os.environ.get("DATABASE_NAME")
+CONTAINER_NAME = os.environ.get("CONTAINER_NAME")
+# プロセス内で共有するコネクションプールの大きさ
+COSMOS_POOL_MAXSIZE = int(os.environ.get("COSMOS_POOL_MAXSIZE", 32))
+# "モジュール:関数" の形式で指定すると、その関数が返すコンテナを使う (ベンチマーク用のフェイクなど)
+COSMOS_CONTAINER_FACTORY = os.environ.get("COSMOS_CONTAINER_FACTORY")
+
+# 会話以外にコンテナに保存するドキュメントの type
+# 履歴一覧用のサマリー
+HISTORY_BOX_TYPE = "historyBox"
+# 利用期間ごとの利用回数カウンター
+USAGE_COUNTER_TYPE = "usageCounter"
+# 既存の会話からサマリーを作成済みであることを示すユーザーごとのマーカー
+HISTORY_BOXES_BACKFILLED_TYPE = "historyBoxesBackfilled"
+# 会話ウィンドウで古いやり取りをまとめた要約 (historyBoxId ごと)
+CONVERSATION_SUMMARY_TYPE = "conversationSummary"
+
+
+class CosmosRepository:
+    """
+    Cosmos DB コンテナへのアクセスをまとめたリポジトリ。
+
+    CosmosClient はプロセスごとに 1 つだけ作成し、keep-alive な
+    コネクションプールを全モジュールで共有する。クライアントは最初の利用時に
+    作成するため、import 時に Cosmos DB へ接続しない。
+    """
+
+    def __init__(self, endpoint=ENDPOINT, key=KEY, database_name=DATABASE_NAME,
+                 container_name=CONTAINER_NAME, pool_maxsize=COSMOS_POOL_MAXSIZE,
+                 container_factory=COSMOS_CONTAINER_FACTORY):
+        self.endpoint = endpoint
+        self.key = key
+        self.database_name = database_name
+        self.container_name = container_name
+        self.pool_maxsize = pool_maxsize
+        self.container_factory = container_factory
+        self._client = None
+        self._container = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self.container_factory:
+            module_name, function_name = self.container_factory.split(":")
+            factory = getattr(importlib.import_module(module_name), function_name)
+            return None, factory()
+
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.pool_maxsize)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        client = CosmosClient(
+            self.endpoint,
+            credential=self.key,
+            transport=RequestsTransport(session=session, session_owner=False),
+        )
+        container = client.get_database_client(self.database_name).get_container_client(self.container_name)
+        return client, container
+
+    def get_container(self):
+        """
+        共有の ContainerProxy を返す。接続できない場合は None。
+
+        初期化に失敗した場合は次の呼び出しで再度接続を試みる。
+        """
+        # fork 後は親プロセスのソケットを共有しないよう作り直す
+        if self._container is not None and self._pid == os.getpid():
+            return self._container
+        with self._lock:
+            if self._container is None or self._pid != os.getpid():
+                try:
+                    self._client, self._container = self._connect()
+                    self._pid = os.getpid()
+                    print("Cosmos DB client initialized successfully in cosmos_repository.py.")
+                except Exception as e:
+                    print(f"Cosmos DB client initialization failed: {e}")
+                    self._client = None
+                    self._container = None
+            return self._container
+
+    @property
+    def container(self):
+        """接続できない場合は例外を送出する ContainerProxy。"""
+        container = self.get_container()
+        if container is None:
+            raise ConnectionError("Database connection is not available.")
+        return container
+
+    def is_available(self):
+        return self.get_container() is not None
+
+    # ---------- 読み取り ----------
+    # 各操作の name は RU・時間を集計する単位 (app/cosmos_usage.py)。呼び出し元のクエリごとに付ける
+    def read_item(self, item_id: str, partition_key: str, name: str = "read_item") -> dict | None:
+        """ID とパーティションキーによるポイント読み取り。見つからなければ None。"""
+        with cosmos_usage_tracker.track(name, "read") as call:
+            try:
+                item = self.container.read_item(item=item_id, partition_key=partition_key, raw_response_hook=call.hook)
+                call.items = 1
+                return item
+            except exceptions.CosmosResourceNotFoundError:
+                call.outcome = "not_found"
+                return None
+
+    def query(self, query: str, parameters: list[dict], partition_key: str, name: str = "query", **kwargs) -> list:
+        """パーティション内のクエリを実行し、結果をリストで返す。"""
+        with cosmos_usage_tracker.track(name, "query") as call:
+            items = list(self.container.query_items(
+                query=query,
+                parameters=parameters,
+                partition_key=partition_key,
+                raw_response_hook=call.hook,
+                **kwargs
+            ))
+            call.items = len(items)
+            return items
+
+    def query_page(
+        self, query: str, parameters: list[dict], partition_key: str, page_size: int,
+        continuation_token: str | None = None, name: str = "query_page",
+    ) -> tuple[list[dict], str | None]:
+        """
+        パーティション内のクエリ結果を 1 ページ分だけ取得する。
+
+        Cosmos DB の max_item_count でページの件数を制限するため、
+        1 回の呼び出しで消費する RU とレイテンシは page_size 件分に収まる。
+
+        Returns:
+            tuple: (アイテムのリスト, 次のページの継続トークン。最後のページなら None)
+        """
+        with cosmos_usage_tracker.track(name, "query_page") as call:
+            pager = self.container.query_items(
+                query=query,
+                parameters=parameters,
+                partition_key=partition_key,
+                max_item_count=page_size,
+                raw_response_hook=call.hook,
+            ).by_page(continuation_token)
+            items = list(next(pager, []))
+            call.items = len(items)
+            return items, pager.continuation_token
+
+    def query_cross_partition(
+        self, query: str, parameters: list[dict] | None = None, name: str = "query_cross_partition",
+    ) -> Iterator:
+        """全パーティションを対象とするクエリ。管理コマンドなど、バッチ処理でのみ使用する。"""
+        with cosmos_usage_tracker.track(name, "query_cross_partition") as call:
+            for item in self.container.query_items(
+                query=query,
+                parameters=parameters,
+                enable_cross_partition_query=True,
+                raw_response_hook=call.hook,
+            ):
+                call.items += 1
+                yield item
+
+    # ---------- 書き込み ----------
+    def create(self, body: dict, name: str = "create") -> dict:
+        with cosmos_usage_tracker.track(name, "create") as call:
+            return self.container.create_item(body=body, raw_response_hook=call.hook)
+
+    def upsert(self, body: dict, name: str = "upsert") -> dict:
+        with cosmos_usage_tracker.track(name, "upsert") as call:
+            return self.container.upsert_item(body=body, raw_response_hook=call.hook)
+
+    def patch(self, item_id: str, partition_key: str, patch_operations: list[dict], name: str = "patch") -> dict:
+        with cosmos_usage_tracker.track(name, "patch") as call:
+            return self.container.patch_item(
+                item=item_id, partition_key=partition_key, patch_operations=patch_operations,
+                raw_response_hook=call.hook,
+            )
+
+    def execute_batch(self, partition_key: str, batch_operations: list[tuple], name: str = "batch") -> list[dict]:
+        """同じパーティションへの操作 (最大 100 件) をトランザクショナルバッチで実行する。"""
+        with cosmos_usage_tracker.track(name, "batch") as call:
+            call.items = len(batch_operations)
+            return self.container.execute_item_batch(
+                batch_operations=batch_operations, partition_key=partition_key, raw_response_hook=call.hook,
+            )
+
+cosmos_repository = CosmosRepository()
@@ -0,0 +1,129 @@
+import os
+import time
+import threading
+from app.metrics import Span, observe_cosmos
+
+# ===============================
+# Cosmos DB の RU・レイテンシ集計の設定
+# ===============================
+COSMOS_USAGE_TRACKING_ENABLED = os.environ.get("COSMOS_USAGE_TRACKING_ENABLED", "true").lower() == "true"
+# この時間 (ミリ秒) または RU を超えた操作はログに出す
+COSMOS_SLOW_OPERATION_MS = float(os.environ.get("COSMOS_SLOW_OPERATION_MS", 500))
+COSMOS_EXPENSIVE_OPERATION_RU = float(os.environ.get("COSMOS_EXPENSIVE_OPERATION_RU", 50))
+
+
+class CosmosCall:
+    """
+    Cosmos DB の 1 回の操作 (クエリの場合は全ページ) の RU・時間・ページ数を記録する。
+
+    hook を raw_response_hook に渡すと、HTTP レスポンス (クエリのページやリトライを含む) ごとに
+    x-ms-request-charge を加算する。所要時間は処理段階のメトリクス (cosmos_<operation>) にも記録する。
+    """
+
+    __slots__ = ("tracker", "name", "operation", "span", "request_charge", "pages", "items")
+
+    def __init__(self, tracker, name, operation):
+        self.tracker = tracker
+        self.name = name
+        self.operation = operation
+        self.span = Span(f"cosmos_{operation}")
+        self.request_charge = 0.0
+        self.pages = 0
+        self.items = 0
+
+    @property
+    def outcome(self):
+        return self.span.outcome
+
+    @outcome.setter
+    def outcome(self, value):
+        self.span.outcome = value
+
+    def hook(self, pipeline_response):
+        headers = pipeline_response.http_response.headers
+        self.request_charge += float(headers.get("x-ms-request-charge") or 0)
+        self.pages += 1
+
+    def __enter__(self):
+        self.span.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is GeneratorExit:
+            # クエリ結果の途中で読むのをやめた場合は失敗として扱わない
+            exc_type = exc = tb = None
+        self.span.__exit__(exc_type, exc, tb)
+        self.tracker.record(self, time.perf_counter() - self.span.started_at)
+        return False
+
+
+class CosmosUsageTracker:
+    """
+    名前付きの操作 (クエリ) ごとに、回数・RU・時間・ページ数をプロセス内で集計する。
+
+    全ワーカーの合計は /metrics (oshietena_cosmos_*) で確認する。
+    """
+
+    def __init__(self, enabled=COSMOS_USAGE_TRACKING_ENABLED, slow_ms=COSMOS_SLOW_OPERATION_MS,
+                 expensive_ru=COSMOS_EXPENSIVE_OPERATION_RU):
+        self.enabled = enabled
+        self.slow_ms = slow_ms
+        self.expensive_ru = expensive_ru
+        self._totals = {}
+        self._lock = threading.Lock()
+
+    def track(self, name, operation):
+        return CosmosCall(self, name, operation)
+
+    def record(self, call, seconds):
+        if not self.enabled:
+            return
+        slow = seconds * 1000 >= self.slow_ms or call.request_charge >= self.expensive_ru
+        with self._lock:
+            totals = self._totals.get(call.name)
+            if totals is None:
+                totals = self._totals[call.name] = {
+                    "operation": call.operation, "calls": 0, "errors": 0, "slow": 0,
+                    "request_charge": 0.0, "max_request_charge": 0.0,
+                    "seconds": 0.0, "max_seconds": 0.0, "pages": 0, "items": 0,
+                }
+            totals["calls"] += 1
+            totals["errors"] += call.outcome == "error"
+            totals["slow"] += slow
+            totals["request_charge"] += call.request_charge
+            totals["max_request_charge"] = max(totals["max_request_charge"], call.request_charge)
+            totals["seconds"] += seconds
+            totals["max_seconds"] = max(totals["max_seconds"], seconds)
+            totals["pages"] += call.pages
+            totals["items"] += call.items
+        observe_cosmos(call.name, call.operation, call.request_charge, seconds, call.pages, slow)
+        if slow:
+            print(
+                f"🐢 Cosmos DB の遅い/高コストな操作: {call.name} ({call.operation}) "
+                f"{seconds * 1000:.0f}ms {call.request_charge:.2f}RU pages={call.pages} items={call.items} "
+                f"outcome={call.outcome}"
+            )
+
+    def stats(self):
+        """操作の名前ごとの集計を、合計 RU の多い順に返す。"""
+        with self._lock:
+            totals = {name: dict(values) for name, values in self._totals.items()}
+        for values in totals.values():
+            values["mean_request_charge"] = values["request_charge"] / values["calls"]
+            values["mean_ms"] = values["seconds"] * 1000 / values["calls"]
+        return dict(sorted(totals.items(), key=lambda item: item[1]["request_charge"], reverse=True))
+
+    def summary_lines(self):
+        """stats() を 1 操作 1 行の文字列にする (管理コマンドの実行結果の表示用)。"""
+        return [
+            f"{name} ({values['operation']}): {values['calls']} 回 / {values['request_charge']:.2f} RU "
+            f"(平均 {values['mean_request_charge']:.2f} RU, {values['mean_ms']:.0f}ms) / {values['pages']} ページ"
+            for name, values in self.stats().items()
+        ]
+
+    def reset(self):
+        with self._lock:
+            self._totals.clear()
+
+
+cosmos_usage_tracker = CosmosUsageTracker()
@@ -0,0 +1,212 @@
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+import numpy as np
+
+# ===============================
+# 埋め込みキャッシュの設定
+# ===============================
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+EMBEDDING_CACHE_ENABLED = os.environ.get("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+# プロセス内 LRU に保持する件数
+EMBEDDING_CACHE_MEMORY_SIZE = int(os.environ.get("EMBEDDING_CACHE_MEMORY_SIZE", 1024))
+# 永続層 (SQLite) のパス。空文字にすると永続層を使わない
+EMBEDDING_CACHE_PATH = os.environ.get(
+    "EMBEDDING_CACHE_PATH", os.path.join(BASE_DIR, "embedding_cache.sqlite3")
+)
+EMBEDDING_CACHE_TTL_SECONDS = int(os.environ.get("EMBEDDING_CACHE_TTL_SECONDS", 7 * 24 * 60 * 60))
+EMBEDDING_CACHE_MAX_ROWS = int(os.environ.get("EMBEDDING_CACHE_MAX_ROWS", 50000))
+# 何回の書き込みごとに永続層の期限切れ・上限超過分を削除するか
+EMBEDDING_CACHE_PRUNE_INTERVAL = 100
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_text(text):
+    """キャッシュキー用にテキストを正規化する (NFKC + 空白の統一)。"""
+    text = unicodedata.normalize("NFKC", text or "")
+    return _WHITESPACE_RE.sub(" ", text).strip()
+
+
+def make_cache_key(text, model):
+    """正規化テキストとモデル名からキャッシュキー (SHA-256) を作る。"""
+    payload = f"{model}\x00{normalize_text(text)}".encode("utf-8")
+    return hashlib.sha256(payload).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    埋め込みベクトルの 2 段キャッシュ。
+
+    1 段目はプロセス内の LRU、2 段目は gunicorn の各ワーカーで共有する
+    SQLite ファイル。どちらも TTL を持ち、件数の上限を超えた分は古い順に削除する。
+    """
+
+    def __init__(self, path, memory_size, ttl_seconds, max_rows, enabled=True):
+        self.enabled = enabled
+        self.path = path
+        self.memory_size = memory_size
+        self.ttl_seconds = ttl_seconds
+        self.max_rows = max_rows
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+        self._conn_pid = None
+        self._writes = 0
+        self._stats = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "evictions": 0,
+        }
+
+    # ---------- 永続層 ----------
+    def _connection(self):
+        # fork 後に親プロセスの接続を使い回さないよう PID を確認する
+        if self._conn is not None and self._conn_pid == os.getpid():
+            return self._conn
+        conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY,"
+            " model TEXT NOT NULL,"
+            " vector BLOB NOT NULL,"
+            " created_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_created_at ON embeddings (created_at)")
+        conn.commit()
+        self._conn = conn
+        self._conn_pid = os.getpid()
+        return conn
+
+    def _disk_get(self, key):
+        """(ベクトル, 保存した時刻) を返す。見つからなければ (None, None)。"""
+        if not self.path:
+            return None, None
+        try:
+            row = self._connection().execute(
+                "SELECT vector, created_at FROM embeddings WHERE key = ?", (key,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            print(f"Embedding cache read failed: {e}")
+            return None, None
+        if row is None:
+            return None, None
+        blob, created_at = row
+        if time.time() - created_at > self.ttl_seconds:
+            return None, None
+        return np.frombuffer(blob, dtype=np.float32), created_at
+
+    def _disk_set(self, key, model, vector):
+        if not self.path:
+            return
+        try:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO embeddings (key, model, vector, created_at) VALUES (?, ?, ?, ?)",
+                (key, model, vector.tobytes(), time.time()),
+            )
+            self._writes += 1
+            if self._writes % EMBEDDING_CACHE_PRUNE_INTERVAL == 0:
+                self._prune(conn)
+            conn.commit()
+        except sqlite3.Error as e:
+            print(f"Embedding cache write failed: {e}")
+
+    def _prune(self, conn):
+        expired = conn.execute(
+            "DELETE FROM embeddings WHERE created_at < ?", (time.time() - self.ttl_seconds,)
+        ).rowcount
+        overflow = conn.execute(
+            "DELETE FROM embeddings WHERE key IN ("
+            " SELECT key FROM embeddings ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_rows,),
+        ).rowcount
+        self._stats["evictions"] += max(expired, 0) + max(overflow, 0)
+
+    # ---------- メモリ層 ----------
+    def _memory_get(self, key):
+        entry = self._memory.get(key)
+        if entry is None:
+            return None
+        vector, created_at = entry
+        if time.time() - created_at > self.ttl_seconds:
+            del self._memory[key]
+            self._stats["evictions"] += 1
+            return None
+        self._memory.move_to_end(key)
+        return vector
+
+    def _memory_set(self, key, vector, created_at=None):
+        self._memory[key] = (vector, created_at or time.time())
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    # ---------- 公開 API ----------
+    def get(self, text, model):
+        """キャッシュ済みのベクトルを返す。見つからなければ None。"""
+        if not self.enabled:
+            return None
+        key = make_cache_key(text, model)
+        with self._lock:
+            vector = self._memory_get(key)
+            if vector is not None:
+                self._stats["memory_hits"] += 1
+                return vector.tolist()
+
+            vector, created_at = self._disk_get(key)
+            if vector is not None:
+                self._stats["disk_hits"] += 1
+                # 有効期限はディスクに保存した時刻から数える (メモリに載せ直しても延長しない)
+                self._memory_set(key, vector, created_at)
+                return vector.tolist()
+
+            self._stats["misses"] += 1
+            return None
+
+    def set(self, text, model, vector):
+        """ベクトルを両方の層に保存する。"""
+        if not self.enabled:
+            return
+        key = make_cache_key(text, model)
+        vector = np.asarray(vector, dtype=np.float32)
+        with self._lock:
+            self._memory_set(key, vector)
+            self._disk_set(key, model, vector)
+            self._stats["stores"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            if self.enabled and self.path:
+                conn = self._connection()
+                conn.execute("DELETE FROM embeddings")
+                conn.commit()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_entries"] = len(self._memory)
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        return stats
+
+
+embedding_cache = EmbeddingCache(
+    path=EMBEDDING_CACHE_PATH,
+    memory_size=EMBEDDING_CACHE_MEMORY_SIZE,
+    ttl_seconds=EMBEDDING_CACHE_TTL_SECONDS,
+    max_rows=EMBEDDING_CACHE_MAX_ROWS,
+    enabled=EMBEDDING_CACHE_ENABLED,
+)
@@ -0,0 +1,174 @@
+import os
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from openai import AsyncAzureOpenAI, AzureOpenAI
+from app.embedding_cache import embedding_cache
+from app.tokenizer import get_tokenizer
+
+# ===============================
+# 埋め込みサービスの設定
+# ===============================
+# text-embedding-3-large の 1 入力あたりの最大トークン数
+EMBEDDING_CHUNK_TOKENS = 8192
+# 1 回の embeddings.create に含める入力数の上限
+EMBEDDING_BATCH_SIZE = int(os.environ.get("EMBEDDING_BATCH_SIZE", 16))
+# バッチが複数に分かれた場合の同時リクエスト数
+EMBEDDING_MAX_CONCURRENCY = int(os.environ.get("EMBEDDING_MAX_CONCURRENCY", 4))
+
+
+class EmbeddingService:
+    """
+    埋め込み生成をまとめて扱うサービス。
+
+    AzureOpenAI クライアント (内部の HTTP コネクションプール) とトークナイザを
+    プロセス内で使い回し、長文のチャンクや複数テキストを 1 回のリクエストにまとめて送る。
+    """
+
+    def __init__(self, client_config, model, chunk_tokens=EMBEDDING_CHUNK_TOKENS,
+                 batch_size=EMBEDDING_BATCH_SIZE, max_concurrency=EMBEDDING_MAX_CONCURRENCY,
+                 cache=embedding_cache):
+        self.client_config = client_config
+        self.model = model
+        self.chunk_tokens = chunk_tokens
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+        self.cache = cache
+        self._client = None
+        self._async_client = None
+        self._client_lock = threading.Lock()
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    self._client = AzureOpenAI(**self.client_config)
+        return self._client
+
+    def split_into_chunks(self, text):
+        """テキストを chunk_tokens 以下のチャンクに分割する。"""
+        if not text:
+            return []
+        # 1 トークンは必ず 1 バイト以上なので、UTF-8 のバイト数が上限以下なら
+        # トークン化せずにそのまま 1 チャンクとして扱える
+        if len(text.encode("utf-8")) <= self.chunk_tokens:
+            return [text]
+
+        tokenizer = get_tokenizer()
+        tokens = tokenizer.encode(text)
+        return [
+            tokenizer.decode(tokens[i:i + self.chunk_tokens])
+            for i in range(0, len(tokens), self.chunk_tokens)
+        ]
+
+    def _request_batch(self, inputs):
+        response = self.client.embeddings.create(input=inputs, model=self.model)
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+    def _embed_chunks(self, chunks):
+        batches = [chunks[i:i + self.batch_size] for i in range(0, len(chunks), self.batch_size)]
+        if len(batches) == 1:
+            return self._request_batch(batches[0])
+
+        with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(batches))) as executor:
+            results = executor.map(self._request_batch, batches)
+        return [embedding for batch in results for embedding in batch]
+
+    def _lookup_cached(self, texts):
+        vectors = [None] * len(texts)
+        pending = {}
+        for i, text in enumerate(texts):
+            if not text:
+                continue
+            cached_vector = self.cache.get(text, self.model)
+            if cached_vector is not None:
+                vectors[i] = cached_vector
+            else:
+                # 同じテキストが複数含まれていても 1 回だけ埋め込む
+                pending.setdefault(text, []).append(i)
+        return vectors, pending
+
+    def _split_pending(self, pending):
+        chunk_owners = []
+        chunks = []
+        for text in pending:
+            for chunk in self.split_into_chunks(text):
+                chunk_owners.append(text)
+                chunks.append(chunk)
+        return chunk_owners, chunks
+
+    def _merge_embeddings(self, vectors, pending, chunk_owners, embeddings):
+        grouped = {}
+        for text, embedding in zip(chunk_owners, embeddings):
+            grouped.setdefault(text, []).append(embedding)
+
+        for text, chunk_vectors in grouped.items():
+            vector = np.mean(chunk_vectors, axis=0).tolist()
+            self.cache.set(text, self.model, vector)
+            for i in pending[text]:
+                vectors[i] = vector
+        return vectors
+
+    def embed_many(self, texts):
+        """
+        複数のテキストをベクトルに変換する。
+
+        キャッシュにないテキストの全チャンクをまとめて埋め込み、
+        テキストごとにチャンクのベクトルを平均したものを返す。
+
+        Args:
+            texts (list[str]): 変換するテキストのリスト
+
+        Returns:
+            list: 各テキストのベクトル (空文字の場合は None)
+        """
+        vectors, pending = self._lookup_cached(texts)
+        if not pending:
+            return vectors
+
+        chunk_owners, chunks = self._split_pending(pending)
+        embeddings = self._embed_chunks(chunks)
+        return self._merge_embeddings(vectors, pending, chunk_owners, embeddings)
+
+    def embed(self, text):
+        """1 件のテキストをベクトルに変換する。"""
+        return self.embed_many([text])[0]
+
+    # ---------- 非同期 API ----------
+    @property
+    def async_client(self):
+        if self._async_client is None:
+            self._async_client = AsyncAzureOpenAI(**self.client_config)
+        return self._async_client
+
+    async def _arequest_batch(self, inputs):
+        response = await self.async_client.embeddings.create(input=inputs, model=self.model)
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+    async def aembed_many(self, texts):
+        """
+        embed_many の非同期版。複数バッチは並行して送信する。
+
+        キャッシュの永続層 (SQLite) の読み書きはイベントループを止めないようスレッドで行う。
+        """
+        vectors, pending = await asyncio.to_thread(self._lookup_cached, texts)
+        if not pending:
+            return vectors
+
+        chunk_owners, chunks = self._split_pending(pending)
+        batches = [chunks[i:i + self.batch_size] for i in range(0, len(chunks), self.batch_size)]
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def request(batch):
+            async with semaphore:
+                return await self._arequest_batch(batch)
+
+        results = await asyncio.gather(*(request(batch) for batch in batches))
+        embeddings = [embedding for batch in results for embedding in batch]
+        return await asyncio.to_thread(self._merge_embeddings, vectors, pending, chunk_owners, embeddings)
+
+    async def aembed(self, text):
+        """embed の非同期版。"""
+        return (await self.aembed_many([text]))[0]
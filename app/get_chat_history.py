@@ -1,148 +1,220 @@
-from azure.cosmos import CosmosClient
 import os
+from datetime import datetime, timezone
 from azure.cosmos.exceptions import CosmosHttpResponseError
+from app.cosmos_repository import HISTORY_BOXES_BACKFILLED_TYPE, cosmos_repository
+from app.save_chat import HISTORY_BOX_TYPE, build_history_box_summary
 
-# --- Cosmos DB クライアント初期化コード ---
-ENDPOINT = os.environ.get("COSMOS_DB_ENDPOINT")
-KEY = os.environ.get("COSMOS_DB_KEY")
-DATABASE_NAME = os.environ.get("DATABASE_NAME")
-CONTAINER_NAME = os.environ.get("CONTAINER_NAME")
+# ===============================
+# ページングの設定
+# ===============================
+# 1 ページに返す件数の上限 (pageSize がこれより大きい場合は切り詰める)
+HISTORY_MAX_PAGE_SIZE = int(os.environ.get("HISTORY_MAX_PAGE_SIZE", 100))
 
-try:
-    client = CosmosClient(ENDPOINT, credential=KEY)
-    database = client.get_database_client(DATABASE_NAME)
-    container = database.get_container_client(CONTAINER_NAME)
-    print("Cosmos DB client initialized successfully in services.py.")
-except Exception as e:
-    print(f"Cosmos DB client initialization failed: {e}")
-    container = None
+# サマリーの作成 (バックフィル) が済んでいることを確認したユーザー。マーカーは削除しないため無効化は不要
+_backfilled_users = set()
 
 
-def fetch_history_for_user(user_id: str, history_box_id) -> list:
+class InvalidContinuationTokenError(ValueError):
+    """継続トークンが不正または期限切れの場合のエラー (クライアントには 400 を返す)。"""
+
+
+def query_history_page(query, parameters, user_id, page_size, continuation_token, name):
+    """
+    履歴を 1 ページ分クエリします。
+
+    Raises:
+        InvalidContinuationTokenError: Cosmos DB が継続トークンを受け付けなかった場合。
+    """
+    try:
+        return cosmos_repository.query_page(
+            query, parameters, user_id, min(page_size, HISTORY_MAX_PAGE_SIZE), continuation_token, name=name,
+        )
+    except CosmosHttpResponseError as e:
+        if continuation_token and e.status_code == 400:
+            raise InvalidContinuationTokenError(f"Invalid continuation token: {e.message}") from e
+        raise
+
+
+def fetch_history_for_user(user_id: str, history_box_id, page_size=None, continuation_token=None):
     """
     指定されたユーザーのチャット履歴（IDとタイトル）をデータベースから取得します。
+    save_chat で更新している historyBoxId ごとのサマリードキュメントを
+    ユーザーのパーティション内で 1 回だけクエリします。
 
     Args:
         user_id (str): 履歴を取得するユーザーのID。
+        page_size (int): 1 ページの件数。省略時は全件をリストで返す。
+        continuation_token (str): 前のページで返された継続トークン。
 
     Returns:
         list: チャット履歴のリスト。各要素は辞書型。
+        page_size を指定した場合は {"items": [...], "continuationToken": str or None}。
 
     Raises:
+        InvalidContinuationTokenError: 継続トークンが不正または期限切れの場合。
         Exception: データベース接続が利用できない場合や、クエリ実行中にエラーが発生した場合。
     """
-    if not container:
+    if not cosmos_repository.is_available():
         raise Exception("Database connection is not available.")
-    
-    # --- ステップ1: 各グループの最も古い日時を取得するクエリを実行 ---
-    query_step1 = """
-    SELECT c.id, c.title, c.historyBoxId, c.createdAt
+
+    # サマリーが揃っていないユーザーは、一覧を返す前に既存の会話から作成する
+    ensure_history_boxes(user_id)
+
+    query = """
+    SELECT c.firstConversationId AS id, c.title, c.historyBoxId
     FROM c
     WHERE c.userId = @userid
-    AND NOT IS_DEFINED(c.AvailableTerm)
+    AND c.type = @type
+    ORDER BY c.createdAt DESC
     """
 
-    parameters_step1 = [
-        {"name": "@userid", "value": user_id}
+    parameters = [
+        {"name": "@userid", "value": user_id},
+        {"name": "@type", "value": HISTORY_BOX_TYPE},
     ]
 
-    results_step1 = list(
-        container.query_items(
-            query=query_step1,
-            parameters=parameters_step1,
-            enable_cross_partition_query=True
-        )
-    )
+    try:
+        if page_size:
+            items, next_token = query_history_page(
+                query, parameters, user_id, page_size, continuation_token, name="history_boxes_page"
+            )
+            return {"items": items, "continuationToken": next_token}
+        return cosmos_repository.query(query, parameters, user_id, name="history_boxes")
+    except InvalidContinuationTokenError:
+        # 空のページを返すとクライアントが一覧の終わりと判断するため、呼び出し元で 400 にする
+        raise
+    except CosmosHttpResponseError as e:
+        # 特定の Cosmos DB エラーは無視し、空リストを返す
+        print(f"Cosmos DB query failed (ignored): {e}")
+        return {"items": [], "continuationToken": None} if page_size else []
+    except Exception as e:
+        print(f"Database query failed for user {user_id}: {e}")
+        raise
 
-    # ステップ1で結果がなければ、空のリストを返す
-    if not results_step1:
-        return []
 
-    # historyBoxId ごとに最古の createdAt を探す
-    history_box_map = {}
+def ensure_history_boxes(user_id: str) -> None:
+    """
+    ユーザーのサマリードキュメントが既存の会話から作成済みであることを保証します。
 
-    for item in results_step1:
-        if "historyBoxId" not in item or "createdAt" not in item:
-            continue
-        box_id = item["historyBoxId"]
-        created_at = item["createdAt"]
+    サマリーは保存時に作成・更新されるため、導入前の会話のサマリーはバックフィル
+    (backfill_history_boxes コマンド) で作成します。まだのユーザーは最初の一覧取得時に作成します。
+    """
+    if user_id in _backfilled_users:
+        return
+    marker = cosmos_repository.read_item(
+        HISTORY_BOXES_BACKFILLED_TYPE, user_id, name="history_boxes_backfilled_read"
+    )
+    if marker is None:
+        backfill_history_boxes(user_id)
+    _backfilled_users.add(user_id)
+
+
+def backfill_history_boxes(user_id: str) -> list:
+    """
+    ユーザーの全会話からサマリードキュメントを作り直し、バックフィル済みのマーカーを書き込みます。
 
-        if box_id not in history_box_map or created_at < history_box_map[box_id]["createdAt"]:
-            history_box_map[box_id] = {
-                "createdAt": created_at,  # 元の文字列も保持
-            }
+    導入後に保存された会話のサマリー (古い会話を含まない) も、全会話から数え直した値で上書きします。
 
-    # --- ステップ2: 最古の createdAt に一致するドキュメントを取得 ---
-    where_clauses = []
-    for box_id, info in history_box_map.items():
-        clause = f'(c.historyBoxId = "{box_id}" AND c.createdAt = "{info["createdAt"]}")'
-        where_clauses.append(clause)
+    Returns:
+        list: 作成したサマリードキュメントのリスト
+    """
+    boxes = scan_history_boxes(user_id)
+    for box in boxes:
+        cosmos_repository.upsert(box, name="history_box_backfill")
+    # マーカーは createdAt を持たないため、利用回数の COUNT や履歴の一覧には含まれない
+    cosmos_repository.upsert({
+        "id": HISTORY_BOXES_BACKFILLED_TYPE,
+        "type": HISTORY_BOXES_BACKFILLED_TYPE,
+        "userId": user_id,
+        "boxCount": len(boxes),
+        "backfilledAt": datetime.now(timezone.utc).isoformat(),
+    }, name="history_boxes_backfilled_upsert")
+    return boxes
+
+
+def scan_history_boxes(user_id: str) -> list:
+    """
+    ユーザーの全会話を読み、historyBoxId ごとのサマリー (最初の会話・件数など) を作ります。
+    バックフィルで使用します。
 
-    filter_condition = " OR ".join(where_clauses)
+    Args:
+        user_id (str): ユーザーID
 
-    query_step2 = f"""
-    SELECT c.id, c.title, c.historyBoxId
+    Returns:
+        list: サマリードキュメントのリスト (最初の会話の作成日時の新しい順)
+    """
+    query = """
+    SELECT c.id, c.title, c.historyBoxId, c.createdAt, c.tenantId
     FROM c
     WHERE c.userId = @userid
     AND NOT IS_DEFINED(c.AvailableTerm)
-    AND ({filter_condition})
-    ORDER BY c.createdAt DESC
+    AND (NOT IS_DEFINED(c.type) OR c.type != @type)
     """
-
-    parameters_step2 = [
-        {"name": "@userid", "value": user_id}
+    parameters = [
+        {"name": "@userid", "value": user_id},
+        {"name": "@type", "value": HISTORY_BOX_TYPE},
     ]
 
-    try:
-        items = list(
-            container.query_items(
-                query=query_step2,
-                parameters=parameters_step2,
-                partition_key=user_id
-            )
-        )
-        return items
-    except CosmosHttpResponseError as e:
-        # 特定の Cosmos DB エラーは無視し、空リストを返す
-        print(f"Cosmos DB query failed (ignored): {e}")
-        return []
-    except Exception as e:
-        print(f"Database query failed for user {user_id}: {e}")
-        raise
+    boxes = {}
+    for item in cosmos_repository.query(query, parameters, user_id, name="history_boxes_scan"):
+        if "historyBoxId" not in item or "createdAt" not in item:
+            continue
+        item["userId"] = user_id
+        box = boxes.get(item["historyBoxId"])
+        if box is None:
+            boxes[item["historyBoxId"]] = build_history_box_summary(item)
+            continue
+        box["messageCount"] += 1
+        if item["createdAt"] < box["createdAt"]:
+            # historyBoxId ごとに最古の会話をサマリーの代表にする
+            box.update({
+                "title": item.get("title"),
+                "firstConversationId": item["id"],
+                "createdAt": item["createdAt"],
+            })
+        box["updatedAt"] = max(box["updatedAt"], item["createdAt"])
+
+    return sorted(boxes.values(), key=lambda box: box["createdAt"], reverse=True)
 
 
-def fetch_single_chat_by_id(user_id, history_box_id):
+def fetch_single_chat_by_id(user_id, history_box_id, page_size=None, continuation_token=None):
     """
     指定ユーザーのチャット履歴から単一のチャットを取得する関数。
 
     Args:
         user_id: ユーザーID
         history_box_id: チャットの一塊
+        page_size: 1 ページの件数。省略時は全件を返す
+        continuation_token: 前のページで返された継続トークン
 
     Returns:
         list or None: チャット履歴のリストまたは None
+        page_size を指定した場合は {"items": [...], "continuationToken": str or None}
+        (最初のページが空なら None)
+
+    Raises:
+        InvalidContinuationTokenError: 継続トークンが不正または期限切れの場合。
     """
     try:
-        client = CosmosClient(ENDPOINT, credential=KEY)
-        db = client.get_database_client(DATABASE_NAME)
-        container = db.get_container_client(CONTAINER_NAME)
-
         query = """
         SELECT c.id, c.question, c.answer
         FROM c
         WHERE c.userId = @userId AND c.historyBoxId = @historyBoxId
         AND NOT IS_DEFINED(c.AvailableTerm)
+        AND (NOT IS_DEFINED(c.type) OR c.type != @type)
         ORDER BY c.createdAt DESC
         """
-        parameters = [{"name": "@userId", "value": user_id},{"name": "@historyBoxId", "value": history_box_id}]
+        parameters = [{"name": "@userId", "value": user_id},{"name": "@historyBoxId", "value": history_box_id},{"name": "@type", "value": HISTORY_BOX_TYPE}]
 
-        items = list(
-            container.query_items(
-                query=query,
-                parameters=parameters,
-                partition_key=user_id  
+        if page_size:
+            items, next_token = query_history_page(
+                query, parameters, user_id, page_size, continuation_token, name="history_chat_page"
             )
-        )
+            if not items and not continuation_token:
+                return None
+            return {"items": items, "continuationToken": next_token}
+
+        items = cosmos_repository.query(query, parameters, user_id, name="history_chat")
         print(items)
         return items if items else None
 
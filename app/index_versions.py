@@ -0,0 +1,86 @@
+import os
+import time
+import sqlite3
+import threading
+
+# ===============================
+# インデックスバージョンの設定
+# ===============================
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# gunicorn の全ワーカーで共有するバージョン管理用の SQLite ファイル
+INDEX_VERSION_DB_PATH = os.environ.get(
+    "INDEX_VERSION_DB_PATH", os.path.join(BASE_DIR, "index_versions.sqlite3")
+)
+# バージョンをファイルから読み直す間隔 (秒)
+INDEX_VERSION_CHECK_SECONDS = float(os.environ.get("INDEX_VERSION_CHECK_SECONDS", 5))
+
+
+class IndexVersionStore:
+    """
+    検索インデックスごとのバージョン番号。
+
+    再インジェスト後に bump() するとバージョンが変わり、
+    バージョンをキーに含むキャッシュ (検索結果・回答) が無効になる。
+    """
+
+    def __init__(self, path=INDEX_VERSION_DB_PATH, check_seconds=INDEX_VERSION_CHECK_SECONDS):
+        self.path = path
+        self.check_seconds = check_seconds
+        self._versions = {}
+        self._lock = threading.Lock()
+        self._conn = None
+        self._conn_pid = None
+
+    def _connection(self):
+        if self._conn is not None and self._conn_pid == os.getpid():
+            return self._conn
+        conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS index_versions ("
+            " index_name TEXT PRIMARY KEY,"
+            " version INTEGER NOT NULL)"
+        )
+        conn.commit()
+        self._conn = conn
+        self._conn_pid = os.getpid()
+        return conn
+
+    def get(self, index_name):
+        """インデックスの現在のバージョンを返す (未登録は 0)。"""
+        now = time.monotonic()
+        cached = self._versions.get(index_name)
+        if cached is not None and now - cached[1] < self.check_seconds:
+            return cached[0]
+
+        with self._lock:
+            try:
+                row = self._connection().execute(
+                    "SELECT version FROM index_versions WHERE index_name = ?", (index_name,)
+                ).fetchone()
+                version = row[0] if row else 0
+            except sqlite3.Error as e:
+                print(f"Index version read failed: {e}")
+                version = cached[0] if cached else 0
+            self._versions[index_name] = (version, now)
+            return version
+
+    def bump(self, index_name):
+        """バージョンを 1 つ進め、新しいバージョンを返す。"""
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT INTO index_versions (index_name, version) VALUES (?, 1)"
+                " ON CONFLICT(index_name) DO UPDATE SET version = version + 1",
+                (index_name,),
+            )
+            conn.commit()
+            version = conn.execute(
+                "SELECT version FROM index_versions WHERE index_name = ?", (index_name,)
+            ).fetchone()[0]
+            self._versions[index_name] = (version, time.monotonic())
+            return version
+
+
+index_versions = IndexVersionStore()
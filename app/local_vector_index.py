@@ -0,0 +1,167 @@
+import os
+import json
+import mmap
+import shutil
+import threading
+import numpy as np
+
+# ===============================
+# ローカルベクトルインデックスの設定
+# ===============================
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+LOCAL_INDEX_DIR = os.environ.get("LOCAL_INDEX_DIR", os.path.join(BASE_DIR, "local_indexes"))
+# ローカル検索を使うインデックス名 (カンマ区切り)。"*" でスナップショットがある全インデックス
+LOCAL_SEARCH_INDEXES = os.environ.get("LOCAL_SEARCH_INDEXES", "")
+
+VECTORS_FILE = "vectors.npy"
+CONTENT_FILE = "content.jsonl"
+OFFSETS_FILE = "offsets.npy"
+META_FILE = "meta.json"
+# float16 のスナップショットを検索する際に一度に float32 へ変換する行数
+SEARCH_BLOCK_ROWS = 1024
+
+
+class LocalVectorIndex:
+    """
+    メモリマップしたベクトル行列と、サイドカーのコンテンツファイルによるローカル検索。
+
+    ベクトルは正規化して保存しているため、内積がそのままコサイン類似度になる。
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, META_FILE), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.vectors = np.load(os.path.join(directory, VECTORS_FILE), mmap_mode="r")
+        self.offsets = np.load(os.path.join(directory, OFFSETS_FILE))
+        self._content_file = open(os.path.join(directory, CONTENT_FILE), "rb")
+        self._content = (
+            mmap.mmap(self._content_file.fileno(), 0, access=mmap.ACCESS_READ)
+            if os.path.getsize(os.path.join(directory, CONTENT_FILE)) else b""
+        )
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def _document(self, row):
+        return json.loads(self._content[self.offsets[row]:self.offsets[row + 1]])
+
+    def search(self, vector, k):
+        """ベクトルに近い上位 k 件のドキュメントを類似度の高い順に返す。"""
+        if len(self) == 0:
+            return []
+        query = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm:
+            query = query / norm
+        if self.vectors.dtype == np.float32:
+            scores = self.vectors @ query
+        else:
+            # float16 の行列積は遅いため、ブロックごとに float32 に変換して計算する
+            scores = np.concatenate([
+                np.asarray(self.vectors[i:i + SEARCH_BLOCK_ROWS], dtype=np.float32) @ query
+                for i in range(0, len(self.vectors), SEARCH_BLOCK_ROWS)
+            ])
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+
+        results = []
+        for row in top:
+            document = self._document(row)
+            document["@search.score"] = float(scores[row])
+            results.append(document)
+        return results
+
+    def close(self):
+        if isinstance(self._content, mmap.mmap):
+            self._content.close()
+        self._content_file.close()
+
+    @classmethod
+    def build(cls, directory, documents, vector_field="content_vector", dtype="float32"):
+        """
+        ドキュメントのイテレータからスナップショットを作成する。
+
+        一時ディレクトリに書き出してから差し替えるため、
+        作成中も既存のスナップショットで検索を続けられる。
+
+        Returns:
+            int: 保存したドキュメント数
+        """
+        tmp_directory = f"{directory}.tmp-{os.getpid()}"
+        shutil.rmtree(tmp_directory, ignore_errors=True)
+        os.makedirs(tmp_directory)
+
+        vectors = []
+        offsets = [0]
+        with open(os.path.join(tmp_directory, CONTENT_FILE), "wb") as content_file:
+            for document in documents:
+                vector = document.get(vector_field)
+                if not vector:
+                    continue
+                vector = np.asarray(vector, dtype=np.float32)
+                norm = np.linalg.norm(vector)
+                vectors.append(vector / norm if norm else vector)
+
+                fields = {
+                    key: value for key, value in document.items()
+                    if key != vector_field and not key.startswith("@")
+                }
+                content_file.write(json.dumps(fields, ensure_ascii=False).encode("utf-8"))
+                offsets.append(content_file.tell())
+
+        dimensions = len(vectors[0]) if vectors else 0
+        matrix = np.vstack(vectors).astype(dtype) if vectors else np.zeros((0, dimensions), dtype=dtype)
+        np.save(os.path.join(tmp_directory, VECTORS_FILE), matrix)
+        np.save(os.path.join(tmp_directory, OFFSETS_FILE), np.asarray(offsets, dtype=np.int64))
+        with open(os.path.join(tmp_directory, META_FILE), "w", encoding="utf-8") as f:
+            json.dump({"count": len(vectors), "dimensions": dimensions, "dtype": dtype}, f)
+
+        old_directory = f"{directory}.old-{os.getpid()}"
+        if os.path.exists(directory):
+            os.rename(directory, old_directory)
+        os.rename(tmp_directory, directory)
+        shutil.rmtree(old_directory, ignore_errors=True)
+        return len(vectors)
+
+
+class LocalIndexRegistry:
+    """読み込み済みのローカルインデックスを保持し、スナップショット更新時に読み直す。"""
+
+    def __init__(self, base_dir=LOCAL_INDEX_DIR, enabled_indexes=LOCAL_SEARCH_INDEXES):
+        self.base_dir = base_dir
+        names = [name.strip() for name in enabled_indexes.split(",") if name.strip()]
+        self.all_indexes = "*" in names
+        self.enabled_indexes = set(names) - {"*"}
+        self._indexes = {}
+        self._lock = threading.Lock()
+
+    def index_path(self, index_name):
+        return os.path.join(self.base_dir, index_name)
+
+    def is_enabled(self, index_name):
+        return self.all_indexes or index_name in self.enabled_indexes
+
+    def get(self, index_name):
+        """ローカル検索を使う設定でスナップショットがあれば LocalVectorIndex を返す。"""
+        if not self.is_enabled(index_name):
+            return None
+        meta_path = os.path.join(self.index_path(index_name), META_FILE)
+        try:
+            mtime = os.path.getmtime(meta_path)
+        except OSError:
+            return None
+
+        with self._lock:
+            loaded = self._indexes.get(index_name)
+            if loaded is not None and loaded[0] == mtime:
+                return loaded[1]
+            index = LocalVectorIndex(self.index_path(index_name))
+            self._indexes[index_name] = (mtime, index)
+            # 読み込み中の検索があり得るため、古いインデックスは明示的に閉じず GC に任せる
+            return index
+
+
+local_index_registry = LocalIndexRegistry()
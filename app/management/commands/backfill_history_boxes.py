@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from app.cosmos_repository import cosmos_repository
+from app.cosmos_usage import cosmos_usage_tracker
+from app.get_chat_history import backfill_history_boxes
+from app.save_chat import HISTORY_BOX_TYPE
+
+
+class Command(BaseCommand):
+    help = (
+        "既存の会話から、履歴一覧用のサマリードキュメント (historyBox) を作成します。"
+        "デプロイ時に実行してください (未実行のユーザーは最初の一覧取得時に作成します)。"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", action="append", dest="users", help="対象のユーザーID (複数指定可。省略時は全ユーザー)")
+
+    def handle(self, *args, **options):
+        user_ids = options["users"] or self._all_user_ids()
+        for user_id in user_ids:
+            boxes = backfill_history_boxes(user_id)
+            self.stdout.write(f"{user_id}: {len(boxes)} 件のサマリーを作成しました")
+        # 実行にかかった RU をクエリごとに表示する
+        for line in cosmos_usage_tracker.summary_lines():
+            self.stdout.write(line)
+        self.stdout.write(self.style.SUCCESS("完了しました"))
+
+    def _all_user_ids(self):
+        query = (
+            "SELECT DISTINCT VALUE c.userId FROM c "
+            "WHERE IS_DEFINED(c.historyBoxId) AND (NOT IS_DEFINED(c.type) OR c.type != @type)"
+        )
+        return list(cosmos_repository.query_cross_partition(
+            query, [{"name": "@type", "value": HISTORY_BOX_TYPE}], name="distinct_user_ids"
+        ))
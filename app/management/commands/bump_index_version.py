@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from app.search_result_cache import search_result_cache
+
+
+class Command(BaseCommand):
+    help = "再インジェスト後にインデックスのバージョンを進め、検索結果と回答のキャッシュを無効にします。"
+
+    def add_arguments(self, parser):
+        parser.add_argument("index_names", nargs="+", help="更新したインデックス名 (テナントの oid)")
+
+    def handle(self, *args, **options):
+        for index_name in options["index_names"]:
+            version = search_result_cache.invalidate(index_name)
+            self.stdout.write(self.style.SUCCESS(f"{index_name}: バージョン {version}"))
@@ -0,0 +1,68 @@
+import os
+import re
+import sys
+import json
+import subprocess
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# python -X importtime の出力行: "import time: self [us] | cumulative | imported package"
+IMPORT_TIME_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+DEFAULT_TARGETS = ["new_oshietena.urls", "app.warmup"]
+
+
+class Command(BaseCommand):
+    help = "アプリケーションの import 時間をモジュールごとに計測します (コールドスタートの確認用)。"
+
+    def add_arguments(self, parser):
+        parser.add_argument("targets", nargs="*", help=f"import するモジュール (既定: {' '.join(DEFAULT_TARGETS)})")
+        parser.add_argument("--top", type=int, default=25, help="表示するモジュール数")
+        parser.add_argument("--json", action="store_true", help="JSON で出力する (CI での比較用)")
+
+    def measure(self, targets):
+        """新しいプロセスで Django を起動して targets を import し、各モジュールの import 時間を返す。"""
+        code = "import django; django.setup()\n" + "".join(f"import {target}\n" for target in targets)
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get("DJANGO_SETTINGS_MODULE", "new_oshietena.settings"))
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", code],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+        )
+        if result.returncode != 0:
+            raise CommandError(f"import に失敗しました:\n{result.stderr[-2000:]}")
+
+        modules = []
+        for line in result.stderr.splitlines():
+            match = IMPORT_TIME_LINE.match(line)
+            if match:
+                self_us, cumulative_us, indent, name = match.groups()
+                modules.append({
+                    "module": name,
+                    "self_ms": int(self_us) / 1000,
+                    "cumulative_ms": int(cumulative_us) / 1000,
+                    "depth": (len(indent) - 1) // 2,
+                })
+        return modules
+
+    def handle(self, *args, **options):
+        targets = options["targets"] or DEFAULT_TARGETS
+        modules = self.measure(targets)
+        total_ms = sum(module["self_ms"] for module in modules)
+        top = sorted(modules, key=lambda module: module["cumulative_ms"], reverse=True)[:options["top"]]
+        # 自前のモジュールのみの合計 (サードパーティの import を除く)
+        own_ms = sum(module["self_ms"] for module in modules if module["module"].split(".")[0] in ("app", "new_oshietena"))
+
+        if options["json"]:
+            self.stdout.write(json.dumps({
+                "targets": targets,
+                "total_ms": round(total_ms, 1),
+                "own_ms": round(own_ms, 1),
+                "modules": len(modules),
+                "top": top,
+            }, ensure_ascii=False, indent=2))
+            return
+
+        self.stdout.write(f"import 対象: {', '.join(targets)}")
+        self.stdout.write(f"合計: {total_ms:.1f} ms ({len(modules)} モジュール, app/new_oshietena: {own_ms:.1f} ms)")
+        self.stdout.write(f"{'cumulative(ms)':>15} {'self(ms)':>10}  module")
+        for module in top:
+            self.stdout.write(f"{module['cumulative_ms']:>15.1f} {module['self_ms']:>10.1f}  {module['module']}")
@@ -0,0 +1,21 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from app.profiling import PROFILE_HEADER, request_profiler, sign_profile_request
+
+
+class Command(BaseCommand):
+    help = "リクエストのプロファイルを記録するための X-Profile-Request ヘッダーの値を作成します。"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="プロファイルを記録するリクエストのパス (例: /api/chat/)")
+        parser.add_argument("--ttl", type=int, default=600, help="ヘッダーの有効期間 (秒)")
+
+    def handle(self, *args, **options):
+        if not request_profiler.secret:
+            raise CommandError("PROFILING_SECRET が設定されていません。")
+        if not 0 < options["ttl"] <= request_profiler.max_token_ttl:
+            raise CommandError(f"--ttl は 1〜{request_profiler.max_token_ttl} 秒で指定してください。")
+        value = sign_profile_request(options["path"], time.time() + options["ttl"], request_profiler.secret)
+        if not request_profiler.enabled:
+            self.stderr.write(self.style.WARNING("PROFILING_ENABLED が true ではないため、サーバーは記録しません。"))
+        self.stdout.write(f"{PROFILE_HEADER}: {value}")
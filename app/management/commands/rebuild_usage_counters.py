@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from app.cosmos_repository import cosmos_repository
+from app.cosmos_usage import cosmos_usage_tracker
+from app.usage_counter import fetch_available_term, rebuild_usage_counter
+
+
+class Command(BaseCommand):
+    help = "会話ドキュメントを数え直して、利用期間ごとの利用回数カウンターを修復します。"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", action="append", dest="users", help="対象のユーザーID (複数指定可。省略時は利用期間を持つ全ユーザー)")
+
+    def handle(self, *args, **options):
+        user_ids = options["users"] or self._all_user_ids()
+        for user_id in user_ids:
+            term = fetch_available_term(user_id)
+            if not term:
+                self.stdout.write(self.style.WARNING(f"{user_id}: 利用期間が見つかりません"))
+                continue
+            count = rebuild_usage_counter(user_id, term)
+            self.stdout.write(f"{user_id}: {term['start']} - {term['end']} の利用回数 {count}")
+        # 実行にかかった RU をクエリごとに表示する
+        for line in cosmos_usage_tracker.summary_lines():
+            self.stdout.write(line)
+        self.stdout.write(self.style.SUCCESS("完了しました"))
+
+    def _all_user_ids(self):
+        query = "SELECT DISTINCT VALUE c.AvailableuserId FROM c WHERE IS_DEFINED(c.AvailableTerm)"
+        return list(cosmos_repository.query_cross_partition(query, name="distinct_user_ids"))
@@ -0,0 +1,41 @@
+import os
+import sys
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+GUNICORN_CONF = os.path.join(settings.BASE_DIR, "new_oshietena", "gunicorn_conf.py")
+
+
+class Command(BaseCommand):
+    help = "gunicorn で本番用サーバーを起動します (設定は new_oshietena/gunicorn_conf.py)。"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--mode", choices=["threads", "gevent", "asgi"], help="並行処理のモデル (SERVE_MODE)")
+        parser.add_argument("--bind", help="待ち受けるアドレス (SERVE_BIND)。例: 0.0.0.0:8000")
+        parser.add_argument("--workers", type=int, help="ワーカープロセス数 (WEB_CONCURRENCY)")
+        parser.add_argument("--threads", type=int, help="threads モードのワーカーあたりのスレッド数 (SERVE_THREADS)")
+        parser.add_argument("--no-preload", action="store_true", help="マスタープロセスでアプリケーションを読み込まない")
+
+    def handle(self, *args, **options):
+        overrides = {
+            "SERVE_MODE": options["mode"],
+            "SERVE_BIND": options["bind"],
+            "WEB_CONCURRENCY": options["workers"],
+            "SERVE_THREADS": options["threads"],
+            "SERVE_PRELOAD": "false" if options["no_preload"] else None,
+        }
+        env = dict(os.environ)
+        env.update({key: str(value) for key, value in overrides.items() if value is not None})
+
+        if env.get("SERVE_MODE") == "asgi":
+            try:
+                import uvicorn_worker  # noqa: F401
+            except ImportError:
+                raise CommandError("asgi モードには uvicorn-worker が必要です (pip install -r requirements.txt)")
+
+        argv = [sys.executable, "-m", "gunicorn", "-c", GUNICORN_CONF]
+        self.stdout.write(f"gunicorn を起動します: mode={env.get('SERVE_MODE', 'threads')}")
+        sys.stdout.flush()
+        # gunicorn のマスタープロセスに置き換える (シグナルをそのまま受け取れるように)
+        os.chdir(settings.BASE_DIR)
+        os.execvpe(sys.executable, argv, env)
@@ -0,0 +1,45 @@
+import os
+from django.core.management.base import BaseCommand, CommandError
+from app.ai_search_service import GET_COMPANY, search_client_registry
+from app.local_vector_index import LocalVectorIndex, local_index_registry
+from app.search_result_cache import search_result_cache
+
+
+class Command(BaseCommand):
+    help = "Azure AI Search のインデックスからローカル検索用のスナップショットを作成します。"
+
+    def add_arguments(self, parser):
+        parser.add_argument("index_names", nargs="+", help="スナップショットを作成するインデックス名 (テナントの oid)")
+        parser.add_argument(
+            "--dtype", choices=["float32", "float16"], default="float32",
+            help="ベクトルの保存形式。float16 はメモリが半分になる代わりに検索が遅くなる (既定: float32)",
+        )
+
+    def handle(self, *args, **options):
+        vector_field = GET_COMPANY["vector_fields"]
+        select_fields = GET_COMPANY["select_fields"] + [vector_field]
+        os.makedirs(local_index_registry.base_dir, exist_ok=True)
+
+        for index_name in options["index_names"]:
+            search_client = search_client_registry.get(index_name)
+            try:
+                # content_vector は retrievable に設定されている必要がある
+                documents = search_client.search(search_text="*", select=select_fields)
+                count = LocalVectorIndex.build(
+                    local_index_registry.index_path(index_name),
+                    documents,
+                    vector_field=vector_field,
+                    dtype=options["dtype"],
+                )
+            except Exception as e:
+                raise CommandError(f"{index_name} のスナップショット作成に失敗しました: {e}")
+
+            # 内容が変わった可能性があるため、検索結果・回答のキャッシュを無効にする
+            version = search_result_cache.invalidate(index_name)
+            self.stdout.write(self.style.SUCCESS(
+                f"{index_name}: {count} 件のドキュメントを保存しました (バージョン {version})"
+            ))
+            if not local_index_registry.is_enabled(index_name):
+                self.stdout.write(
+                    f"ローカル検索を使うには LOCAL_SEARCH_INDEXES に {index_name} を追加してください。"
+                )
@@ -0,0 +1,242 @@
+import os
+import time
+import hmac
+import contextvars
+from django.http import HttpResponse
+from django.urls import Resolver404, resolve
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, REGISTRY, generate_latest
+from prometheus_client import multiprocess
+
+# ===============================
+# メトリクスの設定
+# ===============================
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "true").lower() == "true"
+# /metrics は "Authorization: Bearer <トークン>" を付けたリクエストにだけ応答する
+# 未設定の場合は 404 を返す (レイテンシやインデックス名・クエリ名を公開しないため)
+METRICS_AUTH_TOKEN = os.environ.get("METRICS_AUTH_TOKEN")
+# true の場合、トークンを設定していなくても /metrics を認証なしで公開する (閉じたネットワーク内でのみ使う)
+METRICS_PUBLIC = os.environ.get("METRICS_PUBLIC", "false").lower() == "true"
+# gunicorn の複数ワーカーの値をまとめる場合に指定する (prometheus_client のマルチプロセスモード)
+PROMETHEUS_MULTIPROC_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+
+# 外部サービス (埋め込み・検索・Cosmos DB) の呼び出しと、LLM のストリームの両方を測れる範囲
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+REQUEST_DURATION = Histogram(
+    "oshietena_http_request_duration_seconds",
+    "レスポンスを返すまでの時間 (SSE の場合はヘッダーを返すまで)",
+    ["endpoint", "method"],
+    buckets=STAGE_BUCKETS,
+)
+REQUESTS = Counter(
+    "oshietena_http_requests_total",
+    "リクエスト数",
+    ["endpoint", "method", "status"],
+)
+STAGE_DURATION = Histogram(
+    "oshietena_stage_duration_seconds",
+    "処理段階 (埋め込み・検索・LLM・Cosmos DB など) ごとの所要時間",
+    ["endpoint", "stage", "outcome"],
+    buckets=STAGE_BUCKETS,
+)
+STAGE_ERRORS = Counter(
+    "oshietena_stage_errors_total",
+    "処理段階ごとの例外の数",
+    ["endpoint", "stage", "error"],
+)
+
+# Cosmos DB の名前付きの操作 (クエリ) ごとの RU・時間・ページ数
+COSMOS_RU_BUCKETS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000)
+COSMOS_REQUEST_UNITS = Histogram(
+    "oshietena_cosmos_request_units",
+    "Cosmos DB の操作 1 回あたりの消費 RU (クエリの場合は全ページの合計)",
+    ["query", "operation"],
+    buckets=COSMOS_RU_BUCKETS,
+)
+COSMOS_DURATION = Histogram(
+    "oshietena_cosmos_operation_duration_seconds",
+    "Cosmos DB の操作 1 回あたりの所要時間",
+    ["query", "operation"],
+    buckets=STAGE_BUCKETS,
+)
+COSMOS_PAGES = Counter(
+    "oshietena_cosmos_pages_total",
+    "Cosmos DB へのリクエスト数 (クエリのページ・リトライを含む)",
+    ["query", "operation"],
+)
+COSMOS_SLOW_OPERATIONS = Counter(
+    "oshietena_cosmos_slow_operations_total",
+    "時間または RU がしきい値を超えた Cosmos DB の操作の数",
+    ["query", "operation"],
+)
+
+# 非同期の書き込み (バッチ・write-behind) で、リトライしても書き込めずに破棄したアイテム
+DROPPED_WRITES = Counter(
+    "oshietena_dropped_writes_total",
+    "書き込めずに破棄したアイテムの数 (クライアントには成功を返している)",
+    ["writer", "reason"],
+)
+
+# 同時に実行中の同じ埋め込み・検索の呼び出しを 1 回にまとめた数 (app/single_flight.py)
+SINGLE_FLIGHT_CALLS = Counter(
+    "oshietena_single_flight_calls_total",
+    "埋め込み・検索の呼び出しの内訳 (leader: 実行した / coalesced: 実行中の結果を共有した / "
+    "lock_wait: 他のワーカーの実行を待った / wait_timeout: 待ちきれず自分で実行した)",
+    ["operation", "role"],
+)
+
+# 処理中のリクエストのエンドポイント (URL の name)。リクエスト外の処理は "background"
+current_endpoint = contextvars.ContextVar("metrics_endpoint", default="background")
+
+
+class Span:
+    """
+    with 文で囲んだ処理の時間を STAGE_DURATION に記録する。
+
+    例外が発生した場合の outcome は "error"。キャッシュのヒットなどは
+    ブロック内で span.outcome を書き換えて区別する。
+    """
+
+    __slots__ = ("stage", "endpoint", "outcome", "started_at")
+
+    def __init__(self, stage, endpoint=None):
+        self.stage = stage
+        self.endpoint = endpoint
+        self.outcome = "ok"
+        self.started_at = 0.0
+
+    def __enter__(self):
+        self.started_at = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if not METRICS_ENABLED:
+            return False
+        endpoint = self.endpoint or current_endpoint.get()
+        if exc_type is not None:
+            self.outcome = "error"
+            STAGE_ERRORS.labels(endpoint, self.stage, exc_type.__name__).inc()
+        STAGE_DURATION.labels(endpoint, self.stage, self.outcome).observe(time.perf_counter() - self.started_at)
+        return False
+
+
+def span(stage, endpoint=None):
+    return Span(stage, endpoint)
+
+
+def observe_stage(stage, seconds, outcome="ok", endpoint=None):
+    if METRICS_ENABLED:
+        STAGE_DURATION.labels(endpoint or current_endpoint.get(), stage, outcome).observe(seconds)
+
+
+def observe_cosmos(query, operation, request_charge, seconds, pages, slow):
+    if not METRICS_ENABLED:
+        return
+    COSMOS_REQUEST_UNITS.labels(query, operation).observe(request_charge)
+    COSMOS_DURATION.labels(query, operation).observe(seconds)
+    COSMOS_PAGES.labels(query, operation).inc(pages)
+    if slow:
+        COSMOS_SLOW_OPERATIONS.labels(query, operation).inc()
+
+
+def observe_dropped_writes(writer, reason, count=1):
+    if METRICS_ENABLED:
+        DROPPED_WRITES.labels(writer, reason).inc(count)
+
+
+def observe_single_flight(operation, role):
+    if METRICS_ENABLED:
+        SINGLE_FLIGHT_CALLS.labels(operation, role).inc()
+
+
+def _has_content(chunk):
+    return bool(chunk.choices and chunk.choices[0].delta and chunk.choices[0].delta.content)
+
+
+def time_stream(response, started_at):
+    """
+    LLM のストリームを包み、最初のトークンまでの時間 (llm_first_token) と
+    ストリーム全体の時間 (llm_stream) を記録する。
+
+    ストリームはビューが返った後に読まれるため、エンドポイントはここで確定させる。
+    """
+    endpoint = current_endpoint.get()
+
+    def iterate():
+        first_token = False
+        outcome = "ok"
+        try:
+            for chunk in response:
+                if not first_token and _has_content(chunk):
+                    first_token = True
+                    observe_stage("llm_first_token", time.perf_counter() - started_at, endpoint=endpoint)
+                yield chunk
+        except BaseException:
+            outcome = "error"
+            raise
+        finally:
+            observe_stage("llm_stream", time.perf_counter() - started_at, outcome, endpoint)
+
+    return iterate()
+
+
+def atime_stream(response, started_at):
+    """time_stream の非同期版。"""
+    endpoint = current_endpoint.get()
+
+    async def iterate():
+        first_token = False
+        outcome = "ok"
+        try:
+            async for chunk in response:
+                if not first_token and _has_content(chunk):
+                    first_token = True
+                    observe_stage("llm_first_token", time.perf_counter() - started_at, endpoint=endpoint)
+                yield chunk
+        except BaseException:
+            outcome = "error"
+            raise
+        finally:
+            observe_stage("llm_stream", time.perf_counter() - started_at, outcome, endpoint)
+
+    return iterate()
+
+
+def resolve_endpoint(path):
+    """パスに対応する URL の name を返す (ID を含むパスでもラベルの種類が増えないように)。"""
+    try:
+        match = resolve(path)
+    except Resolver404:
+        return "unmatched"
+    return match.url_name or match.view_name or "unnamed"
+
+
+def observe_request(endpoint, method, status_code, seconds):
+    if METRICS_ENABLED:
+        REQUEST_DURATION.labels(endpoint, method).observe(seconds)
+        REQUESTS.labels(endpoint, method, str(status_code)).inc()
+
+
+# ===============================
+# /metrics エンドポイント
+# ===============================
+def _registry():
+    if PROMETHEUS_MULTIPROC_DIR:
+        # 全ワーカーが書き出した値を集計する
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+
+def metrics_view(request):
+    """Prometheus のテキスト形式でメトリクスを返す。"""
+    if not METRICS_ENABLED:
+        return HttpResponse(status=404)
+    if METRICS_AUTH_TOKEN:
+        expected = f"Bearer {METRICS_AUTH_TOKEN}"
+        if not hmac.compare_digest(request.headers.get("Authorization", ""), expected):
+            return HttpResponse(status=401)
+    elif not METRICS_PUBLIC:
+        return HttpResponse(status=404)
+    return HttpResponse(generate_latest(_registry()), content_type=CONTENT_TYPE_LATEST)
@@ -1,7 +1,12 @@
 import os
 import json
-from openai import AzureOpenAI
+import time
+import queue
+import asyncio
+import threading
+from openai import AsyncAzureOpenAI, AzureOpenAI
 from django.http import JsonResponse
+from app.metrics import atime_stream, span, time_stream
 
 DEPLOYMENT = os.environ.get("DEPLOYMENT")
 
@@ -18,12 +23,31 @@ openai_client_config = {
     "api_version": AZURE_OPENAI_API_VERSION,
     "default_headers": {"Ocp-Apim-Subscription-Key": APIM_SUBSCRIPTION_KEY},
 }
-client = AzureOpenAI(**openai_client_config)
 deployment = DEPLOYMENT
 
-def handle_chatbot_response(messages, headers_for_apim):
-    
-    kwargs = {
+# クライアントは最初の利用時 (またはワーカーのウォームアップ時) に作成する
+_client = None
+_async_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = AzureOpenAI(**openai_client_config)
+    return _client
+
+def get_async_client():
+    global _async_client
+    if _async_client is None:
+        with _client_lock:
+            if _async_client is None:
+                _async_client = AsyncAzureOpenAI(**openai_client_config)
+    return _async_client
+
+def build_chat_kwargs(messages, headers_for_apim):
+    return {
         "messages": messages,
         "model": deployment,
         # "stream": False,
@@ -31,14 +55,216 @@ def handle_chatbot_response(messages, headers_for_apim):
         "temperature": 0,
         "extra_headers": headers_for_apim
     }
-    response = client.chat.completions.create(**kwargs)
-    return response
+
+def handle_chatbot_response(messages, headers_for_apim):
+    
+    kwargs = build_chat_kwargs(messages, headers_for_apim)
+    started_at = time.perf_counter()
+    with span("llm_request"):
+        response = get_client().chat.completions.create(**kwargs)
+    # 最初のトークンまでの時間とストリーム全体の時間を記録する
+    return time_stream(response, started_at)
+
+async def ahandle_chatbot_response(messages, headers_for_apim):
+    """handle_chatbot_response の非同期版 (AsyncAzureOpenAI を使用)。"""
+    kwargs = build_chat_kwargs(messages, headers_for_apim)
+    started_at = time.perf_counter()
+    with span("llm_request"):
+        response = await get_async_client().chat.completions.create(**kwargs)
+    return atime_stream(response, started_at)
+
+# 会話要約用のプロンプト
+SUMMARY_INSTRUCTION = (
+    "あなたは会話の要約者です。これまでの要約と新しいやり取りをもとに、"
+    "今後の回答に必要な事実・前提・ユーザーの意図を漏らさず、簡潔な日本語で要約してください。"
+)
+
+def build_summary_kwargs(previous_summary, messages, headers_for_apim, max_tokens):
+    transcript = "\n".join(f"{message.get('role')}: {message.get('content')}" for message in messages)
+    content = f"これまでの要約:\n{previous_summary}\n\n新しいやり取り:\n{transcript}" if previous_summary else transcript
+    return {
+        "messages": [
+            {"role": "system", "content": SUMMARY_INSTRUCTION},
+            {"role": "user", "content": content},
+        ],
+        "model": deployment,
+        "stream": False,
+        "temperature": 0,
+        "max_tokens": max_tokens,
+        "extra_headers": headers_for_apim
+    }
+
+def summarize_conversation(previous_summary, messages, headers_for_apim, max_tokens):
+    """古い会話を (前回の要約と合わせて) 要約した文字列を返す。"""
+    kwargs = build_summary_kwargs(previous_summary, messages, headers_for_apim, max_tokens)
+    with span("llm_summary"):
+        response = get_client().chat.completions.create(**kwargs)
+    return response.choices[0].message.content or ""
 #===============================================================================================
 # 以下ストリーミング回答用
-def stream_chatbot_response(messages, response):
+# true の場合、デルタを一定時間・一定サイズごとに 1 フレームにまとめて送る (チャンクごとの print もしない)
+SSE_COALESCE_ENABLED = os.environ.get("SSE_COALESCE_ENABLED", "false").lower() == "true"
+SSE_COALESCE_WINDOW_MS = int(os.environ.get("SSE_COALESCE_WINDOW_MS", 50))
+SSE_COALESCE_MAX_BYTES = int(os.environ.get("SSE_COALESCE_MAX_BYTES", 1024))
+
+# json.dumps(..., ensure_ascii=False) が文字列に使うエンコーダ (C 実装)
+_encode_json_string = json.encoder.encode_basestring
+
+def encode_sse_frame(content):
+    """{"content": ...} の SSE フレームを json.dumps と同じ形式で、辞書を作らずに組み立てる。"""
+    return 'data: {"content": ' + _encode_json_string(content) + '}\n\n'
+
+class SSECoalescer:
+    """
+    デルタをためて、最初のデルタから window_ms 経過するか max_bytes に達した時点で 1 フレームにする。
+    クライアントは content を連結して表示するため、受け取る回答全体は変わらない。
+
+    回答の最初のデルタは最初のバイトまでの時間を延ばさないよう、ためずにすぐフレームにする。
+    次のデルタが届かなくても timeout() の秒数が過ぎたら flush() で送る (モデルの出力が止まった場合)。
+    """
+
+    def __init__(self, window_ms=SSE_COALESCE_WINDOW_MS, max_bytes=SSE_COALESCE_MAX_BYTES):
+        self.window_seconds = window_ms / 1000
+        self.max_bytes = max_bytes
+        self.parts = []
+        self.size = 0
+        self.started_at = 0.0
+        self.sent = False
+
+    def add(self, content):
+        """デルタを追加する。フレームを送るタイミングであればフレームを返す。"""
+        if not self.parts:
+            self.started_at = time.monotonic()
+        self.parts.append(content)
+        self.size += len(content.encode("utf-8"))
+        if not self.sent or self.size >= self.max_bytes \
+                or time.monotonic() - self.started_at >= self.window_seconds:
+            return self.flush()
+        return None
+
+    def timeout(self):
+        """たまっているデルタを送るまでの秒数。なければ None (次のデルタまで待ってよい)。"""
+        if not self.parts:
+            return None
+        return max(self.started_at + self.window_seconds - time.monotonic(), 0.0)
+
+    def flush(self):
+        """たまっているデルタをフレームにして返す。なければ None。"""
+        if not self.parts:
+            return None
+        frame = encode_sse_frame("".join(self.parts))
+        self.parts = []
+        self.size = 0
+        self.sent = True
+        return frame
+
+def _delta_content(chunk):
+    if chunk.choices and chunk.choices[0].delta:
+        return chunk.choices[0].delta.content
+    return None
+
+_STREAM_END = object()
+
+def _read_stream(response, chunks, stopped):
+    try:
+        for chunk in response:
+            if stopped.is_set():
+                break
+            chunks.put(chunk)
+        chunks.put(_STREAM_END)
+    except BaseException as e:
+        chunks.put(e)
+    finally:
+        if stopped.is_set() and hasattr(response, "close"):
+            # クライアントが切断した場合は、LLM のストリームも閉じる
+            response.close()
+
+def _chunks_with_deadline(response, coalescer):
+    """
+    LLM のチャンクを返す。coalescer の送信期限までにチャンクが届かなければ None を返す。
+
+    同期のストリームは読み取りを待つ間に中断できないため、別スレッドで読む。
+    """
+    chunks = queue.Queue()
+    stopped = threading.Event()
+    reader = threading.Thread(
+        target=_read_stream, args=(response, chunks, stopped), name="sse-stream-reader", daemon=True
+    )
+    reader.start()
+    try:
+        while True:
+            try:
+                item = chunks.get(timeout=coalescer.timeout())
+            except queue.Empty:
+                yield None
+                continue
+            if item is _STREAM_END:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        # 途中で閉じられた場合は、読み取りスレッドを次のチャンクで終わらせる
+        stopped.set()
+
+async def _achunks_with_deadline(response, coalescer):
+    """_chunks_with_deadline の非同期版。待っている読み取りは期限が来てもキャンセルしない。"""
+    iterator = response.__aiter__()
+    pending = None
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(iterator.__anext__())
+            done, _ = await asyncio.wait({pending}, timeout=coalescer.timeout())
+            if not done:
+                yield None
+                continue
+            task, pending = pending, None
+            try:
+                chunk = task.result()
+            except StopAsyncIteration:
+                return
+            yield chunk
+    finally:
+        if pending is not None:
+            pending.cancel()
+
+def stream_coalesced_response(response, on_complete=None):
+    """stream_chatbot_response のフレームをまとめるモード。"""
+    try:
+        coalescer = SSECoalescer()
+        answer_parts = []
+        for chunk in _chunks_with_deadline(response, coalescer):
+            if chunk is None:
+                frame = coalescer.flush()
+            else:
+                content = _delta_content(chunk)
+                if not content:
+                    continue
+                answer_parts.append(content)
+                frame = coalescer.add(content)
+            if frame:
+                yield frame
+
+        frame = coalescer.flush()
+        if frame:
+            yield frame
+        if on_complete:
+            on_complete("".join(answer_parts))
+
+    except Exception as e:
+        print(f"【Python】エラー: ストリーム処理中に例外が発生しました: {e}")
+        yield f'data: {json.dumps({"error": "An error occurred on the server."})}\n\n'
+
+def stream_chatbot_response(messages, response, on_complete=None):
+    if SSE_COALESCE_ENABLED:
+        yield from stream_coalesced_response(response, on_complete)
+        return
+
     print("【Python】1. stream_chatbot_response 関数が開始されました") # ★追加
     try:
         chunk_count = 0
+        answer_parts = []
         for chunk in response:
             chunk_count += 1
             print(f"【Python】2. LLMからのチャンクを受信しました ({chunk_count}回目)") # ★追加
@@ -51,15 +277,58 @@ def stream_chatbot_response(messages, response):
             
             if delta.content:
                 print(f"【Python】3. contentをyieldします: '{delta.content}'") # ★追加
+                answer_parts.append(delta.content)
                 data = {"content": delta.content}
                 yield f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
             
             # (finish_reasonの処理などは省略)
 
         print(f"【Python】4. ループが正常に終了しました。総チャンク数: {chunk_count}") # ★追加
+        # 回答全体を受け取った後の処理 (キャッシュへの保存など)
+        if on_complete:
+            on_complete("".join(answer_parts))
 
     except Exception as e:
         print(f"【Python】エラー: ストリーム処理中に例外が発生しました: {e}") # ★追加
         # エラー発生をフロントに通知するのも有効
         yield f'data: {json.dumps({"error": "An error occurred on the server."})}\n\n'
-#===============================================================================================
\ No newline at end of file
+#===============================================================================================
+# 以下非同期ストリーミング回答用 (ASGI)
+async def astream_chatbot_response(messages, response, on_complete=None):
+    """stream_chatbot_response の非同期版。クライアントに送るデータ形式は同じ。"""
+    try:
+        coalescer = SSECoalescer() if SSE_COALESCE_ENABLED else None
+        answer_parts = []
+        chunks = _achunks_with_deadline(response, coalescer) if coalescer else response
+        async for chunk in chunks:
+            if chunk is None:
+                frame = coalescer.flush()
+            else:
+                content = _delta_content(chunk)
+                if not content:
+                    continue
+                answer_parts.append(content)
+                frame = coalescer.add(content) if coalescer else encode_sse_frame(content)
+            if frame:
+                yield frame
+
+        frame = coalescer.flush() if coalescer else None
+        if frame:
+            yield frame
+        if on_complete:
+            on_complete("".join(answer_parts))
+
+    except Exception as e:
+        print(f"【Python】エラー: 非同期ストリーム処理中に例外が発生しました: {e}")
+        yield f'data: {json.dumps({"error": "An error occurred on the server."})}\n\n'
+#===============================================================================================
+# 以下キャッシュ済み回答の再生用
+def stream_cached_answer(answer):
+    """キャッシュ済みの回答を stream_chatbot_response と同じ SSE 形式で返す。"""
+    yield encode_sse_frame(answer)
+
+async def astream_cached_answer(answer):
+    """stream_cached_answer の非同期版。"""
+    for frame in stream_cached_answer(answer):
+        yield frame
+#===============================================================================================
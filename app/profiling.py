@@ -0,0 +1,214 @@
+import os
+import time
+import hmac
+import uuid
+import hashlib
+import cProfile
+import threading
+from collections import deque
+
+# ===============================
+# リクエスト単位のプロファイリングの設定
+# ===============================
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROFILING_ENABLED = os.environ.get("PROFILING_ENABLED", "false").lower() == "true"
+# X-Profile-Request ヘッダーの署名鍵。未設定の場合はプロファイリングを行わない
+PROFILING_SECRET = os.environ.get("PROFILING_SECRET")
+PROFILE_DIR = os.environ.get("PROFILE_DIR", os.path.join(BASE_DIR, "profiles"))
+# PROFILING_RATE_WINDOW_SECONDS の間にプロセスごとに記録する最大件数
+PROFILING_MAX_PROFILES = int(os.environ.get("PROFILING_MAX_PROFILES", 10))
+PROFILING_RATE_WINDOW_SECONDS = int(os.environ.get("PROFILING_RATE_WINDOW_SECONDS", 3600))
+# 1 件のプロファイルを記録し続ける最大秒数 (SSE のストリームを含む)
+PROFILING_MAX_SECONDS = float(os.environ.get("PROFILING_MAX_SECONDS", 120))
+# 保存しておく .prof ファイルの最大数。超えた分は古いものから削除する
+PROFILING_MAX_FILES = int(os.environ.get("PROFILING_MAX_FILES", 200))
+# 署名の有効期限として受け付ける最大秒数 (長期間使える署名を作らせない)
+PROFILING_MAX_TOKEN_TTL_SECONDS = int(os.environ.get("PROFILING_MAX_TOKEN_TTL_SECONDS", 3600))
+
+PROFILE_HEADER = "X-Profile-Request"
+# プロファイリングの対象 (ChatView・ChatHistoryView・ChatCountView の URL の name)
+PROFILED_ENDPOINTS = {
+    "chat", "chat_async", "chat_history", "get_single_chat", "checkcount", "get_startday", "usage",
+}
+
+
+def sign_profile_request(path, expires_at, secret=PROFILING_SECRET):
+    """パスと有効期限 (UNIX 時刻) に対する X-Profile-Request ヘッダーの値を返す。"""
+    signature = hmac.new(secret.encode("utf-8"), f"{int(expires_at)}:{path}".encode("utf-8"), hashlib.sha256)
+    return f"{int(expires_at)}:{signature.hexdigest()}"
+
+
+class ProfileSession:
+    """1 件のリクエストのプロファイル。ストリームが終わるまで (または上限の秒数まで) 記録する。"""
+
+    def __init__(self, profiler, endpoint, path):
+        self.profiler = profiler
+        self.endpoint = endpoint
+        self.path = path
+        self.profile_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{endpoint}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.started_at = time.monotonic()
+        self._profile = cProfile.Profile()
+        self._finished = False
+
+    def start(self):
+        self._profile.enable()
+
+    def expired(self):
+        return time.monotonic() - self.started_at > self.profiler.max_seconds
+
+    def finish(self):
+        """記録を止めてファイルに保存する。複数回呼ばれても 1 回だけ保存する。"""
+        if self._finished:
+            return
+        self._finished = True
+        self._profile.disable()
+        try:
+            self.profiler.save(self)
+        finally:
+            self.profiler.release()
+
+    def wrap_stream(self, streaming_content):
+        """StreamingHttpResponse のジェネレータを、最後まで読まれるまで記録し続けるよう包む。"""
+
+        def iterate():
+            try:
+                for chunk in streaming_content:
+                    if self.expired():
+                        self.finish()
+                    yield chunk
+            finally:
+                self.finish()
+
+        return iterate()
+
+    def wrap_async_stream(self, streaming_content):
+        """wrap_stream の非同期版 (ASGI)。"""
+
+        async def iterate():
+            try:
+                async for chunk in streaming_content:
+                    if self.expired():
+                        self.finish()
+                    yield chunk
+            finally:
+                self.finish()
+
+        return iterate()
+
+
+class RequestProfiler:
+    """
+    署名付きのヘッダーを付けたリクエストだけを cProfile で記録し、.prof ファイルに保存する。
+
+    cProfile (Python 3.12 以降は sys.monitoring) は同時に 1 つしか動かせないため、
+    プロセスごとに同時に 1 件、一定時間あたり max_profiles 件までに制限する。
+    保存したファイルは snakeviz・gprof2dot・flameprof などで可視化できる。
+    """
+
+    def __init__(self, enabled=PROFILING_ENABLED, secret=PROFILING_SECRET, directory=PROFILE_DIR,
+                 max_profiles=PROFILING_MAX_PROFILES, window_seconds=PROFILING_RATE_WINDOW_SECONDS,
+                 max_seconds=PROFILING_MAX_SECONDS, max_files=PROFILING_MAX_FILES,
+                 max_token_ttl=PROFILING_MAX_TOKEN_TTL_SECONDS):
+        self.enabled = enabled and bool(secret)
+        self.secret = secret
+        self.directory = directory
+        self.max_profiles = max_profiles
+        self.window_seconds = window_seconds
+        self.max_seconds = max_seconds
+        self.max_files = max_files
+        self.max_token_ttl = max_token_ttl
+        self._active = threading.Lock()
+        self._lock = threading.Lock()
+        self._started = deque()
+        self._stats = {"profiles": 0, "rejected_signature": 0, "rate_limited": 0, "busy": 0, "failed": 0}
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def verify(self, header_value, path):
+        try:
+            expires_at = int(header_value.split(":", 1)[0])
+        except ValueError:
+            return False
+        now = time.time()
+        if not now < expires_at <= now + self.max_token_ttl:
+            return False
+        expected = sign_profile_request(path, expires_at, self.secret)
+        return hmac.compare_digest(header_value, expected)
+
+    def _acquire_slot(self):
+        now = time.monotonic()
+        with self._lock:
+            while self._started and now - self._started[0] > self.window_seconds:
+                self._started.popleft()
+            if len(self._started) >= self.max_profiles:
+                self._stats["rate_limited"] += 1
+                return False
+            if not self._active.acquire(blocking=False):
+                self._stats["busy"] += 1
+                return False
+            self._started.append(now)
+        return True
+
+    def release(self):
+        self._active.release()
+
+    def start(self, request, endpoint):
+        """
+        リクエストがプロファイリングの対象であれば記録を開始した ProfileSession を返す。
+
+        ヘッダーがない・署名が正しくない・上限に達している場合は None。
+        """
+        if not self.enabled or endpoint not in PROFILED_ENDPOINTS:
+            return None
+        header_value = request.headers.get(PROFILE_HEADER)
+        if not header_value:
+            return None
+        if not self.verify(header_value, request.path):
+            self._count("rejected_signature")
+            return None
+        if not self._acquire_slot():
+            return None
+
+        session = ProfileSession(self, endpoint, request.path)
+        try:
+            session.start()
+        except ValueError as e:
+            # デバッガなど、別のプロファイラが動いている場合
+            print(f"⚠️ プロファイリングを開始できませんでした: {e}")
+            self._count("failed")
+            self.release()
+            return None
+        return session
+
+    def save(self, session):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, f"{session.profile_id}.prof")
+            session._profile.dump_stats(path)
+            self._count("profiles")
+            print(f"🔬 プロファイルを保存しました: {path} ({session.path}, {time.monotonic() - session.started_at:.2f}s)")
+            self._prune()
+        except OSError as e:
+            self._count("failed")
+            print(f"⚠️ プロファイルを保存できませんでした: {e}")
+
+    def _prune(self):
+        files = sorted(
+            (entry for entry in os.scandir(self.directory) if entry.name.endswith(".prof")),
+            key=lambda entry: entry.stat().st_mtime,
+        )
+        for entry in files[:max(len(files) - self.max_files, 0)]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+
+request_profiler = RequestProfiler()
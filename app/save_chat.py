@@ -1,23 +1,11 @@
-import os
+import atexit
 import datetime
 from datetime import datetime, timezone
-from azure.cosmos import CosmosClient, exceptions
+from azure.cosmos import exceptions
 import jwt  
-
-# --- Cosmos DB 初期化コード ---
-ENDPOINT = os.environ.get("COSMOS_DB_ENDPOINT")
-KEY = os.environ.get("COSMOS_DB_KEY")
-DATABASE_NAME = os.environ.get("DATABASE_NAME")
-CONTAINER_NAME = os.environ.get("CONTAINER_NAME")
-
-try:
-    client = CosmosClient(ENDPOINT, credential=KEY)
-    database = client.get_database_client(DATABASE_NAME)
-    container = database.get_container_client(CONTAINER_NAME)
-    print("Cosmos DB client initialized successfully in services.py.")
-except Exception as e:
-    print(f"Cosmos DB client initialization failed: {e}")
-    container = None
+from app.cosmos_repository import HISTORY_BOX_TYPE, cosmos_repository
+from app.usage_counter import increment_usage_count
+from app.cosmos_batch_writer import COSMOS_BATCH_WRITES_ENABLED, CosmosBatchWriter
 
 
 def create_new_conversation(
@@ -47,7 +35,7 @@ def create_new_conversation(
         Exception: DB接続不可、またはアイテム作成中にエラーが発生した場合
     """
 
-    if not container:
+    if not cosmos_repository.is_available():
         raise Exception("Database connection is not available.")
 
     new_item = {
@@ -62,13 +50,113 @@ def create_new_conversation(
         "type": "conversation",
     }
 
+    if COSMOS_BATCH_WRITES_ENABLED:
+        # バッチでまとめて作成する。サマリーとカウンターは作成後にまとめて更新する
+        conversation_writer.submit(user_id, new_item)
+        return new_item
+
     try:
-        created_item = container.create_item(body=new_item)
-        return created_item
+        created_item = cosmos_repository.create(new_item, name="conversation_create")
     except Exception as e:
         print("❌ チャット保存失敗:", e)
         raise
 
+    after_conversations_created(user_id, [new_item])
+    return created_item
+
+
+def after_conversations_created(user_id: str, items: list) -> None:
+    """
+    作成した会話 (同じユーザーの 1 件以上) に合わせて、履歴サマリーと利用回数を更新します。
+    同じ historyBoxId の会話はまとめて 1 回の patch にします。
+
+    Args:
+        user_id (str): ユーザーID (パーティションキー)
+        items (list): 作成した会話アイテムのリスト (作成順)
+    """
+    boxes = {}
+    for item in items:
+        boxes.setdefault(item.get("historyBoxId"), []).append(item)
+    for box_items in boxes.values():
+        try:
+            update_history_box_summary(box_items[0], len(box_items), box_items[-1]["createdAt"])
+        except Exception as e:
+            # 会話自体は保存済みのため、サマリーの更新失敗では例外にしない
+            print("❌ 履歴サマリー更新失敗:", e)
+
+    try:
+        increment_usage_count(user_id, items[-1]["createdAt"], len(items))
+    except Exception as e:
+        # 利用回数は rebuild_usage_counters で修復できるため、例外にしない
+        print("❌ 利用回数カウンター更新失敗:", e)
+
+
+conversation_writer = CosmosBatchWriter(on_committed=after_conversations_created)
+atexit.register(conversation_writer.flush)
+
+
+def save_conversation_once(**kwargs) -> None:
+    """
+    create_new_conversation と同じ引数で会話を保存します。
+    同じ conversationId の会話が保存済みの場合 (リトライ時など) は何もしません。
+    """
+    try:
+        create_new_conversation(**kwargs)
+    except exceptions.CosmosResourceExistsError:
+        print(f"会話 {kwargs.get('conversation_id')} は保存済みです")
+
+
+def history_box_summary_id(history_box_id: str) -> str:
+    """historyBoxId に対応するサマリードキュメントの ID を返します。"""
+    return f"{HISTORY_BOX_TYPE}-{history_box_id}"
+
+
+def build_history_box_summary(item: dict, message_count: int = 1) -> dict:
+    """会話アイテム (チャットの一塊の最初の会話) からサマリードキュメントを作ります。"""
+    return {
+        "id": history_box_summary_id(item["historyBoxId"]),
+        "type": HISTORY_BOX_TYPE,
+        "tenantId": item.get("tenantId"),
+        "userId": item["userId"],
+        "historyBoxId": item["historyBoxId"],
+        "title": item.get("title"),
+        "firstConversationId": item["id"],
+        "createdAt": item["createdAt"],
+        "updatedAt": item["createdAt"],
+        "messageCount": message_count,
+    }
+
+
+def update_history_box_summary(item: dict, message_count: int = 1, updated_at: str = None) -> None:
+    """
+    (ユーザー, historyBoxId) ごとのサマリードキュメントを作成または更新します。
+    履歴一覧はこのサマリーだけを読むため、会話数が増えても一覧取得のコストは変わりません。
+
+    Args:
+        item (dict): 保存した会話アイテム (複数の場合は最初のもの)
+        message_count (int): 保存した会話の数
+        updated_at (str): 最後に保存した会話の createdAt (省略時は item の createdAt)
+    """
+    if not item.get("historyBoxId"):
+        return
+
+    updated_at = updated_at or item["createdAt"]
+    summary_id = history_box_summary_id(item["historyBoxId"])
+    patch_operations = [
+        {"op": "incr", "path": "/messageCount", "value": message_count},
+        {"op": "set", "path": "/updatedAt", "value": updated_at},
+    ]
+    try:
+        cosmos_repository.patch(summary_id, item["userId"], patch_operations, name="history_box_update")
+    except exceptions.CosmosResourceNotFoundError:
+        try:
+            summary = build_history_box_summary(item, message_count)
+            summary["updatedAt"] = updated_at
+            cosmos_repository.create(summary, name="history_box_create")
+        except exceptions.CosmosResourceExistsError:
+            # 同時に作成された場合は、作成済みのサマリーを更新する
+            cosmos_repository.patch(summary_id, item["userId"], patch_operations, name="history_box_update")
+
 
 def handle_msal_callback(id_token_str: str) -> dict:
     """
@@ -98,7 +186,7 @@ def handle_msal_callback(id_token_str: str) -> dict:
     if not tenant_id or not user_oid:
         raise ValueError("トークンに必要な情報が含まれていません。")
 
-    if container is None:
+    if not cosmos_repository.is_available():
         raise ConnectionError("データベースコンテナに接続できません。サーバーの構成を確認してください。")
 
     # ユーザー情報のUpsert (初回登録または更新)
@@ -111,6 +199,6 @@ def handle_msal_callback(id_token_str: str) -> dict:
         "created_at": datetime.utcnow().isoformat(),
     }
 
-    container.upsert_item(body=user_item)
+    cosmos_repository.upsert(user_item, name="user_upsert")
 
     return {"status": "success", "userId": user_oid, "tenantId": tenant_id}
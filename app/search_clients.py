@@ -0,0 +1,201 @@
+import os
+import asyncio
+import threading
+from collections import OrderedDict
+import requests
+from requests.adapters import HTTPAdapter
+from azure.core.credentials import AzureKeyCredential
+from azure.core.pipeline.transport import RequestsTransport
+from azure.search.documents import SearchClient
+
+# ===============================
+# SearchClient レジストリの設定
+# ===============================
+# 保持するインデックス (テナント) ごとのクライアント数の上限
+SEARCH_CLIENT_MAX_INDEXES = int(os.environ.get("SEARCH_CLIENT_MAX_INDEXES", 256))
+# 共有トランスポートのコネクションプールの大きさ
+SEARCH_CLIENT_POOL_MAXSIZE = int(os.environ.get("SEARCH_CLIENT_POOL_MAXSIZE", 32))
+
+
+class SearchClientRegistry:
+    """
+    インデックス名ごとの SearchClient を使い回すレジストリ。
+
+    全クライアントは 1 つの keep-alive な requests.Session を共有するため、
+    Azure AI Search への TLS ハンドシェイクはコネクションプールの分だけで済む。
+    上限を超えた場合は最も長く使われていないインデックスのクライアントを破棄する。
+    """
+
+    def __init__(self, endpoint, api_key, max_clients=SEARCH_CLIENT_MAX_INDEXES,
+                 pool_maxsize=SEARCH_CLIENT_POOL_MAXSIZE):
+        self.endpoint = endpoint
+        self.api_key = api_key
+        self.max_clients = max_clients
+        self.pool_maxsize = pool_maxsize
+        self._clients = OrderedDict()
+        self._lock = threading.Lock()
+        self._session = None
+        # https:// と http:// に同じアダプタをマウントしているため、統計はこのアダプタだけから数える
+        self._adapter = None
+        self._transport = None
+        self._credential = None
+        self._pid = None
+        self._stats = {"hits": 0, "creates": 0, "evictions": 0}
+
+    def _ensure_transport(self):
+        # fork 後は親プロセスのソケットを共有しないよう作り直す
+        if self._transport is not None and self._pid == os.getpid():
+            return
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.pool_maxsize)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        self._session = session
+        self._adapter = adapter
+        self._transport = RequestsTransport(session=session, session_owner=False)
+        self._credential = AzureKeyCredential(self.api_key)
+        self._clients.clear()
+        self._pid = os.getpid()
+
+    def _create_client(self, index_name):
+        return SearchClient(
+            endpoint=self.endpoint,
+            index_name=index_name,
+            credential=self._credential,
+            transport=self._transport,
+        )
+
+    def warmup(self):
+        """共有トランスポートを事前に作成する (ワーカー起動時のウォームアップ用)。"""
+        with self._lock:
+            self._ensure_transport()
+
+    def get(self, index_name):
+        """インデックス名に対応する SearchClient を返す。なければ作成する。"""
+        with self._lock:
+            self._ensure_transport()
+            client = self._clients.get(index_name)
+            if client is not None:
+                self._clients.move_to_end(index_name)
+                self._stats["hits"] += 1
+                return client
+
+            client = self._create_client(index_name)
+            self._clients[index_name] = client
+            self._stats["creates"] += 1
+            while len(self._clients) > self.max_clients:
+                # トランスポートは共有しているため、クライアント自体は close しない
+                self._clients.popitem(last=False)
+                self._stats["evictions"] += 1
+            return client
+
+    def _connection_stats(self):
+        connections = 0
+        requests_sent = 0
+        if self._adapter is None:
+            return connections, requests_sent
+        pools = self._adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            connections += pool.num_connections
+            requests_sent += pool.num_requests
+        return connections, requests_sent
+
+    def stats(self):
+        """クライアントの再利用状況と、新規接続数 / リクエスト数を返す。"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["clients"] = len(self._clients)
+            connections, requests_sent = self._connection_stats()
+        stats["connections_opened"] = connections
+        stats["requests_sent"] = requests_sent
+        # 1 リクエストあたりの新規接続数。0 に近いほど接続が再利用されている
+        stats["connections_per_request"] = connections / requests_sent if requests_sent else 0.0
+        return stats
+
+    def close(self):
+        with self._lock:
+            self._clients.clear()
+            if self._session is not None:
+                self._session.close()
+            self._session = None
+            self._adapter = None
+            self._transport = None
+
+
+class AsyncSearchClientRegistry(SearchClientRegistry):
+    """
+    非同期版の SearchClient レジストリ。
+
+    クライアントは 1 つの aiohttp.ClientSession を共有する。セッションは
+    イベントループに結び付くため、実行中のループが変わった場合は作り直す。
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._loop = None
+        self._connections_opened = 0
+        self._requests_sent = 0
+
+    def _ensure_transport(self):
+        loop = asyncio.get_running_loop()
+        if self._transport is not None and self._loop is loop:
+            return
+
+        # aiohttp は非同期版でしか使わないため、WSGI のワーカーでは import しない
+        import aiohttp
+        from azure.core.pipeline.transport import AioHttpTransport
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_connection_create_end.append(self._on_connection_created)
+        trace_config.on_request_start.append(self._on_request_start)
+        session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.pool_maxsize, keepalive_timeout=60),
+            trace_configs=[trace_config],
+        )
+        if self._session is not None:
+            self._close_session(self._session, self._loop)
+        self._session = session
+        self._transport = AioHttpTransport(session=session, session_owner=False)
+        self._credential = AzureKeyCredential(self.api_key)
+        self._clients.clear()
+        self._loop = loop
+
+    @staticmethod
+    def _close_session(session, loop):
+        """前のイベントループで作ったセッションを、そのループ上で閉じる。"""
+        if loop.is_closed():
+            # ループを閉じた時点でソケットも閉じられているため、コネクタを閉じた状態にするだけでよい
+            session.detach()
+            return
+        asyncio.run_coroutine_threadsafe(session.close(), loop)
+
+    async def _on_connection_created(self, session, context, params):
+        self._connections_opened += 1
+
+    async def _on_request_start(self, session, context, params):
+        self._requests_sent += 1
+
+    def _create_client(self, index_name):
+        from azure.search.documents.aio import SearchClient as AsyncSearchClient
+
+        return AsyncSearchClient(
+            endpoint=self.endpoint,
+            index_name=index_name,
+            credential=self._credential,
+            transport=self._transport,
+        )
+
+    def _connection_stats(self):
+        return self._connections_opened, self._requests_sent
+
+    async def aclose(self):
+        with self._lock:
+            self._clients.clear()
+            session = self._session
+            self._session = None
+            self._transport = None
+        if session is not None:
+            await session.close()
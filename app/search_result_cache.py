@@ -0,0 +1,104 @@
+import os
+import sys
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+from app.index_versions import index_versions
+
+# ===============================
+# 検索結果キャッシュの設定
+# ===============================
+SEARCH_RESULT_CACHE_ENABLED = os.environ.get("SEARCH_RESULT_CACHE_ENABLED", "true").lower() == "true"
+SEARCH_RESULT_CACHE_MAX_ENTRIES = int(os.environ.get("SEARCH_RESULT_CACHE_MAX_ENTRIES", 2048))
+SEARCH_RESULT_CACHE_TTL_SECONDS = int(os.environ.get("SEARCH_RESULT_CACHE_TTL_SECONDS", 10 * 60))
+
+
+def hash_vector(vector):
+    """クエリベクトルのハッシュ (float32 のバイト列から計算)。"""
+    return hashlib.blake2b(np.asarray(vector, dtype=np.float32).tobytes(), digest_size=16).digest()
+
+
+class SearchResultCache:
+    """
+    ベクトル検索結果のキャッシュ。
+
+    キーは (インデックス名, インデックスバージョン, クエリベクトルのハッシュ, k, select, トークン予算)。
+    値は select したフィールドの値だけをタプルで保持し、取得時に dict に戻す。
+    """
+
+    def __init__(self, enabled=SEARCH_RESULT_CACHE_ENABLED, max_entries=SEARCH_RESULT_CACHE_MAX_ENTRIES,
+                 ttl_seconds=SEARCH_RESULT_CACHE_TTL_SECONDS, versions=index_versions):
+        self.enabled = enabled
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.versions = versions
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "stores": 0, "expired": 0, "evictions": 0}
+
+    def make_key(self, index_name, vector, k, select_fields, token_budget):
+        return (
+            index_name,
+            self.versions.get(index_name),
+            hash_vector(vector),
+            k,
+            tuple(select_fields),
+            token_budget,
+        )
+
+    def get(self, key):
+        """キャッシュ済みの検索結果 (dict のリスト) を返す。見つからなければ None。"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            created_at, rows = entry
+            if time.time() - created_at > self.ttl_seconds:
+                del self._entries[key]
+                self._stats["expired"] += 1
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+        select_fields = key[4]
+        return [dict(zip(select_fields, row)) for row in rows]
+
+    def set(self, key, results):
+        if not self.enabled:
+            return
+        select_fields = key[4]
+        rows = tuple(tuple(item.get(field) for field in select_fields) for item in results)
+        with self._lock:
+            self._entries[key] = (time.time(), rows)
+            self._entries.move_to_end(key)
+            self._stats["stores"] += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def invalidate(self, index_name):
+        """インデックスのバージョンを進め、そのインデックスのキャッシュを無効にする。"""
+        version = self.versions.bump(index_name)
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == index_name]:
+                del self._entries[key]
+        return version
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+            stats["approx_bytes"] = sum(
+                sys.getsizeof(value) for _, rows in self._entries.values() for row in rows for value in row
+            )
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+
+search_result_cache = SearchResultCache()
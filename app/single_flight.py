@@ -0,0 +1,188 @@
+import os
+import time
+import asyncio
+import hashlib
+import threading
+from app.metrics import observe_single_flight
+
+try:
+    import fcntl
+except ImportError:  # Windows ではワーカー間のロックを使わない
+    fcntl = None
+
+# ===============================
+# 同一リクエストのまとめ (single-flight) の設定
+# ===============================
+SINGLE_FLIGHT_ENABLED = os.environ.get("SINGLE_FLIGHT_ENABLED", "true").lower() == "true"
+# 先行する呼び出しの結果を待つ最大秒数。超えた場合は自分で呼び出す
+SINGLE_FLIGHT_WAIT_SECONDS = float(os.environ.get("SINGLE_FLIGHT_WAIT_SECONDS", 30))
+# 設定した場合、このディレクトリのロックファイルで gunicorn のワーカー間でも同じ呼び出しを直列にする
+SINGLE_FLIGHT_LOCK_DIR = os.environ.get("SINGLE_FLIGHT_LOCK_DIR")
+# ロックファイルの数 (キーのハッシュで振り分ける。衝突したキー同士は短時間待ち合うだけ)
+SINGLE_FLIGHT_LOCK_STRIPES = int(os.environ.get("SINGLE_FLIGHT_LOCK_STRIPES", 64))
+# ロックファイルの取得を試す間隔
+LOCK_POLL_SECONDS = 0.01
+
+
+class _Call:
+    """スレッド間で共有する実行中の呼び出し。"""
+
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class _FileLock:
+    """キーごとのロックファイル (flock) 。取得できるまで待つ間はポーリングする。"""
+
+    def __init__(self, directory, name, key, stripes):
+        digest = hashlib.sha256(repr(key).encode("utf-8")).digest()
+        stripe = int.from_bytes(digest[:4], "big") % stripes
+        self.path = os.path.join(directory, f"{name}-{stripe}.lock")
+        self._file = None
+
+    def try_acquire(self):
+        if self._file is None:
+            self._file = open(self.path, "a+b")
+        try:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        return True
+
+    def release(self):
+        if self._file is not None:
+            try:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            finally:
+                self._file.close()
+                self._file = None
+
+
+class SingleFlight:
+    """
+    同じキーの呼び出しが同時に実行中の場合、1 回だけ実行して全員に同じ結果を返す。
+
+    社内で共有された同じ質問が短時間に集中したときに、埋め込み・検索の呼び出しを
+    1 回にまとめる。結果 (または例外) は実行中に合流した呼び出しにだけ共有し、
+    キャッシュはしない (キャッシュは EmbeddingService・SearchResultCache が担う)。
+
+    lock_dir を指定した場合は、ワーカー間でもロックファイルで同じキーの呼び出しを直列にする。
+    後から実行するワーカーは、共有の永続キャッシュ (埋め込みキャッシュの SQLite など) に
+    先行するワーカーの結果がある状態で呼び出すことになる。
+    """
+
+    def __init__(self, name, enabled=SINGLE_FLIGHT_ENABLED, wait_seconds=SINGLE_FLIGHT_WAIT_SECONDS,
+                 lock_dir=None, lock_stripes=SINGLE_FLIGHT_LOCK_STRIPES):
+        self.name = name
+        self.enabled = enabled
+        self.wait_seconds = wait_seconds
+        self.lock_dir = lock_dir if fcntl is not None else None
+        self.lock_stripes = lock_stripes
+        self._calls = {}
+        self._async_calls = {}
+        self._lock = threading.Lock()
+        self._stats = {"leaders": 0, "coalesced": 0, "lock_waits": 0, "wait_timeouts": 0}
+        if self.lock_dir:
+            os.makedirs(self.lock_dir, exist_ok=True)
+
+    def _count(self, name, role):
+        with self._lock:
+            self._stats[name] += 1
+        observe_single_flight(self.name, role)
+
+    # ---------- 同期 API ----------
+    def do(self, key, fn):
+        """key の呼び出しが実行中であればその結果を待ち、なければ fn() を実行して結果を共有する。"""
+        if not self.enabled:
+            return fn()
+
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        self._count("leaders" if leader else "coalesced", "leader" if leader else "coalesced")
+
+        if not leader:
+            if not call.done.wait(self.wait_seconds):
+                self._count("wait_timeouts", "wait_timeout")
+                return fn()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self._run_locked(key, fn)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def _run_locked(self, key, fn):
+        if not self.lock_dir:
+            return fn()
+        lock = _FileLock(self.lock_dir, self.name, key, self.lock_stripes)
+        acquired = lock.try_acquire()
+        if not acquired:
+            self._count("lock_waits", "lock_wait")
+            deadline = time.monotonic() + self.wait_seconds
+            while not acquired and time.monotonic() < deadline:
+                time.sleep(LOCK_POLL_SECONDS)
+                acquired = lock.try_acquire()
+        try:
+            return fn()
+        finally:
+            lock.release()
+
+    # ---------- 非同期 API ----------
+    async def ado(self, key, coroutine_fn):
+        """do の非同期版。同じイベントループ内の呼び出しを 1 つのタスクにまとめる。"""
+        if not self.enabled:
+            return await coroutine_fn()
+
+        loop = asyncio.get_running_loop()
+        loop_key = (id(loop), key)
+        task = self._async_calls.get(loop_key)
+        leader = task is None
+        if leader:
+            task = loop.create_task(self._arun_locked(key, coroutine_fn))
+            self._async_calls[loop_key] = task
+            task.add_done_callback(lambda _: self._async_calls.pop(loop_key, None))
+        self._count("leaders" if leader else "coalesced", "leader" if leader else "coalesced")
+
+        # 先に呼び出したリクエストが切断されても、合流した呼び出しのためにタスクは止めない
+        if leader:
+            return await asyncio.shield(task)
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), self.wait_seconds)
+        except asyncio.TimeoutError:
+            self._count("wait_timeouts", "wait_timeout")
+            return await coroutine_fn()
+
+    async def _arun_locked(self, key, coroutine_fn):
+        if not self.lock_dir:
+            return await coroutine_fn()
+        lock = _FileLock(self.lock_dir, self.name, key, self.lock_stripes)
+        acquired = lock.try_acquire()
+        if not acquired:
+            self._count("lock_waits", "lock_wait")
+            deadline = time.monotonic() + self.wait_seconds
+            while not acquired and time.monotonic() < deadline:
+                await asyncio.sleep(LOCK_POLL_SECONDS)
+                acquired = lock.try_acquire()
+        try:
+            return await coroutine_fn()
+        finally:
+            lock.release()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
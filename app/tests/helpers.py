@@ -0,0 +1,25 @@
+from app.cosmos_repository import CosmosRepository
+from benchmarks.fake_cosmos import FakeContainer
+
+
+class FakeTokenizer:
+    """1 文字を 1 トークンとして数える tiktoken の代わり (エンコーディングのダウンロードが不要)。"""
+
+    def encode(self, text, **kwargs):
+        return [ord(char) for char in text]
+
+    def decode(self, tokens):
+        return "".join(chr(token) for token in tokens)
+
+
+def create_fake_container():
+    """CosmosRepository の container_factory から呼び出される。遅延とエラーなしのフェイクコンテナ。"""
+    return FakeContainer(latency_ms=0, error_rate=0)
+
+
+def make_fake_repository(documents=()):
+    """benchmarks.fake_cosmos のコンテナを使う CosmosRepository を返す。"""
+    repository = CosmosRepository(container_factory="app.tests.helpers:create_fake_container")
+    for document in documents:
+        repository.container.create_item(document)
+    return repository
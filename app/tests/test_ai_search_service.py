@@ -0,0 +1,54 @@
+from unittest import mock
+from django.test import SimpleTestCase
+from app.ai_search_service import TokenBudgetCollector, collect_within_token_budget, summarize_vector_results
+from app.tests.helpers import FakeTokenizer
+
+
+class TokenBudgetCollectorTests(SimpleTestCase):
+    """トークン予算内での検索結果の収集のテスト (1 文字 = 1 トークンとして数える)"""
+
+    def setUp(self):
+        patcher = mock.patch("app.ai_search_service.get_tokenizer", return_value=FakeTokenizer())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def results(self, *contents):
+        return [{"content": content, "unused": "x"} for content in contents]
+
+    def test_selects_only_requested_fields(self):
+        collected = collect_within_token_budget(self.results("abc"), ["content"], 100)
+        self.assertEqual(collected, [{"content": "abc"}])
+
+    def test_formatted_text_stays_within_budget(self):
+        results = self.results(*["x" * 20 for _ in range(10)])
+        for budget in (30, 60, 100, 200):
+            collected = collect_within_token_budget(results, ["content"], budget)
+            self.assertLessEqual(len(summarize_vector_results(collected)), budget)
+            self.assertGreaterEqual(len(collected), 1)
+
+    def test_counts_separators_between_results(self):
+        # 1 件の整形後は 25 トークン。区切りを数えなければ 2 件目も 50 に収まってしまう
+        collected = collect_within_token_budget(self.results("x" * 20, "y" * 20), ["content"], 50)
+        self.assertEqual(len(collected), 1)
+
+    def test_truncates_oversized_first_result(self):
+        collected = collect_within_token_budget(self.results("x" * 100, "y"), ["content"], 30)
+        self.assertEqual(len(collected), 1)
+        self.assertEqual(len(summarize_vector_results(collected)), 30)
+
+    def test_stops_reading_results_after_budget(self):
+        pulled = []
+
+        def lazy_results():
+            for content in ["a" * 20] * 10:
+                pulled.append(content)
+                yield {"content": content}
+
+        collect_within_token_budget(lazy_results(), ["content"], 60)
+        self.assertLess(len(pulled), 10)
+
+    def test_non_positive_budget_keeps_everything(self):
+        collector = TokenBudgetCollector(["content"], 0)
+        for result in self.results(*["x" * 1000] * 5):
+            self.assertTrue(collector.add(result))
+        self.assertEqual(len(collector.collected), 5)
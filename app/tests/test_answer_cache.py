@@ -0,0 +1,80 @@
+from unittest import mock
+from django.test import SimpleTestCase
+from app.answer_cache import SemanticAnswerCache, is_cacheable_conversation
+
+
+class FakeVersions:
+    """index_versions の代わりにテナントごとのバージョンを辞書で持つ。"""
+
+    def __init__(self):
+        self.versions = {}
+
+    def get(self, tenant):
+        return self.versions.get(tenant, 0)
+
+
+class SemanticAnswerCacheTests(SimpleTestCase):
+    """SemanticAnswerCache (テナントごとの類似質問の回答キャッシュ) のテスト"""
+
+    def setUp(self):
+        self.versions = FakeVersions()
+        self.now = 1_000_000.0
+        patcher = mock.patch("app.answer_cache.time.time", side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def make_cache(self, **kwargs):
+        options = {"enabled": True, "threshold": 0.95, "max_entries": 8, "max_tenants": 8, "ttl_seconds": 100}
+        options.update(kwargs)
+        return SemanticAnswerCache(versions=self.versions, **options)
+
+    def test_near_duplicate_question_hits(self):
+        cache = self.make_cache()
+        cache.store("tenant", [1.0, 0.0, 0.0], "context", "answer")
+        self.assertEqual(cache.lookup("tenant", [0.99, 0.05, 0.0], "context"), "answer")
+        self.assertIsNone(cache.lookup("tenant", [0.0, 1.0, 0.0], "context"))
+        self.assertEqual(cache.stats()["hits"], 1)
+
+    def test_context_and_tenant_must_match(self):
+        cache = self.make_cache()
+        cache.store("tenant", [1.0, 0.0], "context", "answer")
+        self.assertIsNone(cache.lookup("tenant", [1.0, 0.0], "other context"))
+        self.assertIsNone(cache.lookup("other tenant", [1.0, 0.0], "context"))
+
+    def test_expired_answers_are_not_returned(self):
+        cache = self.make_cache(ttl_seconds=100)
+        cache.store("tenant", [1.0, 0.0], "context", "answer")
+        self.now += 101
+        self.assertIsNone(cache.lookup("tenant", [1.0, 0.0], "context"))
+
+    def test_index_version_change_invalidates_tenant(self):
+        cache = self.make_cache()
+        cache.store("tenant", [1.0, 0.0], "context", "answer")
+        self.versions.versions["tenant"] = 1
+        self.assertIsNone(cache.lookup("tenant", [1.0, 0.0], "context"))
+        self.assertEqual(cache.stats()["invalidations"], 1)
+
+    def test_evicts_least_recently_used_answer(self):
+        cache = self.make_cache(max_entries=2)
+        cache.store("tenant", [1.0, 0.0, 0.0], "context", "a")
+        self.now += 1
+        cache.store("tenant", [0.0, 1.0, 0.0], "context", "b")
+        self.now += 1
+        cache.lookup("tenant", [1.0, 0.0, 0.0], "context")
+        self.now += 1
+        cache.store("tenant", [0.0, 0.0, 1.0], "context", "c")
+        self.assertEqual(cache.lookup("tenant", [1.0, 0.0, 0.0], "context"), "a")
+        self.assertIsNone(cache.lookup("tenant", [0.0, 1.0, 0.0], "context"))
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_non_positive_max_entries_disables_cache(self):
+        for max_entries in (0, -1):
+            cache = self.make_cache(max_entries=max_entries)
+            cache.store("tenant", [1.0, 0.0], "context", "answer")
+            self.assertFalse(cache.enabled)
+            self.assertIsNone(cache.lookup("tenant", [1.0, 0.0], "context"))
+
+    def test_only_first_turn_is_cacheable(self):
+        self.assertTrue(is_cacheable_conversation([{"role": "system"}, {"role": "user"}]))
+        self.assertFalse(is_cacheable_conversation([{"role": "user"}, {"role": "assistant"}, {"role": "user"}]))
+        self.assertFalse(is_cacheable_conversation("question"))
@@ -0,0 +1,154 @@
+from unittest import mock
+from django.test import SimpleTestCase
+from app import conversation_window
+from app.conversation_window import (
+    ConversationSummaryCache, conversation_summary_id, fingerprint_messages, split_conversation,
+)
+from app.tests.helpers import make_fake_repository
+
+
+def turns(count):
+    """質問と回答を交互に count 件並べた会話。"""
+    return [
+        {"role": "user" if i % 2 == 0 else "assistant", "content": f"m{i:02d}"}
+        for i in range(count)
+    ]
+
+
+@mock.patch("app.conversation_window.count_tokens", len)
+class SplitConversationTests(SimpleTestCase):
+    # 1 メッセージは 3 文字 + オーバーヘッド 4 = 7 トークン
+
+    def test_keeps_recent_messages_within_budget(self):
+        messages = [{"role": "system", "content": "sys"}] + turns(6)
+
+        system, folded, recent = split_conversation(messages, token_budget=28)
+
+        self.assertEqual(system, [{"role": "system", "content": "sys"}])
+        self.assertEqual(folded, turns(6)[:2])
+        self.assertEqual(recent, turns(6)[2:])
+
+    def test_does_not_start_recent_messages_with_an_answer(self):
+        system, folded, recent = split_conversation(turns(6), token_budget=21)
+
+        self.assertEqual(recent[0]["role"], "user")
+        self.assertEqual(folded + recent, turns(6))
+        self.assertEqual(recent, turns(6)[4:])
+
+    def test_always_keeps_the_latest_message(self):
+        messages = [{"role": "user", "content": "x" * 100}]
+
+        _, folded, recent = split_conversation(messages, token_budget=10)
+
+        self.assertEqual(folded, [])
+        self.assertEqual(recent, messages)
+
+
+class ConversationSummaryCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.cache = ConversationSummaryCache(max_entries=2, ttl_seconds=60)
+
+    def test_full_and_partial_hits(self):
+        folded = turns(4)
+        self.cache.set("box:1", folded[:2], "summary")
+
+        self.assertEqual(self.cache.get("box:1", folded[:2]), ("summary", 2))
+        self.assertEqual(self.cache.get("box:1", folded), ("summary", 2))
+        self.assertEqual(self.cache.stats()["hits"], 1)
+        self.assertEqual(self.cache.stats()["partial_hits"], 1)
+
+    def test_edited_history_is_a_miss(self):
+        self.cache.set("box:1", turns(2), "summary")
+        edited = [{"role": "user", "content": "changed"}] + turns(2)[1:]
+
+        self.assertEqual(self.cache.get("box:1", edited), ("", 0))
+        self.assertEqual(self.cache.stats()["misses"], 1)
+
+    def test_expired_entry_is_a_miss(self):
+        with mock.patch("app.conversation_window.time.time", return_value=1000):
+            self.cache.set("box:1", turns(2), "summary")
+        with mock.patch("app.conversation_window.time.time", return_value=1061):
+            self.assertEqual(self.cache.get("box:1", turns(2)), ("", 0))
+        self.assertEqual(self.cache.stats()["entries"], 0)
+
+    def test_loader_is_used_when_it_covers_more(self):
+        folded = turns(4)
+        self.cache.set("box:1", folded[:2], "short")
+        loaded = {"count": 4, "fingerprint": fingerprint_messages(folded), "summary": "long"}
+
+        self.assertEqual(self.cache.get("box:1", folded, loader=lambda: loaded), ("long", 4))
+        # 読み込んだ要約はプロセス内のキャッシュにも入る
+        self.assertEqual(self.cache.get("box:1", folded), ("long", 4))
+
+    def test_loader_is_not_called_on_a_full_hit(self):
+        self.cache.set("box:1", turns(2), "summary")
+        loader = mock.Mock()
+
+        self.cache.get("box:1", turns(2), loader=loader)
+
+        loader.assert_not_called()
+
+    def test_evicts_least_recently_used_entry(self):
+        for key in ("a", "b", "c"):
+            self.cache.set(key, turns(2), key)
+
+        self.assertEqual(self.cache.get("a", turns(2)), ("", 0))
+        self.assertEqual(self.cache.get("c", turns(2)), ("c", 2))
+
+
+@mock.patch("app.conversation_window.count_tokens", len)
+@mock.patch("app.conversation_window.CONVERSATION_WINDOW_ENABLED", True)
+class WindowMessagesTests(SimpleTestCase):
+    def setUp(self):
+        self.repository = make_fake_repository()
+        patchers = [
+            mock.patch("app.conversation_window.cosmos_repository", self.repository),
+            mock.patch("app.conversation_window.conversation_summary_cache", ConversationSummaryCache()),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_sends_unsummarized_messages_as_is(self):
+        messages = turns(7)
+
+        self.assertEqual(conversation_window.window_messages(messages, "u1", "box1", token_budget=14), messages)
+
+    def test_refresh_persists_and_next_turn_uses_the_summary(self):
+        messages = turns(7)
+        summarize = mock.Mock(return_value="summary of old turns")
+
+        conversation_window.refresh_conversation_summary(
+            messages, "m07", "u1", "box1", summarize, token_budget=14
+        )
+
+        summarize.assert_called_once_with("", turns(6))
+        document = self.repository.read_item(conversation_summary_id("box1"), "u1")
+        self.assertEqual(document["count"], 6)
+        self.assertEqual(document["summary"], "summary of old turns")
+
+        # 別のワーカー (空のプロセス内キャッシュ) でも保存済みの要約を使う
+        next_turn = turns(7) + [{"role": "assistant", "content": "m07"}, {"role": "user", "content": "m08"}]
+        with mock.patch("app.conversation_window.conversation_summary_cache", ConversationSummaryCache()):
+            windowed = conversation_window.window_messages(next_turn, "u1", "box1", token_budget=14)
+
+        self.assertEqual(windowed[0], {
+            "role": "system", "content": conversation_window.SUMMARY_PREFIX + "summary of old turns",
+        })
+        self.assertEqual(windowed[1:], next_turn[6:])
+
+    def test_failed_summary_is_not_persisted(self):
+        summarize = mock.Mock(side_effect=RuntimeError("boom"))
+
+        conversation_window.refresh_conversation_summary(turns(7), "answer", "u1", "box1", summarize, token_budget=14)
+
+        self.assertIsNone(self.repository.read_item(conversation_summary_id("box1"), "u1"))
+
+    @mock.patch("app.conversation_window.CONVERSATION_WINDOW_ENABLED", False)
+    def test_disabled_returns_a_copy(self):
+        messages = turns(7)
+
+        windowed = conversation_window.window_messages(messages, "u1", "box1", token_budget=14)
+
+        self.assertEqual(windowed, messages)
+        self.assertIsNot(windowed, messages)
@@ -0,0 +1,124 @@
+from unittest import mock
+from azure.cosmos import exceptions
+from django.test import SimpleTestCase
+from app.cosmos_batch_writer import CosmosBatchWriter
+from app.tests.helpers import make_fake_repository
+
+
+def item(user_id, index):
+    return {"id": f"{user_id}-{index}", "userId": user_id, "createdAt": f"2026-05-01T00:00:{index:02d}+00:00"}
+
+
+class CosmosBatchWriterTests(SimpleTestCase):
+    def setUp(self):
+        self.repository = make_fake_repository()
+        self.committed = []
+
+    def writer(self, **kwargs):
+        options = {"flush_ms": 60000, "retry_seconds": 0, "submit_timeout": 0}
+        options.update(kwargs)
+        return CosmosBatchWriter(
+            on_committed=lambda partition_key, items: self.committed.append((partition_key, items)),
+            repository=self.repository, **options
+        )
+
+    def assertStored(self, *items):
+        for expected in items:
+            self.assertEqual(self.repository.read_item(expected["id"], expected["userId"]), expected)
+
+    def test_flush_writes_one_batch_per_partition(self):
+        writer = self.writer()
+        items = [item("u1", 0), item("u2", 0), item("u1", 1)]
+        for submitted in items:
+            self.assertTrue(writer.submit(submitted["userId"], submitted))
+
+        self.assertTrue(writer.flush(timeout=5))
+
+        self.assertStored(*items)
+        self.assertCountEqual(self.committed, [("u1", [items[0], items[2]]), ("u2", [items[1]])])
+        stats = writer.stats()
+        self.assertEqual((stats["batches"], stats["batched_items"], stats["pending"]), (1, 2, 0))
+
+    def test_sends_a_batch_when_it_is_full(self):
+        writer = self.writer(max_batch_size=2)
+        items = [item("u1", index) for index in range(5)]
+        for submitted in items:
+            writer.submit("u1", submitted)
+
+        writer.flush(timeout=5)
+
+        self.assertStored(*items)
+        self.assertEqual([len(committed) for _, committed in self.committed], [2, 2, 1])
+
+    def test_existing_item_falls_back_to_single_creates(self):
+        self.repository.create(item("u1", 0))
+        writer = self.writer()
+
+        writer._write("u1", [item("u1", 0), item("u1", 1)])
+
+        self.assertStored(item("u1", 1))
+        self.assertEqual(self.committed, [("u1", [item("u1", 1)])])
+        stats = writer.stats()
+        self.assertEqual((stats["fallbacks"], stats["duplicates"]), (1, 1))
+
+    def test_retry_sends_only_items_that_were_not_committed(self):
+        writer = self.writer()
+        create = self.repository.create
+        calls = []
+
+        def flaky_create(body, name="create"):
+            calls.append(body["id"])
+            if calls.count(body["id"]) == 1 and body["id"] == "u1-1":
+                raise exceptions.CosmosHttpResponseError(status_code=503, message="unavailable")
+            return create(body, name=name)
+
+        with mock.patch.object(self.repository, "execute_batch",
+                               side_effect=exceptions.CosmosBatchOperationError(
+                                   error_index=0, headers={}, status_code=400, message="fail",
+                                   operation_responses=[])), \
+                mock.patch.object(self.repository, "create", side_effect=flaky_create):
+            writer._write("u1", [item("u1", 0), item("u1", 1)])
+
+        self.assertEqual(calls, ["u1-0", "u1-1", "u1-1"])
+        self.assertEqual(self.committed, [("u1", [item("u1", 0), item("u1", 1)])])
+        self.assertEqual(writer.stats()["retries"], 1)
+
+    def test_retry_treats_conflicts_as_committed(self):
+        writer = self.writer()
+        created = []
+
+        def create_then_fail(body, name="create"):
+            # 作成できたが応答が失われた場合
+            if not created:
+                created.append(self.repository.container.create_item(body))
+                raise exceptions.CosmosHttpResponseError(status_code=408, message="timeout")
+            return self.repository.container.create_item(body)
+
+        with mock.patch.object(self.repository, "create", side_effect=create_then_fail):
+            writer._write("u1", [item("u1", 0)])
+
+        self.assertEqual(self.committed, [("u1", [item("u1", 0)])])
+        self.assertEqual(writer.stats()["duplicates"], 0)
+
+    @mock.patch("app.cosmos_batch_writer.observe_dropped_writes")
+    def test_drops_items_after_the_last_retry(self, observe_dropped_writes):
+        writer = self.writer(max_retries=1)
+
+        with mock.patch.object(self.repository, "create",
+                               side_effect=exceptions.CosmosHttpResponseError(status_code=503, message="down")):
+            writer._write("u1", [item("u1", 0)])
+
+        self.assertEqual(self.committed, [])
+        self.assertEqual(writer.stats()["failed"], 1)
+        observe_dropped_writes.assert_called_once_with("cosmos_batch", "retries_exhausted", 1)
+
+    def test_full_buffer_writes_inline(self):
+        writer = self.writer(max_pending=1)
+
+        self.assertTrue(writer.submit("u1", item("u1", 0)))
+        self.assertFalse(writer.submit("u1", item("u1", 1)))
+
+        self.assertStored(item("u1", 1))
+        self.assertEqual(writer.stats()["inline"], 1)
+        writer.flush(timeout=5)
+        self.assertStored(item("u1", 0))
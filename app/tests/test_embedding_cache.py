@@ -0,0 +1,71 @@
+import os
+import tempfile
+from unittest import mock
+from django.test import SimpleTestCase
+from app.embedding_cache import EmbeddingCache, make_cache_key
+
+
+class EmbeddingCacheTests(SimpleTestCase):
+    """EmbeddingCache (メモリの LRU と SQLite の 2 段キャッシュ) のテスト"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.path = os.path.join(self.directory.name, "embedding_cache.sqlite3")
+        self.now = 1_000_000.0
+        patcher = mock.patch("app.embedding_cache.time.time", side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def make_cache(self, memory_size=10, ttl_seconds=100, max_rows=100, path=None):
+        return EmbeddingCache(path if path is not None else self.path, memory_size, ttl_seconds, max_rows)
+
+    def test_memory_hit(self):
+        cache = self.make_cache()
+        cache.set("こんにちは", "model", [1.0, 2.0])
+        self.assertEqual(cache.get("こんにちは", "model"), [1.0, 2.0])
+        self.assertEqual(cache.stats()["memory_hits"], 1)
+
+    def test_key_normalizes_whitespace_and_width(self):
+        self.assertEqual(make_cache_key(" ＡＢＣ  def\n", "m"), make_cache_key("ABC def", "m"))
+        self.assertNotEqual(make_cache_key("ABC", "m1"), make_cache_key("ABC", "m2"))
+
+    def test_disk_hit_from_another_process(self):
+        self.make_cache().set("question", "model", [0.5, 0.25])
+        # 別のワーカー (新しいインスタンス) はメモリが空でも SQLite から読める
+        other = self.make_cache()
+        self.assertEqual(other.get("question", "model"), [0.5, 0.25])
+        self.assertEqual(other.stats()["disk_hits"], 1)
+        self.assertEqual(other.get("question", "model"), [0.5, 0.25])
+        self.assertEqual(other.stats()["memory_hits"], 1)
+
+    def test_expired_entries_are_misses(self):
+        cache = self.make_cache(ttl_seconds=100)
+        cache.set("question", "model", [1.0])
+        self.now += 101
+        self.assertIsNone(cache.get("question", "model"))
+        self.assertEqual(cache.stats()["misses"], 1)
+
+    def test_disk_promotion_keeps_original_age(self):
+        self.make_cache(ttl_seconds=100).set("question", "model", [1.0])
+        self.now += 60
+        other = self.make_cache(ttl_seconds=100)
+        self.assertEqual(other.get("question", "model"), [1.0])
+        # メモリに載せ直しても有効期限は延長されない
+        self.now += 50
+        self.assertIsNone(other.get("question", "model"))
+
+    def test_memory_lru_eviction(self):
+        cache = self.make_cache(memory_size=2, path="")
+        cache.set("a", "model", [1.0])
+        cache.set("b", "model", [2.0])
+        cache.get("a", "model")
+        cache.set("c", "model", [3.0])
+        self.assertEqual(cache.get("a", "model"), [1.0])
+        self.assertIsNone(cache.get("b", "model"))
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_disabled_cache(self):
+        cache = EmbeddingCache(self.path, 10, 100, 100, enabled=False)
+        cache.set("question", "model", [1.0])
+        self.assertIsNone(cache.get("question", "model"))
@@ -0,0 +1,72 @@
+import asyncio
+from types import SimpleNamespace
+from unittest import mock
+from django.test import SimpleTestCase
+from app.embedding_cache import EmbeddingCache
+from app.embedding_service import EmbeddingService
+from app.tests.helpers import FakeTokenizer
+
+
+class FakeEmbeddings:
+    """テキストの長さをベクトルにして返す embeddings API。結果は index の逆順で返す。"""
+
+    def __init__(self):
+        self.requests = []
+
+    def _response(self, inputs):
+        self.requests.append(list(inputs))
+        data = [SimpleNamespace(index=i, embedding=[float(len(text)), 1.0]) for i, text in enumerate(inputs)]
+        return SimpleNamespace(data=list(reversed(data)))
+
+    def create(self, input, model):
+        return self._response(input)
+
+
+class FakeAsyncEmbeddings(FakeEmbeddings):
+    async def create(self, input, model):
+        return self._response(input)
+
+
+class EmbeddingServiceTests(SimpleTestCase):
+    """EmbeddingService (バッチ・重複排除・チャンク分割) のテスト"""
+
+    def make_service(self, **kwargs):
+        cache = EmbeddingCache("", memory_size=100, ttl_seconds=100, max_rows=100)
+        service = EmbeddingService({}, "model", cache=cache, **kwargs)
+        self.embeddings = FakeEmbeddings()
+        service._client = SimpleNamespace(embeddings=self.embeddings)
+        return service
+
+    def test_batches_and_keeps_order(self):
+        service = self.make_service(batch_size=2, max_concurrency=2)
+        vectors = service.embed_many(["a", "bb", "ccc", "dddd", "eeeee"])
+        self.assertEqual([vector[0] for vector in vectors], [1.0, 2.0, 3.0, 4.0, 5.0])
+        self.assertEqual(sorted(len(batch) for batch in self.embeddings.requests), [1, 2, 2])
+
+    def test_duplicates_and_empty_texts(self):
+        service = self.make_service()
+        vectors = service.embed_many(["same", "", "same"])
+        self.assertEqual(self.embeddings.requests, [["same"]])
+        self.assertIsNone(vectors[1])
+        self.assertEqual(vectors[0], vectors[2])
+
+    def test_cached_texts_are_not_requested(self):
+        service = self.make_service()
+        service.embed("question")
+        service.embed_many(["question", "other"])
+        self.assertEqual(self.embeddings.requests, [["question"], ["other"]])
+
+    def test_long_text_is_split_and_averaged(self):
+        service = self.make_service(chunk_tokens=4)
+        with mock.patch("app.embedding_service.get_tokenizer", return_value=FakeTokenizer()):
+            vector = service.embed("abcdefghij")
+        self.assertEqual(self.embeddings.requests, [["abcd", "efgh", "ij"]])
+        self.assertAlmostEqual(vector[0], (4 + 4 + 2) / 3)
+
+    def test_async_matches_sync(self):
+        service = self.make_service(batch_size=2)
+        async_embeddings = FakeAsyncEmbeddings()
+        service._async_client = SimpleNamespace(embeddings=async_embeddings)
+        vectors = asyncio.run(service.aembed_many(["a", "bb", "ccc"]))
+        self.assertEqual([vector[0] for vector in vectors], [1.0, 2.0, 3.0])
+        self.assertEqual(len(async_embeddings.requests), 2)
@@ -0,0 +1,40 @@
+from unittest import mock
+from django.test import SimpleTestCase
+from app.search_clients import SearchClientRegistry
+
+
+class SearchClientRegistryTests(SimpleTestCase):
+    """SearchClientRegistry (インデックスごとのクライアントの再利用) のテスト"""
+
+    def setUp(self):
+        self.registry = SearchClientRegistry("https://example.search.windows.net", "key", max_clients=2)
+        self.addCleanup(self.registry.close)
+
+    def test_reuses_client_per_index(self):
+        first = self.registry.get("tenant-a")
+        self.assertIs(self.registry.get("tenant-a"), first)
+        self.assertIsNot(self.registry.get("tenant-b"), first)
+        stats = self.registry.stats()
+        self.assertEqual((stats["hits"], stats["creates"], stats["clients"]), (1, 2, 2))
+
+    def test_clients_share_one_transport(self):
+        with mock.patch("app.search_clients.SearchClient") as search_client:
+            self.registry.get("tenant-a")
+            self.registry.get("tenant-b")
+        transports = {call.kwargs["transport"] for call in search_client.call_args_list}
+        self.assertEqual(len(transports), 1)
+        self.assertIs(transports.pop(), self.registry._transport)
+
+    def test_evicts_least_recently_used_index(self):
+        first = self.registry.get("tenant-a")
+        self.registry.get("tenant-b")
+        self.registry.get("tenant-a")
+        self.registry.get("tenant-c")
+        self.assertEqual(list(self.registry._clients), ["tenant-a", "tenant-c"])
+        self.assertIs(self.registry.get("tenant-a"), first)
+        self.assertEqual(self.registry.stats()["evictions"], 1)
+
+    def test_stats_before_any_request(self):
+        stats = self.registry.stats()
+        self.assertEqual(stats["connections_opened"], 0)
+        self.assertEqual(stats["connections_per_request"], 0.0)
@@ -0,0 +1,62 @@
+import os
+import tempfile
+from unittest import mock
+from django.test import SimpleTestCase
+from app.index_versions import IndexVersionStore
+from app.search_result_cache import SearchResultCache
+
+
+class SearchResultCacheTests(SimpleTestCase):
+    """SearchResultCache (TTL・件数上限・インデックスバージョンによる無効化) のテスト"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "index_versions.sqlite3")
+        self.versions = IndexVersionStore(self.path, check_seconds=0)
+        self.now = 1_000_000.0
+        patcher = mock.patch("app.search_result_cache.time.time", side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def make_cache(self, **kwargs):
+        options = {"enabled": True, "max_entries": 8, "ttl_seconds": 100}
+        options.update(kwargs)
+        return SearchResultCache(versions=self.versions, **options)
+
+    def key(self, cache, index_name="index", vector=(1.0, 0.0)):
+        return cache.make_key(index_name, list(vector), 3, ["content"], 1500)
+
+    def test_round_trip_keeps_selected_fields(self):
+        cache = self.make_cache()
+        cache.set(self.key(cache), [{"content": "a", "other": "x"}, {"content": "b"}])
+        self.assertEqual(cache.get(self.key(cache)), [{"content": "a"}, {"content": "b"}])
+        self.assertIsNone(cache.get(self.key(cache, vector=(0.0, 1.0))))
+
+    def test_expired_results_are_misses(self):
+        cache = self.make_cache(ttl_seconds=100)
+        cache.set(self.key(cache), [{"content": "a"}])
+        self.now += 101
+        self.assertIsNone(cache.get(self.key(cache)))
+        self.assertEqual(cache.stats()["expired"], 1)
+
+    def test_evicts_least_recently_used_key(self):
+        cache = self.make_cache(max_entries=2)
+        first, second, third = (self.key(cache, vector=(i, 1.0)) for i in range(3))
+        cache.set(first, [{"content": "1"}])
+        cache.set(second, [{"content": "2"}])
+        cache.get(first)
+        cache.set(third, [{"content": "3"}])
+        self.assertIsNotNone(cache.get(first))
+        self.assertIsNone(cache.get(second))
+
+    def test_invalidate_bumps_version_for_other_workers(self):
+        cache = self.make_cache()
+        old_key = self.key(cache)
+        cache.set(old_key, [{"content": "a"}])
+        # 別のワーカーが同じ SQLite でバージョンを進めると、このワーカーのキーも変わる
+        other_worker = SearchResultCache(versions=IndexVersionStore(self.path, check_seconds=0))
+        self.assertEqual(other_worker.invalidate("index"), 1)
+        self.assertNotEqual(self.key(cache), old_key)
+        self.assertIsNone(cache.get(self.key(cache)))
+        self.assertEqual(self.key(cache, index_name="other")[1], 0)
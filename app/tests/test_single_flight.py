@@ -0,0 +1,167 @@
+import time
+import shutil
+import asyncio
+import tempfile
+import threading
+from unittest import mock
+from django.test import SimpleTestCase
+from app.single_flight import SingleFlight
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition was not met in time")
+        time.sleep(0.001)
+
+
+class BlockingCall:
+    """release() されるまで戻らない関数。呼び出し回数を数える。"""
+
+    def __init__(self, result="result", error=None):
+        self.result = result
+        self.error = error
+        self.calls = 0
+        self.started = threading.Event()
+        self._released = threading.Event()
+
+    def release(self):
+        self._released.set()
+
+    def __call__(self):
+        self.calls += 1
+        self.started.set()
+        self._released.wait(5)
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class SingleFlightTests(SimpleTestCase):
+    def run_concurrently(self, flight, fn, count):
+        """count 個のスレッドから同じキーで do を呼び、(結果, 例外) のリストを返す。"""
+        outcomes = [None] * count
+
+        def worker(index):
+            try:
+                outcomes[index] = (flight.do("key", fn), None)
+            except Exception as e:
+                outcomes[index] = (None, e)
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(count)]
+        threads[0].start()
+        fn.started.wait(5)
+        for thread in threads[1:]:
+            thread.start()
+        wait_until(lambda: flight.stats()["coalesced"] == count - 1)
+        fn.release()
+        for thread in threads:
+            thread.join(5)
+        return outcomes
+
+    def test_concurrent_calls_share_one_result(self):
+        flight = SingleFlight("test", enabled=True)
+        fn = BlockingCall()
+
+        outcomes = self.run_concurrently(flight, fn, 4)
+
+        self.assertEqual(fn.calls, 1)
+        self.assertEqual(outcomes, [("result", None)] * 4)
+        self.assertEqual(flight.stats()["leaders"], 1)
+
+    def test_errors_are_shared(self):
+        flight = SingleFlight("test", enabled=True)
+        error = RuntimeError("boom")
+        fn = BlockingCall(error=error)
+
+        outcomes = self.run_concurrently(flight, fn, 3)
+
+        self.assertEqual(fn.calls, 1)
+        self.assertEqual([raised for _, raised in outcomes], [error] * 3)
+
+    def test_results_are_not_cached(self):
+        flight = SingleFlight("test", enabled=True)
+        fn = mock.Mock(side_effect=[1, 2])
+
+        self.assertEqual(flight.do("key", fn), 1)
+        self.assertEqual(flight.do("key", fn), 2)
+
+    def test_disabled_calls_every_time(self):
+        flight = SingleFlight("test", enabled=False)
+        fn = mock.Mock(return_value="result")
+
+        flight.do("key", fn)
+        flight.do("key", fn)
+
+        self.assertEqual(fn.call_count, 2)
+
+    def test_follower_calls_itself_after_the_wait_timeout(self):
+        flight = SingleFlight("test", enabled=True, wait_seconds=0.01)
+        leader = BlockingCall()
+        thread = threading.Thread(target=flight.do, args=("key", leader))
+        thread.start()
+        leader.started.wait(5)
+
+        self.assertEqual(flight.do("key", lambda: "own"), "own")
+        self.assertEqual(flight.stats()["wait_timeouts"], 1)
+        leader.release()
+        thread.join(5)
+
+    def test_lock_dir_serializes_across_instances(self):
+        lock_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, lock_dir, ignore_errors=True)
+        # 同じロックディレクトリを使う 2 つのインスタンスを、別々のワーカーに見立てる
+        first = SingleFlight("test", enabled=True, lock_dir=lock_dir)
+        second = SingleFlight("test", enabled=True, lock_dir=lock_dir)
+        leader = BlockingCall()
+        follower = mock.Mock(return_value="second")
+        thread = threading.Thread(target=first.do, args=("key", leader))
+        thread.start()
+        leader.started.wait(5)
+
+        results = []
+        other = threading.Thread(target=lambda: results.append(second.do("key", follower)))
+        other.start()
+        wait_until(lambda: second.stats()["lock_waits"] == 1)
+        follower.assert_not_called()
+
+        leader.release()
+        thread.join(5)
+        other.join(5)
+        self.assertEqual(results, ["second"])
+
+
+class AsyncSingleFlightTests(SimpleTestCase):
+    def test_concurrent_calls_in_a_loop_share_one_task(self):
+        flight = SingleFlight("test", enabled=True)
+        calls = []
+
+        async def fetch():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return "result"
+
+        async def main():
+            return await asyncio.gather(*(flight.ado("key", fetch) for _ in range(3)))
+
+        self.assertEqual(asyncio.run(main()), ["result"] * 3)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(flight.stats(), {"leaders": 1, "coalesced": 2, "lock_waits": 0, "wait_timeouts": 0})
+
+    def test_leader_cancellation_does_not_cancel_followers(self):
+        flight = SingleFlight("test", enabled=True)
+
+        async def fetch():
+            await asyncio.sleep(0.01)
+            return "result"
+
+        async def main():
+            leader = asyncio.ensure_future(flight.ado("key", fetch))
+            await asyncio.sleep(0)
+            follower = asyncio.ensure_future(flight.ado("key", fetch))
+            await asyncio.sleep(0)
+            leader.cancel()
+            return await follower
+
+        self.assertEqual(asyncio.run(main()), "result")
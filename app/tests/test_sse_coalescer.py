@@ -0,0 +1,82 @@
+import json
+from types import SimpleNamespace
+from unittest import mock
+from django.test import SimpleTestCase
+from app.open_ai_service import SSECoalescer, encode_sse_frame, stream_coalesced_response
+
+
+def frame_content(frame):
+    return json.loads(frame.removeprefix("data: "))["content"]
+
+
+class EncodeSSEFrameTests(SimpleTestCase):
+    def test_matches_json_dumps(self):
+        for content in ("hello", "日本語の回答", 'quote " and \\ backslash', "改行\nタブ\t", " "):
+            self.assertEqual(
+                encode_sse_frame(content),
+                f'data: {json.dumps({"content": content}, ensure_ascii=False)}\n\n',
+            )
+
+
+class SSECoalescerTests(SimpleTestCase):
+    def setUp(self):
+        self.now = 100.0
+        patcher = mock.patch("app.open_ai_service.time.monotonic", side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.coalescer = SSECoalescer(window_ms=50, max_bytes=10)
+
+    def test_first_delta_is_sent_immediately(self):
+        self.assertEqual(self.coalescer.add("a"), encode_sse_frame("a"))
+        self.assertIsNone(self.coalescer.timeout())
+
+    def test_buffers_until_the_window_elapses(self):
+        self.coalescer.add("a")
+
+        self.assertIsNone(self.coalescer.add("b"))
+        self.now += 0.02
+        self.assertIsNone(self.coalescer.add("c"))
+        self.assertAlmostEqual(self.coalescer.timeout(), 0.03)
+        self.now += 0.04
+        self.assertEqual(self.coalescer.add("d"), encode_sse_frame("bcd"))
+
+    def test_sends_when_max_bytes_is_reached(self):
+        self.coalescer.add("a")
+
+        self.assertIsNone(self.coalescer.add("あいう"))
+        self.assertEqual(self.coalescer.add("え"), encode_sse_frame("あいうえ"))
+
+    def test_flush_sends_pending_deltas_after_the_timeout(self):
+        self.coalescer.add("a")
+        self.coalescer.add("b")
+        self.now += 0.1
+
+        self.assertEqual(self.coalescer.timeout(), 0.0)
+        self.assertEqual(self.coalescer.flush(), encode_sse_frame("b"))
+        self.assertIsNone(self.coalescer.flush())
+
+
+def chunk(content):
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=content))])
+
+
+class StreamCoalescedResponseTests(SimpleTestCase):
+    def test_frames_carry_the_whole_answer(self):
+        deltas = ["こん", "にち", "は", None, "、", "世界"]
+        on_complete = mock.Mock()
+
+        frames = list(stream_coalesced_response(iter(chunk(delta) for delta in deltas), on_complete))
+
+        self.assertEqual(frames[0], encode_sse_frame("こん"))
+        self.assertEqual("".join(frame_content(frame) for frame in frames), "こんにちは、世界")
+        on_complete.assert_called_once_with("こんにちは、世界")
+
+    def test_stream_error_yields_an_error_frame(self):
+        def failing_stream():
+            yield chunk("a")
+            raise RuntimeError("boom")
+
+        frames = list(stream_coalesced_response(failing_stream()))
+
+        self.assertEqual(frames[0], encode_sse_frame("a"))
+        self.assertIn('"error"', frames[-1])
@@ -0,0 +1,140 @@
+from unittest import mock
+from azure.cosmos import exceptions
+from django.test import SimpleTestCase
+from app import usage_counter
+from app.usage_counter import TermCache, build_usage_counter, increment_usage_count, usage_counter_id
+from app.tests.helpers import make_fake_repository
+
+TERM = {"start": "2026-04-01T00:00:00+00:00", "end": "2027-03-31T23:59:59+00:00"}
+TERM_DOCUMENT = {"id": "term-u1", "AvailableuserId": "u1", "AvailableTerm": TERM}
+
+
+def conversation(index):
+    return {"id": f"c{index}", "userId": "u1", "createdAt": f"2026-05-{index + 1:02d}T00:00:00+00:00"}
+
+
+class UsageCounterTestCase(SimpleTestCase):
+    def setUp(self):
+        self.repository = make_fake_repository([TERM_DOCUMENT])
+        patchers = [
+            mock.patch("app.usage_counter.cosmos_repository", self.repository),
+            mock.patch("app.usage_counter.term_cache", TermCache(ttl_seconds=60)),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def save_conversations(self, count):
+        for index in range(count):
+            self.repository.create(conversation(index))
+        return conversation(count - 1)["createdAt"]
+
+    def counter(self):
+        return self.repository.read_item(usage_counter_id(TERM), "u1")
+
+
+class IncrementUsageCountTests(UsageCounterTestCase):
+    def test_increments_existing_counter(self):
+        self.repository.create(build_usage_counter("u1", TERM, 5))
+
+        increment_usage_count("u1", conversation(0)["createdAt"], count=2)
+
+        self.assertEqual(self.counter()["count"], 7)
+
+    def test_first_save_seeds_counter_including_the_saved_conversations(self):
+        created_at = self.save_conversations(3)
+
+        increment_usage_count("u1", created_at, count=3)
+
+        self.assertEqual(self.counter()["count"], 3)
+
+    def test_ignores_conversations_outside_the_term(self):
+        increment_usage_count("u1", "2028-01-01T00:00:00+00:00")
+
+        self.assertIsNone(self.counter())
+
+    def create_concurrently(self, competitor_count):
+        """カウンターの作成が、competitor_count を数えた別のリクエストと競合した状態にする。"""
+        create = self.repository.create
+
+        def competing_create(body, name="create"):
+            create(build_usage_counter("u1", TERM, competitor_count))
+            raise exceptions.CosmosResourceExistsError(status_code=409, message="exists")
+
+        return mock.patch.object(self.repository, "create", side_effect=competing_create)
+
+    def test_conflict_with_counter_that_includes_this_conversation(self):
+        created_at = self.save_conversations(2)
+
+        with self.create_concurrently(competitor_count=2):
+            increment_usage_count("u1", created_at)
+
+        self.assertEqual(self.counter()["count"], 2)
+
+    def test_conflict_with_counter_that_misses_this_conversation(self):
+        created_at = self.save_conversations(2)
+
+        with self.create_concurrently(competitor_count=1):
+            increment_usage_count("u1", created_at)
+
+        self.assertEqual(self.counter()["count"], 2)
+
+    def test_conflict_adds_at_most_this_requests_count(self):
+        created_at = self.save_conversations(3)
+
+        # 競合したカウンターより後に別の会話も保存されていた場合でも、今回の件数までしか足さない
+        with self.create_concurrently(competitor_count=0):
+            increment_usage_count("u1", created_at, count=1)
+
+        self.assertEqual(self.counter()["count"], 1)
+
+
+class TermCacheTests(UsageCounterTestCase):
+    def setUp(self):
+        super().setUp()
+        self.now = 1000.0
+        patcher = mock.patch("app.usage_counter.time.time", side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.cache = TermCache(ttl_seconds=60, max_users=2)
+
+    def test_queries_once_then_serves_from_memory(self):
+        self.assertEqual(self.cache.get("u1"), TERM)
+        self.assertEqual(self.cache.get("u1"), TERM)
+
+        stats = self.cache.stats()
+        self.assertEqual((stats["queries"], stats["hits"], stats["point_reads"]), (1, 1, 0))
+
+    def test_expired_entry_is_refreshed_with_a_point_read(self):
+        self.cache.get("u1")
+        self.now += 61
+
+        self.assertEqual(self.cache.get("u1"), TERM)
+
+        stats = self.cache.stats()
+        self.assertEqual((stats["queries"], stats["point_reads"]), (1, 1))
+
+    def test_invalidate_picks_up_an_updated_term(self):
+        self.cache.get("u1")
+        updated = {"start": TERM["start"], "end": "2028-03-31T23:59:59+00:00"}
+        self.repository.upsert(dict(TERM_DOCUMENT, AvailableTerm=updated))
+
+        self.cache.invalidate("u1")
+
+        self.assertEqual(self.cache.get("u1"), updated)
+
+    def test_users_without_a_term_are_not_cached(self):
+        self.assertIsNone(self.cache.get("u2"))
+        self.assertIsNone(self.cache.get("u2"))
+
+        self.assertEqual(self.cache.stats()["queries"], 2)
+        self.assertEqual(self.cache.stats()["users"], 0)
+
+    def test_evicts_least_recently_used_user(self):
+        for user_id in ("u1", "u3", "u4"):
+            self.repository.upsert(dict(TERM_DOCUMENT, id=f"term-{user_id}", AvailableuserId=user_id))
+            self.cache.get(user_id)
+
+        self.assertEqual(self.cache.stats()["users"], 2)
+        self.cache.get("u1")
+        self.assertEqual(self.cache.stats()["queries"], 4)
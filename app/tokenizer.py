@@ -0,0 +1,17 @@
+import functools
+import tiktoken
+
+DEFAULT_ENCODING = "cl100k_base"
+
+
+@functools.lru_cache(maxsize=None)
+def get_tokenizer(encoding_name=DEFAULT_ENCODING):
+    """tiktoken のエンコーダをプロセス内で一度だけ生成して使い回す。"""
+    return tiktoken.get_encoding(encoding_name)
+
+
+def count_tokens(text, encoding_name=DEFAULT_ENCODING):
+    """テキストのトークン数を返す。"""
+    if not text:
+        return 0
+    return len(get_tokenizer(encoding_name).encode(text))
@@ -0,0 +1,217 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from azure.cosmos import exceptions
+from app.cosmos_repository import HISTORY_BOX_TYPE, USAGE_COUNTER_TYPE, cosmos_repository
+
+# ===============================
+# 利用期間キャッシュの設定
+# ===============================
+# 利用期間はほとんど変わらないため、プロセス内でこの秒数だけ使い回す
+TERM_CACHE_TTL_SECONDS = int(os.environ.get("TERM_CACHE_TTL_SECONDS", 300))
+TERM_CACHE_MAX_USERS = int(os.environ.get("TERM_CACHE_MAX_USERS", 10000))
+
+
+class TermCache:
+    """
+    ユーザーごとの利用期間と、そのドキュメントの ID を保持するキャッシュ。
+
+    期限切れ後はドキュメント ID によるポイント読み取りで取り直すため、
+    クエリを実行するのはユーザーごとに最初の 1 回だけになる。
+    """
+
+    def __init__(self, ttl_seconds=TERM_CACHE_TTL_SECONDS, max_users=TERM_CACHE_MAX_USERS):
+        self.ttl_seconds = ttl_seconds
+        self.max_users = max_users
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "point_reads": 0, "queries": 0, "invalidations": 0}
+
+    def _fetch(self, user_id, document_id):
+        if document_id is not None:
+            with self._lock:
+                self._stats["point_reads"] += 1
+            item = cosmos_repository.read_item(document_id, user_id, name="available_term_read")
+            if item is not None and "AvailableTerm" in item:
+                return item["AvailableTerm"], document_id
+
+        with self._lock:
+            self._stats["queries"] += 1
+        query_term = (
+            "SELECT c.id, c.AvailableTerm FROM c "
+            "WHERE c.AvailableuserId = @userId"
+        )
+        parameters = [{"name": "@userId", "value": user_id}]
+        items = cosmos_repository.query(query_term, parameters, user_id, name="available_term")
+        if not items:
+            return None, None
+        return items[0]["AvailableTerm"], items[0]["id"]
+
+    def get(self, user_id):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry["expires_at"] > now:
+                self._entries.move_to_end(user_id)
+                self._stats["hits"] += 1
+                return entry["term"]
+        document_id = entry["document_id"] if entry is not None else None
+
+        term, document_id = self._fetch(user_id, document_id)
+        with self._lock:
+            if term is None:
+                # 利用期間がまだ登録されていないユーザーはキャッシュしない
+                self._entries.pop(user_id, None)
+                return None
+            self._entries[user_id] = {"term": term, "document_id": document_id, "expires_at": now + self.ttl_seconds}
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_users:
+                self._entries.popitem(last=False)
+        return term
+
+    def invalidate(self, user_id=None):
+        """ユーザー (省略時は全ユーザー) の利用期間を破棄する。次回の参照で取り直す。"""
+        with self._lock:
+            if user_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(user_id, None)
+            self._stats["invalidations"] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["users"] = len(self._entries)
+        return stats
+
+
+term_cache = TermCache()
+
+
+def fetch_available_term(user_id):
+    """
+    ユーザーの利用期間 (AvailableTerm) を取得します。
+
+    Returns:
+        dict or None: {"start": ..., "end": ...}。見つからない場合は None
+    """
+    return term_cache.get(user_id)
+
+
+def invalidate_available_term(user_id=None):
+    """利用期間を更新した際に呼び出し、キャッシュ済みの利用期間を破棄します。"""
+    term_cache.invalidate(user_id)
+
+
+def usage_counter_id(term):
+    """利用期間に対応するカウンタードキュメントの ID を返します。"""
+    return f"{USAGE_COUNTER_TYPE}-{term['start']}"
+
+
+def count_conversations(user_id, term):
+    """利用期間内の会話数を会話ドキュメントから数えます (カウンターの初期化・修復用)。"""
+    query_count = (
+        "SELECT VALUE COUNT(1) FROM c "
+        "WHERE c.userId = @userId "
+        "AND c.createdAt >= @start_date "
+        "AND c.createdAt <= @end_date "
+        "AND (NOT IS_DEFINED(c.type) OR c.type != @type)"
+    )
+    parameters_count = [
+        {"name": "@userId", "value": user_id},
+        {"name": "@start_date", "value": term["start"]},
+        {"name": "@end_date", "value": term["end"]},
+        {"name": "@type", "value": HISTORY_BOX_TYPE},
+    ]
+    count_items = cosmos_repository.query(query_count, parameters_count, user_id, name="count_conversations")
+    return count_items[0] if count_items else 0
+
+
+def build_usage_counter(user_id, term, count):
+    # createdAt を持たせないため、利用期間での COUNT や履歴の一覧には含まれない
+    return {
+        "id": usage_counter_id(term),
+        "type": USAGE_COUNTER_TYPE,
+        "userId": user_id,
+        "termStart": term["start"],
+        "termEnd": term["end"],
+        "count": count,
+        "updatedAt": datetime.now(timezone.utc).isoformat(),
+    }
+
+
+def seed_usage_counter(user_id, term):
+    """
+    会話数を数えてカウンターを作成し、その値を返します。
+    同時に作成された場合は作成済みのカウンターを優先します。
+    """
+    counter = build_usage_counter(user_id, term, count_conversations(user_id, term))
+    try:
+        cosmos_repository.create(counter, name="usage_counter_create")
+    except exceptions.CosmosResourceExistsError:
+        pass
+    return counter["count"]
+
+
+def rebuild_usage_counter(user_id, term):
+    """会話ドキュメントから数え直した値でカウンターを上書きし、その値を返します。"""
+    counter = build_usage_counter(user_id, term, count_conversations(user_id, term))
+    cosmos_repository.upsert(counter, name="usage_counter_rebuild")
+    return counter["count"]
+
+
+def read_usage_count(user_id, term):
+    """
+    利用期間内の会話数をカウンターのポイント読み取りで返します。
+    カウンターがまだない場合は会話数を数えて作成します。
+    """
+    counter = cosmos_repository.read_item(usage_counter_id(term), user_id, name="usage_counter_read")
+    if counter is not None:
+        return counter["count"]
+    return seed_usage_counter(user_id, term)
+
+
+def increment_usage_count(user_id, created_at, count=1):
+    """
+    保存した会話の分だけカウンターを増やします。
+    会話の作成日時が利用期間外の場合は何もしません。
+
+    Args:
+        user_id (str): ユーザーID (パーティションキー)
+        created_at (str): 保存した会話 (複数の場合は最後のもの) の createdAt (ISO 8601)
+        count (int): 保存した会話の数
+    """
+    term = fetch_available_term(user_id)
+    if term and created_at > term["end"]:
+        # キャッシュ中に利用期間が更新された可能性があるため取り直す
+        invalidate_available_term(user_id)
+        term = fetch_available_term(user_id)
+    if not term or not term["start"] <= created_at <= term["end"]:
+        return
+
+    patch_operations = [
+        {"op": "incr", "path": "/count", "value": count},
+        {"op": "set", "path": "/updatedAt", "value": created_at},
+    ]
+    try:
+        cosmos_repository.patch(usage_counter_id(term), user_id, patch_operations, name="usage_counter_increment")
+        return
+    except exceptions.CosmosResourceNotFoundError:
+        pass
+
+    # 初回は保存済みの会話を含めて数えるため、加算は不要
+    counter = build_usage_counter(user_id, term, count_conversations(user_id, term))
+    try:
+        cosmos_repository.create(counter, name="usage_counter_create")
+    except exceptions.CosmosResourceExistsError:
+        # 同時に作成されたカウンターは、この会話を数えている場合といない場合がある。
+        # 作成直前に数えた会話数 (この会話を含む) に足りない分だけ (最大で今回の件数まで) 加算し、二重に数えない
+        current = cosmos_repository.read_item(usage_counter_id(term), user_id, name="usage_counter_read")
+        missing = min(count, counter["count"] - current["count"]) if current else 0
+        if missing > 0:
+            cosmos_repository.patch(usage_counter_id(term), user_id, [
+                {"op": "incr", "path": "/count", "value": missing},
+                {"op": "set", "path": "/updatedAt", "value": created_at},
+            ], name="usage_counter_increment")
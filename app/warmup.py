@@ -0,0 +1,74 @@
+import time
+import importlib
+
+# ===============================
+# 起動時の事前読み込みとウォームアップ
+# ===============================
+# fork 前 (gunicorn のマスタープロセス) に import しておく重いモジュール
+PRELOAD_MODULES = [
+    "openai",
+    "tiktoken",
+    "numpy",
+    "azure.cosmos",
+    "azure.search.documents",
+    "new_oshietena.urls",
+]
+
+
+def _timed_steps(steps):
+    timings = {}
+    for name, step in steps:
+        started_at = time.perf_counter()
+        try:
+            step()
+            timings[name] = round((time.perf_counter() - started_at) * 1000, 1)
+        except Exception as e:
+            # ウォームアップの失敗は最初のリクエストで再試行されるため、起動は止めない
+            print(f"⚠️ ウォームアップ失敗 ({name}): {e}")
+            timings[name] = None
+    return timings
+
+
+def preload():
+    """
+    ソケットを持たない重い処理 (モジュールの import とトークナイザの読み込み) を行う。
+
+    fork 前に 1 回だけ実行すれば、各ワーカーはコピーオンライトで共有できる。
+
+    Returns:
+        dict: ステップ名 -> 所要時間 (ミリ秒。失敗した場合は None)
+    """
+    from app.tokenizer import get_tokenizer
+
+    steps = [(f"import {name}", lambda name=name: importlib.import_module(name)) for name in PRELOAD_MODULES]
+    steps.append(("tokenizer", lambda: get_tokenizer().encode("warmup")))
+    timings = _timed_steps(steps)
+    print(f"🔥 preload: {timings}")
+    return timings
+
+
+def warmup():
+    """
+    ワーカーごとの初期化 (JWKS・各サービスのクライアントと接続) を最初のリクエストより前に行う。
+
+    fork 後のワーカーで実行する。ソケットやスレッドは fork をまたいで共有できないため、
+    preload ではなくこちらで作成する。
+
+    Returns:
+        dict: ステップ名 -> 所要時間 (ミリ秒。失敗した場合は None)
+    """
+    from new_oshietena.jwks import jwks_provider
+    from app import open_ai_service
+    from app.ai_search_service import embedding_service, search_client_registry
+    from app.cosmos_repository import cosmos_repository
+
+    steps = [
+        ("jwks", jwks_provider.start),
+        ("openai client", open_ai_service.get_client),
+        ("embedding client", lambda: embedding_service.client),
+        ("search transport", search_client_registry.warmup),
+        ("cosmos container", lambda: cosmos_repository.container),
+    ]
+    timings = _timed_steps(steps)
+    print(f"🔥 warmup: {timings}")
+    return timings
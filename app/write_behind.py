@@ -0,0 +1,144 @@
+import os
+import time
+import queue
+import atexit
+import asyncio
+import threading
+from app.metrics import observe_dropped_writes
+
+# ===============================
+# 書き込みキュー (write-behind) の設定
+# ===============================
+WRITE_BEHIND_QUEUE_SIZE = int(os.environ.get("WRITE_BEHIND_QUEUE_SIZE", 1000))
+WRITE_BEHIND_WORKERS = int(os.environ.get("WRITE_BEHIND_WORKERS", 2))
+WRITE_BEHIND_MAX_RETRIES = int(os.environ.get("WRITE_BEHIND_MAX_RETRIES", 3))
+# リトライの待ち時間 (秒)。リトライのたびに倍にする
+WRITE_BEHIND_RETRY_SECONDS = float(os.environ.get("WRITE_BEHIND_RETRY_SECONDS", 0.5))
+# キューが満杯の場合に空きを待つ最大秒数。超えた場合は書き込みを破棄する (メトリクスに記録する)
+WRITE_BEHIND_SUBMIT_TIMEOUT = float(os.environ.get("WRITE_BEHIND_SUBMIT_TIMEOUT", 1))
+# プロセス終了時に、残っている書き込みを待つ最大秒数
+WRITE_BEHIND_SHUTDOWN_TIMEOUT = float(os.environ.get("WRITE_BEHIND_SHUTDOWN_TIMEOUT", 10))
+
+
+class WriteBehindQueue:
+    """
+    リクエストの処理が終わった後に実行する書き込みのキュー。
+
+    バックグラウンドのスレッドが順に実行し、失敗した場合はリトライする。
+    キューが満杯の場合は submit_timeout 秒まで空きを待ち (流量を抑える)、空かなければ書き込みを破棄する。
+    呼び出し元で実行すると、Cosmos DB が応答しない間ストリームの終了処理がタイムアウトなしで止まるため。
+    ただしイベントループ上 (ASGI) から呼ばれた場合は、ループを止めないようスレッドプールに渡す。
+    """
+
+    def __init__(self, max_size=WRITE_BEHIND_QUEUE_SIZE, workers=WRITE_BEHIND_WORKERS,
+                 max_retries=WRITE_BEHIND_MAX_RETRIES, retry_seconds=WRITE_BEHIND_RETRY_SECONDS,
+                 submit_timeout=WRITE_BEHIND_SUBMIT_TIMEOUT):
+        self.max_size = max_size
+        self.workers = workers
+        self.max_retries = max_retries
+        self.retry_seconds = retry_seconds
+        self.submit_timeout = submit_timeout
+        self._queue = queue.Queue(maxsize=max_size)
+        self._threads = []
+        self._pid = None
+        self._lock = threading.Lock()
+        self._stats = {"submitted": 0, "completed": 0, "failed": 0, "retries": 0, "dropped": 0, "offloaded": 0}
+
+    def _ensure_workers(self):
+        # fork 後の子プロセスにはスレッドが引き継がれないため、プロセスごとに起動する
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(maxsize=self.max_size)
+            self._threads = [
+                threading.Thread(target=self._worker, name=f"write-behind-{i}", daemon=True)
+                for i in range(self.workers)
+            ]
+            for thread in self._threads:
+                thread.start()
+            self._pid = os.getpid()
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def _run(self, func, args, kwargs):
+        for attempt in range(self.max_retries + 1):
+            try:
+                func(*args, **kwargs)
+                self._count("completed")
+                return
+            except Exception as e:
+                if attempt == self.max_retries:
+                    print(f"❌ バックグラウンドの書き込みに失敗しました ({func.__name__}): {e}")
+                    self._count("failed")
+                    observe_dropped_writes("write_behind", "retries_exhausted")
+                    return
+                self._count("retries")
+                time.sleep(self.retry_seconds * (2 ** attempt))
+
+    def _worker(self):
+        while True:
+            func, args, kwargs = self._queue.get()
+            try:
+                self._run(func, args, kwargs)
+            finally:
+                self._queue.task_done()
+
+    def submit(self, func, *args, **kwargs):
+        """
+        書き込みをキューに追加する。
+
+        Returns:
+            bool: キューに追加できた場合は True。満杯でスレッドプールに渡した、または破棄した場合は False
+        """
+        self._ensure_workers()
+        self._count("submitted")
+        try:
+            self._queue.put_nowait((func, args, kwargs))
+            return True
+        except queue.Full:
+            pass
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if loop is not None:
+            # ループ上では空きを待てないため、スレッドプールで実行する
+            self._count("offloaded")
+            loop.run_in_executor(None, self._run, func, args, kwargs)
+            return False
+
+        try:
+            self._queue.put((func, args, kwargs), timeout=self.submit_timeout)
+            return True
+        except queue.Full:
+            print(f"❌ 書き込みキューが満杯のため破棄しました ({func.__name__})")
+            self._count("dropped")
+            observe_dropped_writes("write_behind", "queue_full")
+            return False
+
+    def flush(self, timeout=WRITE_BEHIND_SHUTDOWN_TIMEOUT):
+        """キュー内の書き込みがすべて終わるまで (最大 timeout 秒) 待つ。"""
+        if self._pid != os.getpid():
+            return True
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if time.monotonic() >= deadline:
+                print(f"⚠️ 未完了の書き込みが {self._queue.unfinished_tasks} 件あります")
+                return False
+            time.sleep(0.05)
+        return True
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["pending"] = self._queue.unfinished_tasks
+        return stats
+
+
+write_behind_queue = WriteBehindQueue()
+atexit.register(write_behind_queue.flush)
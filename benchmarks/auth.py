@@ -0,0 +1,42 @@
+"""
+ベンチマーク用のトークン発行。
+
+RSA 鍵を生成して JWKS ファイルに書き出し (JWKS_URL=file://... で読み込ませる)、
+AzureADJWTAuthentication が検証できる形式のトークンを発行する。
+"""
+import json
+import time
+import uuid
+import jwt
+from jwt.algorithms import RSAAlgorithm
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+
+class TokenIssuer:
+    def __init__(self, tenant_id, client_id, kid=None):
+        self.tenant_id = tenant_id
+        self.client_id = client_id
+        # 実行ごとに鍵を作り直すため、kid も毎回変える
+        self.kid = kid or f"benchmark-{uuid.uuid4().hex[:12]}"
+        self._private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+    def write_jwks(self, path):
+        jwk = json.loads(RSAAlgorithm.to_jwk(self._private_key.public_key()))
+        jwk.update({"kid": self.kid, "use": "sig", "alg": "RS256"})
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"keys": [jwk]}, f)
+        return path
+
+    def issue(self, username, oid=None, lifetime_seconds=3600):
+        now = int(time.time())
+        payload = {
+            "aud": self.client_id,
+            "iss": f"https://sts.windows.net/{self.tenant_id}/",
+            "iat": now,
+            "nbf": now,
+            "exp": now + lifetime_seconds,
+            "oid": oid or str(uuid.uuid4()),
+            "tid": self.tenant_id,
+            "preferred_username": username,
+        }
+        return jwt.encode(payload, self._private_key, algorithm="RS256", headers={"kid": self.kid})
@@ -0,0 +1,205 @@
+"""
+ベンチマーク用の Azure OpenAI (chat / embeddings) と Azure AI Search のフェイクサーバー。
+
+    python -m benchmarks.fake_azure --port 8900 --ttft-ms 400 --tokens-per-second 40
+
+AZURE_OPENAI_ENDPOINT / AZURE_OPENAI_EMBEDDING_ENDPOINT / SEARCH_CLIENT_ENDPOINT に
+http://127.0.0.1:<port> を指定すると、アプリケーションはこのサーバーに接続する。
+各サービスの応答は決定的で、遅延・トークンの生成速度・エラーの割合を指定できる。
+"""
+import time
+import json
+import random
+import asyncio
+import hashlib
+import argparse
+from dataclasses import dataclass, asdict
+from aiohttp import web
+
+
+@dataclass
+class FakeAzureConfig:
+    # 最初のトークンまでの遅延 (ミリ秒) と、その後のトークンの生成速度
+    ttft_ms: float = 300
+    tokens_per_second: float = 50
+    answer_tokens: int = 120
+    # 要約 (stream=False) の応答までの遅延
+    completion_ms: float = 500
+    embedding_ms: float = 30
+    embedding_dimensions: int = 3072
+    search_ms: float = 40
+    search_results: int = 10
+    search_content_chars: int = 400
+    # 各リクエストがエラーになる割合と、そのときのステータスコード (429 / 500 など)
+    error_rate: float = 0.0
+    error_status: int = 429
+
+
+ANSWER_TOKENS = ["回答", "の", "例", "です", "。", "規定", "に", "より", "申請", "が", "必要", "と", "なり", "ます"]
+
+
+def _deterministic_vector(text, dimensions):
+    """入力ごとに同じベクトルを返す (キャッシュのヒット率が実運用と同じように振る舞う)。"""
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "big")
+    generator = random.Random(seed)
+    vector = [generator.uniform(-1, 1) for _ in range(dimensions)]
+    norm = sum(value * value for value in vector) ** 0.5 or 1.0
+    return [value / norm for value in vector]
+
+
+class FakeAzureServer:
+    def __init__(self, config=None):
+        self.config = config or FakeAzureConfig()
+        self.stats = {"chat": 0, "completions": 0, "embeddings": 0, "search": 0, "errors": 0}
+
+    def _inject_error(self):
+        if self.config.error_rate and random.random() < self.config.error_rate:
+            self.stats["errors"] += 1
+            headers = {"Retry-After": "1"} if self.config.error_status == 429 else None
+            return web.json_response(
+                {"error": {"code": str(self.config.error_status), "message": "Injected error (fake)"}},
+                status=self.config.error_status, headers=headers,
+            )
+        return None
+
+    async def handle(self, request):
+        path = request.path
+        if path.endswith("/chat/completions"):
+            return await self.chat_completions(request)
+        if path.endswith("/embeddings"):
+            return await self.embeddings(request)
+        if path.endswith("/docs/search.post.search"):
+            return await self.search(request)
+        if path == "/_stats":
+            return web.json_response({"stats": self.stats, "config": asdict(self.config)})
+        return web.json_response({"error": f"Not found in fake Azure: {path}"}, status=404)
+
+    # ---------- Azure OpenAI: chat ----------
+    async def chat_completions(self, request):
+        body = await request.json()
+        error = self._inject_error()
+        if error is not None:
+            return error
+        model = body.get("model", "fake")
+        created = int(time.time())
+
+        if not body.get("stream"):
+            self.stats["completions"] += 1
+            await asyncio.sleep(self.config.completion_ms / 1000)
+            return web.json_response({
+                "id": "chatcmpl-fake", "object": "chat.completion", "created": created, "model": model,
+                "choices": [{
+                    "index": 0, "finish_reason": "stop",
+                    "message": {"role": "assistant", "content": "これまでの会話の要約 (fake)"},
+                }],
+                "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+            })
+
+        self.stats["chat"] += 1
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+
+        def chunk(delta, finish_reason=None):
+            payload = {
+                "id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": created, "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+            return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode("utf-8")
+
+        # Azure OpenAI と同じく、最初のチャンクは choices が空 (コンテンツフィルターの結果のみ)
+        await response.write(b'data: {"id":"","object":"","created":0,"model":"","choices":[],"prompt_filter_results":[]}\n\n')
+        await asyncio.sleep(self.config.ttft_ms / 1000)
+        await response.write(chunk({"role": "assistant", "content": ""}))
+        interval = 1 / self.config.tokens_per_second if self.config.tokens_per_second > 0 else 0
+        for i in range(self.config.answer_tokens):
+            await response.write(chunk({"content": ANSWER_TOKENS[i % len(ANSWER_TOKENS)]}))
+            if interval:
+                await asyncio.sleep(interval)
+        await response.write(chunk({}, "stop"))
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    # ---------- Azure OpenAI: embeddings ----------
+    async def embeddings(self, request):
+        body = await request.json()
+        error = self._inject_error()
+        if error is not None:
+            return error
+        self.stats["embeddings"] += 1
+        inputs = body.get("input")
+        inputs = [inputs] if isinstance(inputs, str) else inputs
+        await asyncio.sleep(self.config.embedding_ms / 1000)
+        data = [
+            {"object": "embedding", "index": i, "embedding": _deterministic_vector(str(text), self.config.embedding_dimensions)}
+            for i, text in enumerate(inputs)
+        ]
+        return web.json_response({
+            "object": "list", "data": data, "model": body.get("model", "fake"),
+            "usage": {"prompt_tokens": 0, "total_tokens": 0},
+        })
+
+    # ---------- Azure AI Search ----------
+    async def search(self, request):
+        await request.read()
+        error = self._inject_error()
+        if error is not None:
+            return error
+        self.stats["search"] += 1
+        await asyncio.sleep(self.config.search_ms / 1000)
+        content = ("社内規定の抜粋 (fake) " * 64)[:self.config.search_content_chars]
+        value = [
+            {"@search.score": round(1.0 - i * 0.01, 4), "content": f"[{i}] {content}"}
+            for i in range(self.config.search_results)
+        ]
+        return web.json_response({"value": value})
+
+
+def create_app(config=None):
+    server = FakeAzureServer(config)
+    app = web.Application(client_max_size=64 * 1024 * 1024)
+    app.router.add_route("*", "/{tail:.*}", server.handle)
+    app["fake_azure"] = server
+    return app
+
+
+def add_arguments(parser):
+    defaults = FakeAzureConfig()
+    parser.add_argument("--ttft-ms", type=float, default=defaults.ttft_ms, help="最初のトークンまでの遅延 (ミリ秒)")
+    parser.add_argument("--tokens-per-second", type=float, default=defaults.tokens_per_second, help="トークンの生成速度 (0 で待たない)")
+    parser.add_argument("--answer-tokens", type=int, default=defaults.answer_tokens, help="回答のトークン数")
+    parser.add_argument("--completion-ms", type=float, default=defaults.completion_ms, help="要約 (stream=False) の遅延")
+    parser.add_argument("--embedding-ms", type=float, default=defaults.embedding_ms, help="embeddings の遅延")
+    parser.add_argument("--embedding-dimensions", type=int, default=defaults.embedding_dimensions, help="ベクトルの次元数")
+    parser.add_argument("--search-ms", type=float, default=defaults.search_ms, help="検索の遅延")
+    parser.add_argument("--search-results", type=int, default=defaults.search_results, help="検索結果の件数")
+    parser.add_argument("--error-rate", type=float, default=defaults.error_rate, help="エラーを返す割合 (0〜1)")
+    parser.add_argument("--error-status", type=int, default=defaults.error_status, help="エラー時のステータスコード")
+
+
+def config_from_arguments(args):
+    return FakeAzureConfig(
+        ttft_ms=args.ttft_ms,
+        tokens_per_second=args.tokens_per_second,
+        answer_tokens=args.answer_tokens,
+        completion_ms=args.completion_ms,
+        embedding_ms=args.embedding_ms,
+        embedding_dimensions=args.embedding_dimensions,
+        search_ms=args.search_ms,
+        search_results=args.search_results,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Azure OpenAI / AI Search のフェイクサーバー")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    add_arguments(parser)
+    args = parser.parse_args()
+    web.run_app(create_app(config_from_arguments(args)), host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
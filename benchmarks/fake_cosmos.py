@@ -0,0 +1,287 @@
+"""
+ベンチマーク用の Cosmos DB コンテナのフェイク (プロセス内)。
+
+COSMOS_CONTAINER_FACTORY=benchmarks.fake_cosmos:create_container を指定すると、
+cosmos_repository が実際の CosmosClient の代わりにこのコンテナを使う。
+データは各ワーカープロセスのメモリに保持し、FAKE_COSMOS_SEED の JSON (ドキュメントのリスト) で初期化する。
+
+このアプリケーションが発行するクエリ (= / != / >= / <= / IS_DEFINED / ORDER BY / COUNT / DISTINCT VALUE)
+だけを解釈する簡易的な実装で、Cosmos DB の SQL 全体には対応しない。
+"""
+import os
+import re
+import copy
+import json
+import time
+import random
+import threading
+from azure.core.paging import ItemPaged
+from azure.cosmos import exceptions
+
+FAKE_COSMOS_SEED = os.environ.get("FAKE_COSMOS_SEED")
+# 1 回の操作あたりの遅延 (ミリ秒) と、エラー (429) を返す割合
+FAKE_COSMOS_LATENCY_MS = float(os.environ.get("FAKE_COSMOS_LATENCY_MS", 5))
+FAKE_COSMOS_ERROR_RATE = float(os.environ.get("FAKE_COSMOS_ERROR_RATE", 0))
+
+# raw_response_hook に渡す RU の目安 (実際の Cosmos DB の値ではない)
+POINT_READ_RU = 1.0
+WRITE_RU = 6.0
+QUERY_BASE_RU = 2.8
+QUERY_RU_PER_DOCUMENT = 0.05
+
+SELECT_PATTERN = re.compile(
+    r"^\s*SELECT\s+(?P<select>.+?)\s+FROM\s+c\s*(?:WHERE\s+(?P<where>.+?))?\s*(?:ORDER\s+BY\s+c\.(?P<order>\w+)\s*(?P<direction>ASC|DESC)?)?\s*$",
+    re.IGNORECASE | re.DOTALL,
+)
+COMPARISON_PATTERN = re.compile(r"^c\.(\w+)\s*(=|!=|>=|<=|>|<)\s*(@\w+)$")
+IS_DEFINED_PATTERN = re.compile(r"^(NOT\s+)?IS_DEFINED\(c\.(\w+)\)$", re.IGNORECASE)
+MISSING = object()
+
+OPERATORS = {
+    "=": lambda a, b: a == b,
+    "!=": lambda a, b: a != b,
+    ">=": lambda a, b: a >= b,
+    "<=": lambda a, b: a <= b,
+    ">": lambda a, b: a > b,
+    "<": lambda a, b: a < b,
+}
+
+
+def _split(expression, keyword):
+    """括弧の外にある AND / OR で式を分割する。"""
+    parts, depth, start = [], 0, 0
+    pattern = re.compile(rf"\s+{keyword}\s+", re.IGNORECASE)
+    i = 0
+    while i < len(expression):
+        char = expression[i]
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif depth == 0:
+            match = pattern.match(expression, i)
+            if match:
+                parts.append(expression[start:i])
+                i = start = match.end()
+                continue
+        i += 1
+    parts.append(expression[start:])
+    return [part.strip() for part in parts]
+
+
+def _strip_parentheses(expression):
+    expression = expression.strip()
+    while expression.startswith("(") and expression.endswith(")"):
+        depth = 0
+        for i, char in enumerate(expression):
+            depth += char == "("
+            depth -= char == ")"
+            if depth == 0 and i < len(expression) - 1:
+                return expression
+        expression = expression[1:-1].strip()
+    return expression
+
+
+def _evaluate(expression, document, parameters):
+    expression = _strip_parentheses(expression)
+    alternatives = _split(expression, "OR")
+    if len(alternatives) > 1:
+        return any(_evaluate(part, document, parameters) for part in alternatives)
+    conditions = _split(expression, "AND")
+    if len(conditions) > 1:
+        return all(_evaluate(part, document, parameters) for part in conditions)
+
+    match = IS_DEFINED_PATTERN.match(expression)
+    if match:
+        defined = match.group(2) in document
+        return not defined if match.group(1) else defined
+    match = COMPARISON_PATTERN.match(expression)
+    if match:
+        field, operator, parameter = match.groups()
+        value = document.get(field, MISSING)
+        if value is MISSING:
+            return False
+        try:
+            return OPERATORS[operator](value, parameters[parameter])
+        except TypeError:
+            return False
+    raise ValueError(f"Unsupported condition in fake Cosmos DB: {expression}")
+
+
+def _project(select, documents):
+    select = select.strip()
+    if re.fullmatch(r"VALUE\s+COUNT\(1\)", select, re.IGNORECASE):
+        return [len(documents)]
+    match = re.fullmatch(r"DISTINCT\s+VALUE\s+c\.(\w+)", select, re.IGNORECASE)
+    if match:
+        values = []
+        for document in documents:
+            value = document.get(match.group(1), MISSING)
+            if value is not MISSING and value not in values:
+                values.append(value)
+        return values
+    if select == "*":
+        return [copy.deepcopy(document) for document in documents]
+
+    fields = []
+    for column in select.split(","):
+        match = re.fullmatch(r"\s*c\.(\w+)(?:\s+AS\s+(\w+))?\s*", column, re.IGNORECASE)
+        if not match:
+            raise ValueError(f"Unsupported select in fake Cosmos DB: {column}")
+        fields.append((match.group(1), match.group(2) or match.group(1)))
+    return [
+        {alias: copy.deepcopy(document[field]) for field, alias in fields if field in document}
+        for document in documents
+    ]
+
+
+class _FakeHttpResponse:
+    def __init__(self, request_charge):
+        self.headers = {"x-ms-request-charge": f"{request_charge:.2f}"}
+
+
+class _FakePipelineResponse:
+    def __init__(self, request_charge):
+        self.http_response = _FakeHttpResponse(request_charge)
+
+
+def _charge(kwargs, request_charge):
+    """raw_response_hook を指定された場合は、Cosmos DB と同じく RU をヘッダーで渡す。"""
+    hook = kwargs.get("raw_response_hook")
+    if hook is not None:
+        hook(_FakePipelineResponse(request_charge))
+
+
+class FakeContainer:
+    """ContainerProxy のうち、このアプリケーションが使うメソッドだけを持つフェイク。"""
+
+    def __init__(self, documents=(), latency_ms=FAKE_COSMOS_LATENCY_MS, error_rate=FAKE_COSMOS_ERROR_RATE):
+        self.latency_ms = latency_ms
+        self.error_rate = error_rate
+        # (パーティションキー, ID) -> ドキュメント
+        self._documents = {}
+        self._lock = threading.Lock()
+        for document in documents:
+            self._documents[(self._partition_key(document), document["id"])] = copy.deepcopy(document)
+
+    @staticmethod
+    def _partition_key(document):
+        return document.get("userId") or document.get("AvailableuserId") or document["id"]
+
+    def _simulate(self):
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        if self.error_rate and random.random() < self.error_rate:
+            raise exceptions.CosmosHttpResponseError(status_code=429, message="Request rate is large (fake)")
+
+    # ---------- 読み取り ----------
+    def read_item(self, item, partition_key, **kwargs):
+        self._simulate()
+        with self._lock:
+            document = self._documents.get((partition_key, item))
+        _charge(kwargs, POINT_READ_RU)
+        if document is None:
+            raise exceptions.CosmosResourceNotFoundError(status_code=404, message=f"{item} not found")
+        return copy.deepcopy(document)
+
+    def _query(self, query, parameters, partition_key):
+        """クエリの結果と、評価したドキュメント数を返す。"""
+        match = SELECT_PATTERN.match(query)
+        if not match:
+            raise ValueError(f"Unsupported query in fake Cosmos DB: {query}")
+        values = {parameter["name"]: parameter["value"] for parameter in parameters or []}
+        with self._lock:
+            documents = [
+                document for (key, _), document in self._documents.items()
+                if partition_key is None or key == partition_key
+            ]
+        scanned = len(documents)
+        if match.group("where"):
+            documents = [document for document in documents if _evaluate(match.group("where"), document, values)]
+        if match.group("order"):
+            field = match.group("order")
+            documents.sort(
+                key=lambda document: document.get(field, ""),
+                reverse=(match.group("direction") or "ASC").upper() == "DESC",
+            )
+        return _project(match.group("select"), documents), scanned
+
+    def query_items(self, query, parameters=None, partition_key=None, enable_cross_partition_query=None,
+                    max_item_count=None, **kwargs):
+        self._simulate()
+        results, scanned = self._query(query, parameters, partition_key)
+        page_size = max_item_count or len(results) or 1
+
+        def get_next(continuation_token):
+            start = int(continuation_token or 0)
+            _charge(kwargs, QUERY_BASE_RU + QUERY_RU_PER_DOCUMENT * scanned)
+            return start, results[start:start + page_size]
+
+        def extract_data(response):
+            start, items = response
+            next_start = start + len(items)
+            return (str(next_start) if next_start < len(results) else None), iter(items)
+
+        return ItemPaged(get_next, extract_data)
+
+    # ---------- 書き込み ----------
+    def create_item(self, body, **kwargs):
+        self._simulate()
+        key = (self._partition_key(body), body["id"])
+        _charge(kwargs, WRITE_RU)
+        with self._lock:
+            if key in self._documents:
+                raise exceptions.CosmosResourceExistsError(status_code=409, message=f"{body['id']} already exists")
+            self._documents[key] = copy.deepcopy(body)
+        return copy.deepcopy(body)
+
+    def upsert_item(self, body, **kwargs):
+        self._simulate()
+        _charge(kwargs, WRITE_RU)
+        with self._lock:
+            self._documents[(self._partition_key(body), body["id"])] = copy.deepcopy(body)
+        return copy.deepcopy(body)
+
+    def patch_item(self, item, partition_key, patch_operations, **kwargs):
+        self._simulate()
+        _charge(kwargs, WRITE_RU)
+        with self._lock:
+            document = self._documents.get((partition_key, item))
+            if document is None:
+                raise exceptions.CosmosResourceNotFoundError(status_code=404, message=f"{item} not found")
+            for operation in patch_operations:
+                field = operation["path"].lstrip("/")
+                if operation["op"] == "incr":
+                    document[field] = document.get(field, 0) + operation["value"]
+                elif operation["op"] in ("set", "add", "replace"):
+                    document[field] = operation["value"]
+                elif operation["op"] == "remove":
+                    document.pop(field, None)
+            return copy.deepcopy(document)
+
+    def execute_item_batch(self, batch_operations, partition_key, **kwargs):
+        self._simulate()
+        _charge(kwargs, WRITE_RU * len(batch_operations))
+        with self._lock:
+            for index, (operation, args, *_) in enumerate(batch_operations):
+                if operation == "create" and (partition_key, args[0]["id"]) in self._documents:
+                    raise exceptions.CosmosBatchOperationError(
+                        error_index=index, headers={}, status_code=409,
+                        message=f"{args[0]['id']} already exists", operation_responses=[],
+                    )
+            results = []
+            for operation, args, *_ in batch_operations:
+                if operation not in ("create", "upsert"):
+                    raise ValueError(f"Unsupported batch operation in fake Cosmos DB: {operation}")
+                self._documents[(partition_key, args[0]["id"])] = copy.deepcopy(args[0])
+                results.append({"statusCode": 201, "resourceBody": copy.deepcopy(args[0])})
+        return results
+
+
+def create_container():
+    """COSMOS_CONTAINER_FACTORY から呼び出される。FAKE_COSMOS_SEED のドキュメントで初期化する。"""
+    documents = []
+    if FAKE_COSMOS_SEED:
+        with open(FAKE_COSMOS_SEED, "r", encoding="utf-8") as f:
+            documents = json.load(f)
+    return FakeContainer(documents)
@@ -0,0 +1,300 @@
+"""
+/api/chat/ ・ /api/history/ ・ /api/checkcount/ に負荷をかけるドライバー。
+
+    python -m benchmarks.load_driver --base-url http://127.0.0.1:8000 --users users.json \
+        --concurrency 32 --duration 60 --mix chat=1,history=3,checkcount=2 --server-pid 1234
+
+users.json は run.py が作成する ({"username", "token", "historyBoxIds", "startDay"} のリスト)。
+スループット・p50/p95/p99 レイテンシ・SSE の最初のフレームまでの時間 (TTFB) と、
+--server-pid を指定した場合はワーカーごとのメモリ (RSS) を集計する。
+"""
+import os
+import json
+import time
+import uuid
+import random
+import asyncio
+import argparse
+import aiohttp
+
+ENDPOINTS = ("chat", "history", "checkcount")
+DEFAULT_MIX = "chat=1,history=3,checkcount=2"
+QUESTIONS = [
+    "有給休暇の申請方法を教えてください",
+    "出張旅費の精算期限はいつですか",
+    "在宅勤務の申請に必要な書類は何ですか",
+    "慶弔休暇は何日取得できますか",
+    "社内システムのパスワードを忘れた場合はどうすればよいですか",
+]
+
+
+def parse_mix(mix):
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in ENDPOINTS:
+            raise ValueError(f"Unknown endpoint in mix: {name} (choose from {', '.join(ENDPOINTS)})")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(int(round(q / 100 * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+def summarize(values):
+    return {
+        "count": len(values),
+        "mean_ms": round(sum(values) / len(values), 1) if values else None,
+        "p50_ms": _round(percentile(values, 50)),
+        "p95_ms": _round(percentile(values, 95)),
+        "p99_ms": _round(percentile(values, 99)),
+        "max_ms": _round(max(values) if values else None),
+    }
+
+
+def _round(value):
+    return round(value, 1) if value is not None else None
+
+
+# ===============================
+# ワーカーごとのメモリ (Linux の /proc から取得)
+# ===============================
+def child_pids(pid):
+    children = set()
+    try:
+        for task in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{task}/children", "r") as f:
+                children.update(int(child) for child in f.read().split())
+    except OSError:
+        pass
+    return sorted(children)
+
+
+def rss_mb(pid):
+    try:
+        with open(f"/proc/{pid}/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+class MemorySampler:
+    """サーバー (gunicorn のマスター) とワーカーの RSS を定期的に記録する。"""
+
+    def __init__(self, server_pid, interval=1.0):
+        self.server_pid = server_pid
+        self.interval = interval
+        self.samples = {}
+
+    def sample(self):
+        for pid in [self.server_pid] + child_pids(self.server_pid):
+            value = rss_mb(pid)
+            if value is not None:
+                self.samples.setdefault(pid, []).append(value)
+
+    async def run(self, stop_event):
+        while not stop_event.is_set():
+            self.sample()
+            try:
+                await asyncio.wait_for(stop_event.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def report(self):
+        return {
+            str(pid): {
+                "role": "master" if pid == self.server_pid else "worker",
+                "start_mb": round(values[0], 1),
+                "end_mb": round(values[-1], 1),
+                "peak_mb": round(max(values), 1),
+            }
+            for pid, values in self.samples.items()
+        }
+
+
+# ===============================
+# 負荷の生成
+# ===============================
+class LoadDriver:
+    def __init__(self, base_url, users, weights, concurrency, duration, persist=False, history_page_size=None,
+                 chat_path="/api/chat/", timeout=300):
+        self.base_url = base_url.rstrip("/")
+        self.chat_path = chat_path
+        self.users = users
+        self.weights = weights
+        self.concurrency = concurrency
+        self.duration = duration
+        self.persist = persist
+        self.history_page_size = history_page_size
+        self.timeout = timeout
+        self.latencies = {name: [] for name in weights}
+        self.ttfb = []
+        self.statuses = {name: {} for name in weights}
+        self.errors = {name: 0 for name in weights}
+
+    def _record(self, endpoint, status, started_at, ok):
+        self.latencies[endpoint].append((time.perf_counter() - started_at) * 1000)
+        key = str(status)
+        self.statuses[endpoint][key] = self.statuses[endpoint].get(key, 0) + 1
+        if not ok:
+            self.errors[endpoint] += 1
+
+    async def chat(self, session, user):
+        body = {
+            "messages": [{"role": "user", "content": random.choice(QUESTIONS)}],
+            "historyBoxId": random.choice(user["historyBoxIds"]),
+        }
+        if self.persist:
+            body.update({"persist": True, "conversationId": str(uuid.uuid4())})
+        started_at = time.perf_counter()
+        # フロントエンドと同じく、利用開始日と CSRF トークンのヘッダーを付ける
+        headers = dict(self._headers(user), **{"x-usage-startdate": user.get("startDay", ""), "x-csrftoken": "benchmark"})
+        async with session.post(f"{self.base_url}{self.chat_path}", json=body, headers=headers) as response:
+            first_frame = None
+            errored = False
+            async for line in response.content:
+                if first_frame is None and line.startswith(b"data:"):
+                    first_frame = time.perf_counter()
+                if line.startswith(b'data: {"error"'):
+                    errored = True
+            if first_frame is not None:
+                self.ttfb.append((first_frame - started_at) * 1000)
+            self._record("chat", response.status, started_at, response.status == 200 and not errored)
+
+    async def history(self, session, user):
+        params = {"historyBoxId": random.choice(user["historyBoxIds"])}
+        if self.history_page_size:
+            params["pageSize"] = str(self.history_page_size)
+        started_at = time.perf_counter()
+        async with session.get(f"{self.base_url}/api/history/", params=params, headers=self._headers(user)) as response:
+            await response.read()
+            self._record("history", response.status, started_at, response.status == 200)
+
+    async def checkcount(self, session, user):
+        started_at = time.perf_counter()
+        async with session.get(f"{self.base_url}/api/checkcount/", headers=self._headers(user)) as response:
+            await response.read()
+            # 上限に達した場合の 403 なども正常な応答として扱う
+            self._record("checkcount", response.status, started_at, response.status < 500)
+
+    @staticmethod
+    def _headers(user):
+        return {"Authorization": f"Bearer {user['token']}"}
+
+    async def _worker(self, session, deadline):
+        names = list(self.weights)
+        weights = [self.weights[name] for name in names]
+        while time.perf_counter() < deadline:
+            endpoint = random.choices(names, weights)[0]
+            user = random.choice(self.users)
+            started_at = time.perf_counter()
+            try:
+                await getattr(self, endpoint)(session, user)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                self._record(endpoint, type(e).__name__, started_at, False)
+
+    async def run(self, server_pid=None):
+        stop_event = asyncio.Event()
+        sampler = MemorySampler(server_pid) if server_pid else None
+        sampler_task = asyncio.create_task(sampler.run(stop_event)) if sampler else None
+
+        connector = aiohttp.TCPConnector(limit=self.concurrency)
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            started_at = time.perf_counter()
+            deadline = started_at + self.duration
+            await asyncio.gather(*(self._worker(session, deadline) for _ in range(self.concurrency)))
+            elapsed = time.perf_counter() - started_at
+
+        stop_event.set()
+        if sampler_task:
+            await sampler_task
+            sampler.sample()
+        return self.report(elapsed, sampler)
+
+    def report(self, elapsed, sampler=None):
+        total = sum(len(values) for values in self.latencies.values())
+        endpoints = {}
+        for name, values in self.latencies.items():
+            endpoints[name] = summarize(values)
+            endpoints[name].update({
+                "throughput_rps": round(len(values) / elapsed, 2) if elapsed else None,
+                "errors": self.errors[name],
+                "statuses": self.statuses[name],
+            })
+        report = {
+            "duration_s": round(elapsed, 2),
+            "concurrency": self.concurrency,
+            "requests": total,
+            "throughput_rps": round(total / elapsed, 2) if elapsed else None,
+            "errors": sum(self.errors.values()),
+            "endpoints": endpoints,
+            "chat_ttfb": summarize(self.ttfb),
+        }
+        if sampler:
+            report["memory"] = sampler.report()
+        return report
+
+
+def format_report(report):
+    lines = [
+        f"duration {report['duration_s']}s / concurrency {report['concurrency']} / "
+        f"{report['requests']} requests ({report['throughput_rps']} req/s) / errors {report['errors']}",
+        f"{'endpoint':<12}{'count':>8}{'req/s':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'errors':>8}",
+    ]
+    rows = list(report["endpoints"].items()) + [("chat ttfb", report["chat_ttfb"])]
+    for name, values in rows:
+        lines.append(
+            f"{name:<12}{values['count']:>8}{values.get('throughput_rps', '') or '':>9}"
+            f"{values['p50_ms'] or '-':>9}{values['p95_ms'] or '-':>9}{values['p99_ms'] or '-':>9}"
+            f"{values.get('errors', ''):>8}"
+        )
+    for pid, memory in report.get("memory", {}).items():
+        lines.append(
+            f"{memory['role']:<7} pid {pid:<8} rss {memory['start_mb']} -> {memory['end_mb']} MB "
+            f"(peak {memory['peak_mb']} MB)"
+        )
+    return "\n".join(lines)
+
+
+def add_arguments(parser):
+    parser.add_argument("--concurrency", type=int, default=16, help="同時に実行するリクエスト数")
+    parser.add_argument("--duration", type=float, default=30, help="負荷をかける秒数")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="エンドポイントの比率 (例: chat=1,history=3,checkcount=2)")
+    parser.add_argument("--chat-path", default="/api/chat/", help="チャットのパス (asgi モードでは /api/chat/async/)")
+    parser.add_argument("--persist", action="store_true", help="チャットの回答をサーバー側で保存させる")
+    parser.add_argument("--history-page-size", type=int, default=None, help="履歴をページングで取得する件数")
+    parser.add_argument("--json", dest="json_path", default=None, help="結果を JSON で書き出すファイル")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="負荷テストのドライバー")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--users", required=True, help="ユーザーとトークンの JSON ファイル")
+    parser.add_argument("--server-pid", type=int, default=None, help="メモリを計測するサーバー (マスター) の PID")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    with open(args.users, "r", encoding="utf-8") as f:
+        users = json.load(f)
+    driver = LoadDriver(args.base_url, users, parse_mix(args.mix), args.concurrency, args.duration,
+                        persist=args.persist, history_page_size=args.history_page_size,
+                        chat_path=args.chat_path)
+    report = asyncio.run(driver.run(args.server_pid))
+    print(format_report(report))
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
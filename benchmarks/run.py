@@ -0,0 +1,240 @@
+"""
+オフラインのベンチマークをまとめて実行する。
+
+    python -m benchmarks.run --mode threads --workers 2 --concurrency 32 --duration 60 --json result.json
+
+1. フェイクの Azure OpenAI / AI Search サーバー (fake_azure) を起動する
+2. フェイクの Cosmos DB (fake_cosmos) の初期データ・JWKS・ユーザーのトークンを作成する
+3. 環境変数で接続先をフェイクに向けて ``manage.py serve`` を起動する
+4. 負荷ドライバー (load_driver) を実行し、結果を表示する
+
+Azure のサービスには一切接続しない。
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import socket
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from datetime import datetime, timedelta, timezone
+from benchmarks import fake_azure, load_driver
+from benchmarks.auth import TokenIssuer
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TENANT_ID = "00000000-0000-0000-0000-00000000bench"
+CLIENT_ID = "benchmark-client"
+
+
+def build_term(now):
+    return {
+        "start": (now - timedelta(days=30)).strftime("%Y-%m-%dT00:00:00Z"),
+        "end": (now + timedelta(days=335)).strftime("%Y-%m-%dT00:00:00Z"),
+    }
+
+
+def build_seed(users, history_boxes, conversations_per_box):
+    """ユーザーごとの利用期間・履歴ボックスのサマリー・会話のドキュメントを作る。"""
+    now = datetime.now(timezone.utc)
+    term = build_term(now)
+    documents = []
+    for user in users:
+        user_id = user["username"]
+        documents.append({
+            "id": f"term-{user_id}", "userId": user_id, "AvailableuserId": user_id, "AvailableTerm": term,
+        })
+        for box_index, history_box_id in enumerate(user["historyBoxIds"]):
+            created_at = (now - timedelta(days=box_index + 1)).isoformat()
+            conversation_ids = [str(uuid.uuid4()) for _ in range(conversations_per_box)]
+            for i, conversation_id in enumerate(conversation_ids):
+                documents.append({
+                    "id": conversation_id, "tenantId": TENANT_ID, "userId": user_id,
+                    "title": f"質問 {box_index}-{i}", "question": f"質問 {box_index}-{i}",
+                    "answer": "回答 (benchmark) " * 20, "historyBoxId": history_box_id,
+                    "createdAt": (now - timedelta(days=box_index + 1, minutes=-i)).isoformat(),
+                    "type": "conversation",
+                })
+            documents.append({
+                "id": f"historyBox-{history_box_id}", "type": "historyBox", "tenantId": TENANT_ID,
+                "userId": user_id, "historyBoxId": history_box_id, "title": f"質問 {box_index}-0",
+                "firstConversationId": conversation_ids[0] if conversation_ids else None,
+                "createdAt": created_at, "updatedAt": created_at, "messageCount": conversations_per_box,
+            })
+        # backfill_history_boxes の実行後と同じ状態にする (初回の一覧取得で全会話を読まない)
+        documents.append({"id": "historyBoxesBackfilled", "type": "historyBoxesBackfilled", "userId": user_id})
+    return documents
+
+
+def build_users(issuer, count, history_boxes):
+    start_day = build_term(datetime.now(timezone.utc))["start"][:10]
+    return [
+        {
+            "username": f"bench{i:04d}@example.com",
+            "token": issuer.issue(f"bench{i:04d}@example.com", lifetime_seconds=24 * 3600),
+            "historyBoxIds": [str(uuid.uuid4()) for _ in range(history_boxes)],
+            "startDay": start_day,
+        }
+        for i in range(count)
+    ]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port, timeout, process=None):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"プロセスが終了しました (exit code {process.returncode})")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise TimeoutError(f"ポート {port} が {timeout} 秒以内に開きませんでした")
+
+
+def server_environment(args, workdir, azure_url, seed_path, jwks_path):
+    env = dict(os.environ)
+    env.update({
+        "PYTHONPATH": os.pathsep.join(filter(None, [BASE_DIR, env.get("PYTHONPATH")])),
+        "SECRET_KEY": env.get("SECRET_KEY") or "benchmark",
+        "DEPLOYMENT": "benchmark",
+        "AZURE_OPENAI_ENDPOINT": azure_url,
+        "AZURE_OPENAI_EMBEDDING_ENDPOINT": azure_url,
+        "AZURE_OPENAI_KEY": "benchmark",
+        "AZURE_OPENAI_API_VERSION": "2024-02-01",
+        "SEARCH_CLIENT_ENDPOINT": azure_url,
+        "AZURE_KEY_CREDENTIAL": "benchmark",
+        "APIM_SUBSCRIPTION_KEY": "benchmark",
+        "COSMOS_CONTAINER_FACTORY": "benchmarks.fake_cosmos:create_container",
+        "FAKE_COSMOS_SEED": seed_path,
+        "FAKE_COSMOS_LATENCY_MS": str(args.cosmos_latency_ms),
+        "FAKE_COSMOS_ERROR_RATE": str(args.cosmos_error_rate),
+        "VITE_APP_TENANT_ID": TENANT_ID,
+        "VITE_APP_CLIENT_ID": CLIENT_ID,
+        "JWKS_URL": f"file://{jwks_path}",
+        "JWKS_CACHE_PATH": os.path.join(workdir, "jwks_cache.json"),
+        # ベンチマークのユーザーを db.sqlite3 に保存しない
+        "AUTH_STATELESS_USERS": "true",
+        # 実行ごとの状態をリポジトリ内に残さない
+        "EMBEDDING_CACHE_PATH": os.path.join(workdir, "embedding_cache.sqlite3"),
+        "LOCAL_INDEX_DIR": os.path.join(workdir, "local_indexes"),
+        "INDEX_VERSION_DB_PATH": os.path.join(workdir, "index_versions.sqlite3"),
+        "PROFILE_DIR": os.path.join(workdir, "profiles"),
+        "SINGLE_FLIGHT_LOCK_DIR": os.path.join(workdir, "single_flight_locks"),
+        "SERVE_BIND": f"127.0.0.1:{args.port}",
+        "SERVE_ACCESS_LOG": env.get("SERVE_ACCESS_LOG", os.path.join(workdir, "access.log")),
+    })
+    if args.cache_mode == "cold":
+        # 各種キャッシュを無効にして、毎回フェイクのサービスまで到達させる
+        env.update({
+            "EMBEDDING_CACHE_ENABLED": "false",
+            "SEARCH_RESULT_CACHE_ENABLED": "false",
+            "SEMANTIC_CACHE_ENABLED": "false",
+        })
+    return env
+
+
+def start_process(argv, env, log_path):
+    log = open(log_path, "w", encoding="utf-8")
+    return subprocess.Popen(argv, env=env, cwd=BASE_DIR, stdout=log, stderr=subprocess.STDOUT)
+
+
+def stop_process(process, timeout=15):
+    if process is None or process.poll() is not None:
+        return
+    process.terminate()
+    try:
+        process.wait(timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="フェイクの Azure サービスを使ったオフラインのベンチマーク")
+    parser.add_argument("--mode", choices=["threads", "gevent", "asgi"], default="threads", help="serve の並行処理モデル")
+    parser.add_argument("--workers", type=int, default=2, help="ワーカープロセス数")
+    parser.add_argument("--threads", type=int, default=None, help="threads モードのワーカーあたりのスレッド数")
+    parser.add_argument("--port", type=int, default=None, help="アプリケーションのポート (省略時は空きポート)")
+    parser.add_argument("--users", dest="user_count", type=int, default=50, help="ユーザー数")
+    parser.add_argument("--history-boxes", type=int, default=20, help="ユーザーあたりの履歴ボックス数")
+    parser.add_argument("--conversations-per-box", type=int, default=5, help="履歴ボックスあたりの会話数")
+    parser.add_argument("--cosmos-latency-ms", type=float, default=5, help="フェイクの Cosmos DB の遅延 (ミリ秒)")
+    parser.add_argument("--cosmos-error-rate", type=float, default=0.0, help="フェイクの Cosmos DB がエラーを返す割合")
+    parser.add_argument("--cache-mode", choices=["warm", "cold"], default="warm", help="cold の場合は埋め込み・検索結果・回答のキャッシュを無効にする")
+    parser.add_argument("--startup-timeout", type=float, default=120, help="サーバーの起動を待つ秒数")
+    parser.add_argument("--workdir", default=None, help="ログや初期データを置くディレクトリ (省略時は一時ディレクトリ)")
+    fake_azure.add_arguments(parser)
+    load_driver.add_arguments(parser)
+    args = parser.parse_args()
+    args.port = args.port or free_port()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="oshietena-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    print(f"📁 作業ディレクトリ: {workdir}")
+
+    issuer = TokenIssuer(TENANT_ID, CLIENT_ID)
+    # 前回の実行で保存された JWKS (別の鍵) を読み込ませない
+    if os.path.exists(os.path.join(workdir, "jwks_cache.json")):
+        os.remove(os.path.join(workdir, "jwks_cache.json"))
+    jwks_path = issuer.write_jwks(os.path.join(workdir, "jwks.json"))
+    users = build_users(issuer, args.user_count, args.history_boxes)
+    seed_path = os.path.join(workdir, "cosmos_seed.json")
+    with open(seed_path, "w", encoding="utf-8") as f:
+        json.dump(build_seed(users, args.history_boxes, args.conversations_per_box), f, ensure_ascii=False)
+    with open(os.path.join(workdir, "users.json"), "w", encoding="utf-8") as f:
+        json.dump(users, f)
+
+    azure_port = free_port()
+    fake_azure_argv = [
+        sys.executable, "-m", "benchmarks.fake_azure", "--port", str(azure_port),
+        "--ttft-ms", str(args.ttft_ms), "--tokens-per-second", str(args.tokens_per_second),
+        "--answer-tokens", str(args.answer_tokens), "--completion-ms", str(args.completion_ms),
+        "--embedding-ms", str(args.embedding_ms), "--embedding-dimensions", str(args.embedding_dimensions),
+        "--search-ms", str(args.search_ms), "--search-results", str(args.search_results),
+        "--error-rate", str(args.error_rate), "--error-status", str(args.error_status),
+    ]
+    env = server_environment(args, workdir, f"http://127.0.0.1:{azure_port}", seed_path, jwks_path)
+    serve_argv = [sys.executable, "manage.py", "serve", "--mode", args.mode, "--workers", str(args.workers)]
+    if args.threads:
+        serve_argv += ["--threads", str(args.threads)]
+
+    azure_process = server_process = None
+    try:
+        azure_process = start_process(fake_azure_argv, env, os.path.join(workdir, "fake_azure.log"))
+        wait_for_port(azure_port, 30, azure_process)
+        server_process = start_process(serve_argv, env, os.path.join(workdir, "server.log"))
+        wait_for_port(args.port, args.startup_timeout, server_process)
+        print(f"🚀 サーバーを起動しました: mode={args.mode} workers={args.workers} port={args.port}")
+
+        chat_path = "/api/chat/async/" if args.mode == "asgi" and args.chat_path == "/api/chat/" else args.chat_path
+        driver = load_driver.LoadDriver(
+            f"http://127.0.0.1:{args.port}", users, load_driver.parse_mix(args.mix), args.concurrency,
+            args.duration, persist=args.persist, history_page_size=args.history_page_size, chat_path=chat_path,
+        )
+        report = asyncio.run(driver.run(server_process.pid))
+        report["settings"] = {
+            "mode": args.mode, "workers": args.workers, "threads": args.threads, "chat_path": chat_path,
+            "cache_mode": args.cache_mode, "cosmos_latency_ms": args.cosmos_latency_ms,
+            "fake_azure": fake_azure.config_from_arguments(args).__dict__,
+        }
+        print(load_driver.format_report(report))
+        if args.json_path:
+            with open(args.json_path, "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+            print(f"📝 結果を保存しました: {args.json_path}")
+    finally:
+        stop_process(server_process)
+        stop_process(azure_process)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,10 @@
 import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
 import jwt
-from jwt import PyJWKClient
+from new_oshietena.jwks import jwks_provider
 from rest_framework.authentication import BaseAuthentication
 from rest_framework.exceptions import AuthenticationFailed
 from django.contrib.auth.models import User # DjangoのUserモデルを利用
@@ -8,9 +12,98 @@ from django.contrib.auth.models import User # DjangoのUserモデルを利用
 # --- Azure AD 認証のための設定 ---
 SYSTENA_TENANT_ID = os.environ.get("VITE_APP_TENANT_ID")
 CLIENT_ID = os.environ.get("VITE_APP_CLIENT_ID")
-JWKS_URL = f"https://login.microsoftonline.com/{SYSTENA_TENANT_ID}/discovery/v2.0/keys"
 AUDIENCE = f"api://{CLIENT_ID}"
-JWK_CLIENT = PyJWKClient(JWKS_URL, cache_keys=True)
+# 署名鍵は起動時に読み込み、バックグラウンドで更新する (new_oshietena/jwks.py)
+JWK_CLIENT = jwks_provider
+
+# --- 検証済みトークンのキャッシュの設定 ---
+AUTH_TOKEN_CACHE_ENABLED = os.environ.get("AUTH_TOKEN_CACHE_ENABLED", "true").lower() == "true"
+AUTH_TOKEN_CACHE_SIZE = int(os.environ.get("AUTH_TOKEN_CACHE_SIZE", 4096))
+# true の場合、User をデータベースに保存せずクレームから組み立てる
+AUTH_STATELESS_USERS = os.environ.get("AUTH_STATELESS_USERS", "false").lower() == "true"
+
+
+class VerifiedTokenCache:
+    """
+    署名検証済みのトークンを、トークンの有効期限 (exp) まで保持するキャッシュ。
+
+    キーはトークンの SHA-256 ハッシュで、トークン自体は保持しない。
+    """
+
+    def __init__(self, max_entries=AUTH_TOKEN_CACHE_SIZE, enabled=AUTH_TOKEN_CACHE_ENABLED):
+        self.enabled = enabled
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "expired": 0}
+
+    @staticmethod
+    def _key(token):
+        return hashlib.sha256(token.encode("utf-8")).digest()
+
+    def get(self, token):
+        """キャッシュ済みの (user, payload) を返す。なければ None。"""
+        if not self.enabled:
+            return None
+        key = self._key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            if entry[0] <= time.time():
+                del self._entries[key]
+                self._stats["expired"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return entry[1]
+
+    def set(self, token, user_auth):
+        if not self.enabled:
+            return
+        exp = user_auth[1].get("exp")
+        if not exp:
+            # 有効期限のないトークンはキャッシュしない
+            return
+        key = self._key(token)
+        with self._lock:
+            self._entries[key] = (exp, user_auth)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+        return stats
+
+
+verified_token_cache = VerifiedTokenCache()
+
+
+def resolve_user(username, payload):
+    """
+    トークンのユーザー名に対応する User を返す。
+
+    AUTH_STATELESS_USERS が true の場合は保存しない User をクレームから組み立て、
+    SQLite への書き込みを行わない。
+    """
+    if AUTH_STATELESS_USERS:
+        return User(
+            username=username,
+            first_name=(payload.get("given_name") or "")[:150],
+            last_name=(payload.get("family_name") or "")[:150],
+            email=payload.get("email") or "",
+        )
+    user, created = User.objects.get_or_create(username=username)
+    return user
+
 
 class AzureADJWTAuthentication(BaseAuthentication):
     """
@@ -23,6 +116,11 @@ class AzureADJWTAuthentication(BaseAuthentication):
 
         try:
             token = auth_header.split(' ')[1]
+            cached = verified_token_cache.get(token)
+            if cached is not None:
+                # 検証済みのトークンは署名検証とユーザーの取得を省略する
+                return cached
+
             signing_key = JWK_CLIENT.get_signing_key_from_jwt(token).key
             
             payload = jwt.decode(
@@ -38,10 +136,11 @@ class AzureADJWTAuthentication(BaseAuthentication):
             if not username:
                 raise AuthenticationFailed('Token does not contain a username.')
             
-            # DjangoのUserモデルと連携（存在しない場合は作成）
-            user, created = User.objects.get_or_create(username=username)
+            # DjangoのUserモデルと連携（存在しない場合は作成。設定によっては保存しない）
+            user = resolve_user(username, payload)
 
             # 検証に成功した場合、(user, auth) タプルを返す
+            verified_token_cache.set(token, (user, payload))
             return (user, payload)
 
         except jwt.PyJWTError as e:
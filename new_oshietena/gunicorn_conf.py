@@ -0,0 +1,83 @@
+"""
+gunicorn の設定 (本番用のエントリポイント)。
+
+    gunicorn -c new_oshietena/gunicorn_conf.py
+
+または ``python manage.py serve`` から起動する。並行処理のモデルは SERVE_MODE で選ぶ。
+
+- threads: WSGI + スレッド (gthread)。既定
+- gevent: WSGI + gevent (グリーンスレッド)。SSE のような待ち時間の長い接続を多数保持できる
+- asgi: ASGI + uvicorn。AsyncChatView (/api/chat/async/) を非同期で動かす
+"""
+import os
+import multiprocessing
+
+SERVE_MODE = os.environ.get("SERVE_MODE", "threads")
+
+if SERVE_MODE == "gevent":
+    # 事前読み込みで ssl や socket を import する前にパッチを当てる
+    from gevent import monkey
+
+    monkey.patch_all()
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "new_oshietena.settings")
+
+WORKER_CLASSES = {
+    "threads": "gthread",
+    "gevent": "gevent",
+    "asgi": "uvicorn_worker.UvicornWorker",
+}
+APPLICATIONS = {
+    "threads": "new_oshietena.wsgi:application",
+    "gevent": "new_oshietena.wsgi:application",
+    "asgi": "new_oshietena.asgi:application",
+}
+
+if SERVE_MODE not in WORKER_CLASSES:
+    raise ValueError(f"SERVE_MODE must be one of {', '.join(WORKER_CLASSES)}: {SERVE_MODE}")
+
+wsgi_app = APPLICATIONS[SERVE_MODE]
+worker_class = WORKER_CLASSES[SERVE_MODE]
+bind = os.environ.get("SERVE_BIND", f"0.0.0.0:{os.environ.get('PORT', '8000')}")
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get("SERVE_THREADS", 8))
+worker_connections = int(os.environ.get("SERVE_WORKER_CONNECTIONS", 1000))
+# SSE のストリームは長時間続くため、タイムアウトは長めにする
+timeout = int(os.environ.get("SERVE_TIMEOUT", 300))
+graceful_timeout = int(os.environ.get("SERVE_GRACEFUL_TIMEOUT", 30))
+keepalive = int(os.environ.get("SERVE_KEEPALIVE", 5))
+# アプリケーションと重いモジュールをマスタープロセスで 1 回だけ読み込む
+preload_app = os.environ.get("SERVE_PRELOAD", "true").lower() == "true"
+accesslog = os.environ.get("SERVE_ACCESS_LOG", "-")
+
+
+def on_starting(server):
+    # マルチプロセスモードのメトリクスは、前回の起動時のファイルを消してから集計する
+    directory = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        for name in os.listdir(directory):
+            if name.endswith(".db"):
+                os.remove(os.path.join(directory, name))
+
+
+def when_ready(server):
+    if preload_app:
+        from app.warmup import preload
+
+        preload()
+
+
+def post_fork(server, worker):
+    from app.warmup import preload, warmup
+
+    if not preload_app:
+        preload()
+    warmup()
+
+
+def child_exit(server, worker):
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(worker.pid)
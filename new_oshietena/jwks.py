@@ -0,0 +1,173 @@
+import os
+import json
+import time
+import random
+import threading
+import urllib.request
+import jwt
+from jwt import PyJWKSet
+from jwt.exceptions import PyJWKClientConnectionError, PyJWKClientError
+
+# --- JWKS (署名鍵) 取得の設定 ---
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SYSTENA_TENANT_ID = os.environ.get("VITE_APP_TENANT_ID")
+# テストやオフライン環境では file:// の URL でローカルの JWKS を指定できる
+JWKS_URL = os.environ.get(
+    "JWKS_URL",
+    f"https://login.microsoftonline.com/{SYSTENA_TENANT_ID}/discovery/v2.0/keys",
+)
+# 取得した JWKS を保存するファイル。コールドスタート時はここから鍵を読み込む
+JWKS_CACHE_PATH = os.environ.get("JWKS_CACHE_PATH", os.path.join(BASE_DIR, "jwks_cache.json"))
+# バックグラウンドで JWKS を取り直す間隔 (秒)
+JWKS_REFRESH_SECONDS = int(os.environ.get("JWKS_REFRESH_SECONDS", 3600))
+# 未知の kid を受け取った際に JWKS を取り直す最短間隔 (秒)
+JWKS_MIN_REFRESH_SECONDS = int(os.environ.get("JWKS_MIN_REFRESH_SECONDS", 60))
+JWKS_FETCH_TIMEOUT = int(os.environ.get("JWKS_FETCH_TIMEOUT", 10))
+
+
+class JWKSProvider:
+    """
+    PyJWKClient の代わりに使う署名鍵のプロバイダ。
+
+    鍵は起動時 (またはワーカーの起動時) に読み込み、バックグラウンドのスレッドで
+    定期的に取り直す。取得した JWKS はファイルにも保存し、次回の起動時は
+    ネットワークに接続せずに鍵を使える。リクエストの処理中に JWKS を取得するのは、
+    未知の kid (鍵のローテーション) を受け取った場合だけになる。
+    """
+
+    def __init__(self, url=JWKS_URL, cache_path=JWKS_CACHE_PATH, refresh_seconds=JWKS_REFRESH_SECONDS,
+                 min_refresh_seconds=JWKS_MIN_REFRESH_SECONDS, timeout=JWKS_FETCH_TIMEOUT):
+        self.url = url
+        self.cache_path = cache_path
+        self.refresh_seconds = refresh_seconds
+        self.min_refresh_seconds = min_refresh_seconds
+        self.timeout = timeout
+        self._keys = {}
+        self._fetched_at = 0.0
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._stop = threading.Event()
+
+    # ---------- 鍵の読み込み ----------
+    def _set_keys(self, data, fetched_at):
+        jwk_set = PyJWKSet.from_dict(data)
+        keys = {
+            key.key_id: key for key in jwk_set.keys
+            if key.public_key_use in ["sig", None] and key.key_id
+        }
+        if not keys:
+            raise PyJWKClientError("The JWKS endpoint did not contain any signing keys")
+        with self._lock:
+            self._keys = keys
+            self._fetched_at = fetched_at
+
+    def load_cache_file(self):
+        """保存済みの JWKS を読み込む。読み込めた場合は True。"""
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self._set_keys(data, os.path.getmtime(self.cache_path))
+            return True
+        except (OSError, ValueError, jwt.PyJWTError) as e:
+            print(f"JWKS キャッシュファイルを読み込めませんでした: {e}")
+            return False
+
+    def _save_cache_file(self, data):
+        tmp_path = f"{self.cache_path}.tmp-{os.getpid()}"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.cache_path)
+        except OSError as e:
+            print(f"JWKS キャッシュファイルを保存できませんでした: {e}")
+
+    def fetch(self):
+        try:
+            request = urllib.request.Request(url=self.url)
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.load(response)
+        except (OSError, ValueError) as e:
+            raise PyJWKClientConnectionError(f'Fail to fetch data from the url, err: "{e}"') from e
+
+    def refresh(self, force=True):
+        """
+        JWKS を取得して鍵を差し替え、ファイルに保存する。
+
+        force が False の場合、直前 min_refresh_seconds 以内に取得済みなら何もしない。
+        """
+        with self._refresh_lock:
+            if not force and time.time() - self._fetched_at < self.min_refresh_seconds:
+                return
+            data = self.fetch()
+            self._set_keys(data, time.time())
+            self._save_cache_file(data)
+
+    # ---------- 起動時の読み込みとバックグラウンド更新 ----------
+    def start(self):
+        """
+        鍵を読み込み、バックグラウンドの更新スレッドを開始する。
+
+        ファイルの鍵が更新間隔より古い、またはファイルがない場合はここで取得する。
+        fork 後のワーカーでも呼び出してよく、スレッドはプロセスごとに 1 つだけ起動する。
+        """
+        if not self._keys:
+            self.load_cache_file()
+        if time.time() - self._fetched_at >= self.refresh_seconds:
+            try:
+                self.refresh()
+            except jwt.PyJWTError as e:
+                # 取得に失敗しても、ファイルの鍵があれば検証を続けられる
+                print(f"JWKS の事前取得に失敗しました: {e}")
+        self._ensure_refresher()
+
+    def _ensure_refresher(self):
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._refresh_loop, name="jwks-refresher", daemon=True)
+            self._thread.start()
+
+    def _refresh_loop(self):
+        while True:
+            # 有効期限より前に取り直す。複数ワーカーが同時に取得しないよう少しずらす
+            delay = self.refresh_seconds - (time.time() - self._fetched_at)
+            delay = max(delay, self.min_refresh_seconds) * random.uniform(0.9, 1.0)
+            if self._stop.wait(delay):
+                return
+            try:
+                self.refresh(force=False)
+            except jwt.PyJWTError as e:
+                print(f"JWKS のバックグラウンド更新に失敗しました: {e}")
+
+    def stop(self):
+        self._stop.set()
+
+    # ---------- PyJWKClient 互換の API ----------
+    def get_signing_key(self, kid):
+        self._ensure_refresher()
+        with self._lock:
+            key = self._keys.get(kid)
+        if key is not None:
+            return key
+
+        # 未知の kid はローテーションの可能性があるため、JWKS を取り直してもう一度探す
+        self.refresh(force=False)
+        with self._lock:
+            key = self._keys.get(kid)
+        if key is None:
+            raise PyJWKClientError(f'Unable to find a signing key that matches: "{kid}"')
+        return key
+
+    def get_signing_key_from_jwt(self, token):
+        header = jwt.get_unverified_header(token)
+        return self.get_signing_key(header.get("kid"))
+
+
+jwks_provider = JWKSProvider()
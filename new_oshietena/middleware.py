@@ -0,0 +1,105 @@
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from app.metrics import current_endpoint, observe_request, resolve_endpoint
+from app.profiling import request_profiler
+
+
+class MetricsMiddleware:
+    """
+    リクエストごとの所要時間とステータスを記録するミドルウェア。
+
+    処理中のエンドポイントを current_endpoint に設定し、ビューの内側で記録する
+    処理段階 (埋め込み・検索・Cosmos DB など) のメトリクスにも同じラベルを付ける。
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        endpoint = resolve_endpoint(request.path_info)
+        token = current_endpoint.set(endpoint)
+        started_at = time.perf_counter()
+        status_code = 500
+        try:
+            response = self.get_response(request)
+            status_code = response.status_code
+            return response
+        finally:
+            current_endpoint.reset(token)
+            observe_request(endpoint, request.method, status_code, time.perf_counter() - started_at)
+
+    async def __acall__(self, request):
+        endpoint = resolve_endpoint(request.path_info)
+        token = current_endpoint.set(endpoint)
+        started_at = time.perf_counter()
+        status_code = 500
+        try:
+            response = await self.get_response(request)
+            status_code = response.status_code
+            return response
+        finally:
+            current_endpoint.reset(token)
+            observe_request(endpoint, request.method, status_code, time.perf_counter() - started_at)
+
+
+class ProfilingMiddleware:
+    """
+    署名付きの X-Profile-Request ヘッダーを付けたリクエストを cProfile で記録するミドルウェア。
+
+    SSE のレスポンスはストリームを最後まで返し終えるまで記録し、保存したプロファイルの ID を
+    X-Profile-Id ヘッダーで返す。ヘッダーの値は manage.py profile_header で作成する。
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def _start(self, request):
+        if not request_profiler.enabled:
+            return None
+        return request_profiler.start(request, resolve_endpoint(request.path_info))
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        session = self._start(request)
+        if session is None:
+            return self.get_response(request)
+        try:
+            response = self.get_response(request)
+        except BaseException:
+            session.finish()
+            raise
+        return self._attach(session, response)
+
+    async def __acall__(self, request):
+        session = self._start(request)
+        if session is None:
+            return await self.get_response(request)
+        try:
+            response = await self.get_response(request)
+        except BaseException:
+            session.finish()
+            raise
+        return self._attach(session, response)
+
+    def _attach(self, session, response):
+        response["X-Profile-Id"] = session.profile_id
+        if not response.streaming:
+            session.finish()
+        elif response.is_async:
+            response.streaming_content = session.wrap_async_stream(response.streaming_content)
+        else:
+            response.streaming_content = session.wrap_stream(response.streaming_content)
+        return response
@@ -55,6 +55,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # 処理時間を計測するため先頭に置く
+    'new_oshietena.middleware.MetricsMiddleware',
+    # 署名付きのヘッダーを付けたリクエストだけを記録する (PROFILING_ENABLED)
+    'new_oshietena.middleware.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
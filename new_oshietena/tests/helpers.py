@@ -0,0 +1,30 @@
+import time
+import jwt
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jwt.algorithms import RSAAlgorithm
+
+
+def generate_private_key():
+    return rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+
+def to_jwks(*keys):
+    """(kid, 秘密鍵) の組から公開鍵の JWKS を作る。"""
+    jwks = []
+    for kid, private_key in keys:
+        jwk = RSAAlgorithm.to_jwk(private_key.public_key(), as_dict=True)
+        jwks.append(dict(jwk, kid=kid, use="sig", alg="RS256"))
+    return {"keys": jwks}
+
+
+def sign_token(private_key, kid="k1", audience="client-id", tenant_id="tenant-id", lifetime=3600, **claims):
+    now = int(time.time())
+    payload = {
+        "aud": audience,
+        "iss": f"https://sts.windows.net/{tenant_id}/",
+        "iat": now,
+        "exp": now + lifetime,
+        "preferred_username": "user@example.com",
+        **claims,
+    }
+    return jwt.encode(payload, private_key, algorithm="RS256", headers={"kid": kid})
@@ -0,0 +1,95 @@
+from types import SimpleNamespace
+from unittest import mock
+from django.test import RequestFactory, SimpleTestCase
+from rest_framework.exceptions import AuthenticationFailed
+from new_oshietena.authentication import AzureADJWTAuthentication, VerifiedTokenCache
+from new_oshietena.tests.helpers import generate_private_key, sign_token
+
+
+class VerifiedTokenCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch("new_oshietena.authentication.time.time", side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.cache = VerifiedTokenCache(max_entries=2, enabled=True)
+
+    def test_hit_until_the_token_expires(self):
+        self.cache.set("token", ("user", {"exp": 1060}))
+
+        self.assertEqual(self.cache.get("token"), ("user", {"exp": 1060}))
+        self.now = 1060
+        self.assertIsNone(self.cache.get("token"))
+        self.assertEqual(self.cache.stats(), {"hits": 1, "misses": 0, "expired": 1, "entries": 0})
+
+    def test_tokens_without_exp_are_not_cached(self):
+        self.cache.set("token", ("user", {}))
+
+        self.assertIsNone(self.cache.get("token"))
+
+    def test_evicts_least_recently_used_token(self):
+        for token in ("a", "b", "c"):
+            self.cache.set(token, (token, {"exp": 2000}))
+
+        self.assertIsNone(self.cache.get("a"))
+        self.assertEqual(self.cache.get("c"), ("c", {"exp": 2000}))
+
+    def test_does_not_keep_the_raw_token(self):
+        self.cache.set("secret-token", ("user", {"exp": 2000}))
+
+        self.assertNotIn("secret-token", self.cache._entries)
+
+    def test_disabled_cache(self):
+        cache = VerifiedTokenCache(enabled=False)
+        cache.set("token", ("user", {"exp": 2000}))
+
+        self.assertIsNone(cache.get("token"))
+
+
+@mock.patch("new_oshietena.authentication.AUTH_STATELESS_USERS", True)
+@mock.patch("new_oshietena.authentication.SYSTENA_TENANT_ID", "tenant-id")
+@mock.patch("new_oshietena.authentication.CLIENT_ID", "client-id")
+class AzureADJWTAuthenticationTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.private_key = generate_private_key()
+
+    def setUp(self):
+        self.jwk_client = mock.Mock()
+        self.jwk_client.get_signing_key_from_jwt.return_value = SimpleNamespace(key=self.private_key.public_key())
+        patchers = [
+            mock.patch("new_oshietena.authentication.JWK_CLIENT", self.jwk_client),
+            mock.patch("new_oshietena.authentication.verified_token_cache", VerifiedTokenCache(enabled=True)),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def authenticate(self, token):
+        request = RequestFactory().get("/", HTTP_AUTHORIZATION=f"Bearer {token}")
+        return AzureADJWTAuthentication().authenticate(request)
+
+    def test_second_request_skips_signature_verification(self):
+        token = sign_token(self.private_key)
+
+        first_user, payload = self.authenticate(token)
+        second_user, _ = self.authenticate(token)
+
+        self.assertEqual(first_user.username, "user@example.com")
+        self.assertIs(second_user, first_user)
+        self.assertEqual(payload["aud"], "client-id")
+        self.jwk_client.get_signing_key_from_jwt.assert_called_once()
+
+    def test_invalid_token_is_rejected_and_not_cached(self):
+        token = sign_token(self.private_key, audience="other-client")
+
+        for _ in range(2):
+            with self.assertRaises(AuthenticationFailed):
+                self.authenticate(token)
+        self.assertEqual(self.jwk_client.get_signing_key_from_jwt.call_count, 2)
+
+    def test_missing_header_is_left_to_other_authenticators(self):
+        request = RequestFactory().get("/")
+
+        self.assertIsNone(AzureADJWTAuthentication().authenticate(request))
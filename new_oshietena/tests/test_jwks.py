@@ -0,0 +1,83 @@
+import os
+import json
+import shutil
+import tempfile
+from pathlib import Path
+from unittest import mock
+from django.test import SimpleTestCase
+from jwt.exceptions import PyJWKClientError
+from new_oshietena.jwks import JWKSProvider
+from new_oshietena.tests.helpers import generate_private_key, to_jwks
+
+
+class JWKSProviderTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.key1 = generate_private_key()
+        cls.key2 = generate_private_key()
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.jwks_path = os.path.join(self.directory, "keys.json")
+        self.cache_path = os.path.join(self.directory, "jwks_cache.json")
+        self.publish(("k1", self.key1))
+
+    def publish(self, *keys):
+        with open(self.jwks_path, "w", encoding="utf-8") as f:
+            json.dump(to_jwks(*keys), f)
+
+    def provider(self, url=None, min_refresh_seconds=60):
+        provider = JWKSProvider(
+            url=url or Path(self.jwks_path).as_uri(), cache_path=self.cache_path,
+            refresh_seconds=3600, min_refresh_seconds=min_refresh_seconds,
+        )
+        self.addCleanup(provider.stop)
+        return provider
+
+    def test_refresh_fetches_and_saves_the_cache_file(self):
+        provider = self.provider()
+
+        provider.refresh()
+
+        self.assertEqual(provider.get_signing_key("k1").key_id, "k1")
+        with open(self.cache_path, "r", encoding="utf-8") as f:
+            self.assertEqual(json.load(f), to_jwks(("k1", self.key1)))
+
+    def test_start_uses_a_fresh_cache_file_without_fetching(self):
+        self.provider().refresh()
+        provider = self.provider(url="file:///nonexistent/keys.json")
+
+        with mock.patch.object(provider, "fetch") as fetch:
+            provider.start()
+
+        fetch.assert_not_called()
+        self.assertEqual(provider.get_signing_key("k1").key_id, "k1")
+
+    def test_start_keeps_cached_keys_when_the_fetch_fails(self):
+        self.provider().refresh()
+        os.utime(self.cache_path, (0, 0))
+        provider = self.provider(url="file:///nonexistent/keys.json")
+
+        provider.start()
+
+        self.assertEqual(provider.get_signing_key("k1").key_id, "k1")
+
+    def test_unknown_kid_refreshes_the_keys(self):
+        provider = self.provider(min_refresh_seconds=0)
+        provider.refresh()
+        self.publish(("k1", self.key1), ("k2", self.key2))
+
+        self.assertEqual(provider.get_signing_key("k2").key_id, "k2")
+
+    def test_unknown_kid_does_not_refetch_within_the_minimum_interval(self):
+        provider = self.provider()
+        provider.refresh()
+        self.publish(("k1", self.key1), ("k2", self.key2))
+
+        with mock.patch.object(provider, "fetch", wraps=provider.fetch) as fetch:
+            with self.assertRaises(PyJWKClientError):
+                provider.get_signing_key("k2")
+
+        fetch.assert_not_called()
@@ -20,16 +20,24 @@ from new_oshietena import views
 from app.chat_count import ChatCountView
 from django.urls import path
 from .views import ChatView, ChatHistoryView, auth_setup, get_csrf_token
+from .views import AsyncChatView
 from .views import FrontendAppView
+from app.metrics import metrics_view
 
 urlpatterns = [
     path("", FrontendAppView.as_view()),
     path('api/admin/', admin.site.urls),
     path('api/auth_setup/', auth_setup, name='auth_setup'),
     path('api/chat/', ChatView.as_view(), name='chat'),    
+    # ASGI (非同期) 版のチャットエンドポイント
+    path('api/chat/async/', AsyncChatView.as_view(), name='chat_async'),
     path('api/checkcount/', ChatCountView.as_view(), name='checkcount'),
     path('api/startday/', ChatCountView.as_view(), name='get_startday'),
+    # 開始日・利用回数・上限をまとめて返す
+    path('api/usage/', ChatCountView.as_view(), name='usage'),
     path('api/history/', ChatHistoryView.as_view(), name='chat_history'),
     path('api/csrf-token', get_csrf_token, name='get_csrf_token'),
     path('api/history/<str:chat_id>/', ChatHistoryView.as_view(), name='get_single_chat'),
+    # Prometheus 形式のメトリクス (METRICS_AUTH_TOKEN の Bearer トークンが必要。未設定なら METRICS_PUBLIC=true の場合のみ公開)
+    path('metrics', metrics_view, name='metrics'),
 ]
@@ -1,5 +1,7 @@
 import os
 import json
+import uuid
+import asyncio
 from django.http import JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import ensure_csrf_cookie
 from rest_framework.views import APIView
@@ -8,28 +10,169 @@ from rest_framework import status
 from rest_framework.permissions import IsAuthenticated
 import openai 
 from django.http import HttpResponse
+from django.views import View
+from asgiref.sync import sync_to_async
+from rest_framework.exceptions import AuthenticationFailed
 
 # 認証クラスとサービス関数をインポート
 from .authentication import AzureADJWTAuthentication
 from app.open_ai_service import handle_chatbot_response, stream_chatbot_response
+from app.open_ai_service import ahandle_chatbot_response, astream_chatbot_response
+from app.open_ai_service import stream_cached_answer, astream_cached_answer
 from app.ai_search_service import process_target_index, summarize_vector_results
-from app.save_chat import create_new_conversation
-from app.get_chat_history import fetch_history_for_user, fetch_single_chat_by_id
+from app.ai_search_service import aprocess_target_index, convert_string_to_vector, aconvert_string_to_vector
+from app.answer_cache import semantic_answer_cache, is_cacheable_conversation
+from app.open_ai_service import summarize_conversation
+from app.conversation_window import window_messages, refresh_conversation_summary
+from app.conversation_window import CONVERSATION_WINDOW_ENABLED, CONVERSATION_SUMMARY_MAX_TOKENS
+from app.save_chat import create_new_conversation, save_conversation_once
+from app.write_behind import write_behind_queue
+from app.get_chat_history import InvalidContinuationTokenError, fetch_history_for_user, fetch_single_chat_by_id
+from app.metrics import span
 from django.views.generic import TemplateView
 import traceback
-from django.conf import settings
-ERROR_MESSAGES_PATH = os.path.join(settings.BASE_DIR, "frontend/src/locales/ja/translation.json")
-
-try:
-    with open(ERROR_MESSAGES_PATH, "r", encoding="utf-8") as f:
-        ERROR_MESSAGES = json.load(f)
-except Exception as e:
-    ERROR_MESSAGES = {}
+# サーバー側での会話の保存 (リクエストで persist: true を指定した場合のみ)。false で無効化する
+CHAT_SERVER_SIDE_SAVE_ENABLED = os.environ.get("CHAT_SERVER_SIDE_SAVE_ENABLED", "true").lower() == "true"
 
 class FrontendAppView(TemplateView):
     template_name = "index.html"
 
 
+def extract_user_question(messages):
+    """messages から最初のユーザーの質問を取り出す"""
+    if isinstance(messages, list): # messagesがリストであることを確認
+        for message in messages:
+            if message.get("role") == "user":
+                return message.get("content")
+    return ""
+
+
+def build_headers_for_apim(request):
+    """APIM に転送するヘッダーを組み立てる"""
+    return {
+        'Authorization': request.headers.get('Authorization'),
+        'Content-Type': 'application/json',
+        'x-usage-startdate': request.headers.get('x-usage-startdate'),
+        'x-csrftoken': request.headers.get('x-csrftoken')
+    }
+
+
+def handle_permission_denied(e):
+    """openai.PermissionDeniedError をレスポンスに変換する"""
+    # メッセージに "quota" という単語が含まれているか確認
+    if "quota" in str(e).lower():
+        print(f"✅ クォータ上限エラー(403)を検出しました: {e}")
+        # 画面には「利用回数上限」メッセージを返す
+        return JsonResponse(
+            {"error": "rate_limit"},
+            status=429
+        )
+    # "quota" を含まない、純粋な権限エラーの場合
+    print(f"❌ 権限エラー: {e}")
+    return HttpResponse(
+        "APIへのアクセス権限がありません。",
+        status=403,
+        content_type="text/plain; charset=utf-8"
+    )
+
+
+def build_answer_cache_callback(target_index, question_vector, vector_summary):
+    """ストリーム完了時に回答をセマンティックキャッシュへ保存するコールバックを返す"""
+    if question_vector is None:
+        return None
+
+    def store_answer(answer):
+        try:
+            semantic_answer_cache.store(target_index, question_vector, vector_summary, answer)
+        except Exception as e:
+            print(f"回答キャッシュへの保存に失敗しました: {e}")
+
+    return store_answer
+
+
+def extract_latest_question(messages):
+    """messages から最後のユーザーの質問 (今回の質問) を取り出す"""
+    if isinstance(messages, list):
+        for message in reversed(messages):
+            if message.get("role") == "user":
+                return message.get("content")
+    return ""
+
+
+def build_persist_callback(request, data, messages):
+    """
+    ストリーム完了時に会話を保存するコールバックと、保存する会話のIDを返す。
+
+    クライアントが persist: true を指定した場合のみ保存する (その場合クライアントは
+    /api/history/ への POST を行わない)。保存は write-behind キューで行うため、
+    ストリームの応答時間には影響しない。
+
+    Returns:
+        tuple: (コールバック, conversationId)。保存しない場合は (None, None)
+    """
+    if not CHAT_SERVER_SIDE_SAVE_ENABLED or data.get("persist") is not True or not data.get("historyBoxId"):
+        return None, None
+
+    conversation_id = str(data.get("conversationId") or uuid.uuid4())
+    conversation = {
+        "tenant_id": request.auth.get("tid"),
+        "user_id": request.user.username,
+        "conversation_id": conversation_id,
+        "question": extract_latest_question(messages),
+        "historyBoxId": data["historyBoxId"],
+    }
+
+    def persist_answer(answer):
+        write_behind_queue.submit(
+            save_conversation_once,
+            answer={"message": {"role": "assistant", "content": answer}},
+            **conversation
+        )
+
+    return persist_answer, conversation_id
+
+
+def build_summary_refresh_callback(messages, user_id, history_box_id, headers_for_apim):
+    """
+    ストリーム完了時に、次のターン用に古い会話の要約を更新するコールバックを返す。
+
+    要約の LLM 呼び出しは write-behind キューで行い、回答の最初のトークンまでの時間には含めない。
+    """
+    if not CONVERSATION_WINDOW_ENABLED:
+        return None
+
+    def summarize(summary, new_messages):
+        return summarize_conversation(summary, new_messages, headers_for_apim, CONVERSATION_SUMMARY_MAX_TOKENS)
+
+    def refresh_summary(answer):
+        write_behind_queue.submit(
+            refresh_conversation_summary, messages, answer, user_id, history_box_id, summarize
+        )
+
+    return refresh_summary
+
+
+def combine_callbacks(*callbacks):
+    """None を除いたコールバックを順に呼び出すコールバックを返す"""
+    callbacks = [callback for callback in callbacks if callback is not None]
+    if not callbacks:
+        return None
+
+    def on_complete(answer):
+        for callback in callbacks:
+            callback(answer)
+
+    return on_complete
+
+
+def build_stream_response(stream, conversation_id):
+    """SSE のレスポンスを作る。サーバー側で保存する場合は会話のIDをヘッダーで返す"""
+    response = StreamingHttpResponse(stream, content_type="text/event-stream")
+    if conversation_id:
+        response["X-Conversation-Id"] = conversation_id
+    return response
+
+
 class ChatView(APIView):
     """チャットのストリーミング応答を処理するビュー"""
     authentication_classes = [AzureADJWTAuthentication]
@@ -39,56 +182,52 @@ class ChatView(APIView):
         try:
             messages = request.data.get("messages", [])
             target_index = request.auth.get('oid')
-            auth_header = request.headers.get('Authorization')
-            csrf_token = request.headers.get('x-csrftoken')
-            usage_start_date = request.headers.get('x-usage-startdate')
             if not messages:
                 return Response({"error": "messages field is required."}, status=status.HTTP_400_BAD_REQUEST)
 
-            user_question = ""
-            if isinstance(messages, list): # messagesがリストであることを確認
-                for message in messages:
-                    if message.get("role") == "user":
-                        user_question = message.get("content")
-                        break # ユーザーの質問を見つけたらループを抜ける
-
-            headers_for_apim = {
-                'Authorization': auth_header,
-                'Content-Type': 'application/json',
-                'x-usage-startdate': usage_start_date,
-                'x-csrftoken': csrf_token
-            }
+            user_question = extract_user_question(messages)
+            headers_for_apim = build_headers_for_apim(request)
+            persist_answer, conversation_id = build_persist_callback(request, request.data, messages)
 
             if target_index:
                 anser = process_target_index(user_question, target_index)
                 print(anser)
                 vector_summary = summarize_vector_results(anser)
-                messages.append({
+
+                # 同じ質問・同じ関連情報に対する回答がキャッシュにあれば LLM を呼ばずに返す
+                question_vector = None
+                if semantic_answer_cache.enabled and is_cacheable_conversation(messages):
+                    question_vector = convert_string_to_vector(user_question)
+                    with span("answer_cache") as timer:
+                        cached_answer = semantic_answer_cache.lookup(target_index, question_vector, vector_summary)
+                        timer.outcome = "miss" if cached_answer is None else "hit"
+                    if cached_answer is not None:
+                        if persist_answer:
+                            persist_answer(cached_answer)
+                        return build_stream_response(stream_cached_answer(cached_answer), conversation_id)
+
+                # 会話履歴をトークン予算に収め、古いやり取りは (回答後に更新している) 要約にまとめる
+                refresh_summary = build_summary_refresh_callback(
+                    messages, request.user.username, request.data.get("historyBoxId"), headers_for_apim
+                )
+                with span("history_window"):
+                    model_messages = window_messages(messages, request.user.username, request.data.get("historyBoxId"))
+                model_messages.append({
                     "role": "system",
                     "content": f"以下は関連情報です:\n{vector_summary}"
                 })
-                response = handle_chatbot_response(messages, headers_for_apim)
-                return StreamingHttpResponse(
-                stream_chatbot_response(messages, response),
-                content_type="text/event-stream",
-            )
-        except openai.PermissionDeniedError as e:
-            # メッセージに "quota" という単語が含まれているか確認
-            if "quota" in str(e).lower():
-                print(f"✅ クォータ上限エラー(403)を検出しました: {e}")
-                # 画面には「利用回数上限」メッセージを返す
-                return JsonResponse(
-                    {"error": "rate_limit"},
-                    status=429
+                response = handle_chatbot_response(model_messages, headers_for_apim)
+                on_complete = combine_callbacks(
+                    build_answer_cache_callback(target_index, question_vector, vector_summary),
+                    persist_answer,
+                    refresh_summary,
                 )
-            else:
-                # "quota" を含まない、純粋な権限エラーの場合
-                print(f"❌ 権限エラー: {e}")
-                return HttpResponse(
-                    "APIへのアクセス権限がありません。",
-                    status=403,
-                    content_type="text/plain; charset=utf-8"
+                return build_stream_response(
+                    stream_chatbot_response(model_messages, response, on_complete=on_complete),
+                    conversation_id,
                 )
+        except openai.PermissionDeniedError as e:
+            return handle_permission_denied(e)
 
         except Exception as e:
             # その他の予期せぬエラー
@@ -96,6 +235,110 @@ class ChatView(APIView):
             return Response({"error": f"Chat processing error: {e}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
         #===============================================================================================
 
+class AsyncChatView(View):
+    """
+    ChatView の非同期版。
+
+    ASGI で動かすと、埋め込み・検索・LLM ストリームの待ち時間にスレッドを占有しないため、
+    1 プロセスで多数の SSE ストリームを同時に保持できる。
+    認証・リクエスト・レスポンスの形式は ChatView と同じ。
+
+    キャッシュの参照や履歴のトークン数の計算など、CPU・ディスクを使う同期処理はスレッドで実行する。
+    会話・要約の保存 (Cosmos DB) は write-behind キューのスレッドで行うため、非同期の Cosmos DB クライアントは使わない。
+    """
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        view = super().as_view(**initkwargs)
+        # APIView と同様に CSRF チェックの対象外とする (認証は Bearer トークンで行う)
+        view.csrf_exempt = True
+        return view
+
+    async def authenticate(self, request):
+        """AzureADJWTAuthentication で認証し、失敗時は DRF と同じ 403 レスポンスを返す"""
+        try:
+            user_auth = await sync_to_async(AzureADJWTAuthentication().authenticate)(request)
+        except AuthenticationFailed as e:
+            return None, JsonResponse({"detail": str(e.detail)}, status=status.HTTP_403_FORBIDDEN)
+        if user_auth is None:
+            return None, JsonResponse(
+                {"detail": "Authentication credentials were not provided."},
+                status=status.HTTP_403_FORBIDDEN,
+            )
+        return user_auth, None
+
+    async def post(self, request):
+        user_auth, error_response = await self.authenticate(request)
+        if error_response is not None:
+            return error_response
+        request.user, request.auth = user_auth
+
+        try:
+            try:
+                data = json.loads(request.body or b"{}")
+            except ValueError as e:
+                return JsonResponse({"detail": f"JSON parse error - {e}"}, status=status.HTTP_400_BAD_REQUEST)
+
+            messages = data.get("messages", [])
+            target_index = request.auth.get('oid')
+            if not messages:
+                return JsonResponse({"error": "messages field is required."}, status=status.HTTP_400_BAD_REQUEST)
+
+            user_question = extract_user_question(messages)
+            headers_for_apim = build_headers_for_apim(request)
+            persist_answer, conversation_id = build_persist_callback(request, data, messages)
+
+            if not target_index:
+                return JsonResponse(
+                    {"error": "Chat processing error: token has no oid claim"},
+                    status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                )
+
+            anser = await aprocess_target_index(user_question, target_index)
+            vector_summary = summarize_vector_results(anser)
+
+            question_vector = None
+            if semantic_answer_cache.enabled and is_cacheable_conversation(messages):
+                question_vector = await aconvert_string_to_vector(user_question)
+                with span("answer_cache") as timer:
+                    cached_answer = await asyncio.to_thread(
+                        semantic_answer_cache.lookup, target_index, question_vector, vector_summary
+                    )
+                    timer.outcome = "miss" if cached_answer is None else "hit"
+                if cached_answer is not None:
+                    if persist_answer:
+                        persist_answer(cached_answer)
+                    return build_stream_response(astream_cached_answer(cached_answer), conversation_id)
+
+            refresh_summary = build_summary_refresh_callback(
+                messages, request.user.username, data.get("historyBoxId"), headers_for_apim
+            )
+            with span("history_window"):
+                model_messages = await asyncio.to_thread(
+                    window_messages, messages, request.user.username, data.get("historyBoxId")
+                )
+            model_messages.append({
+                "role": "system",
+                "content": f"以下は関連情報です:\n{vector_summary}"
+            })
+            response = await ahandle_chatbot_response(model_messages, headers_for_apim)
+            on_complete = combine_callbacks(
+                build_answer_cache_callback(target_index, question_vector, vector_summary),
+                persist_answer,
+                refresh_summary,
+            )
+            return build_stream_response(
+                astream_chatbot_response(model_messages, response, on_complete=on_complete),
+                conversation_id,
+            )
+        except openai.PermissionDeniedError as e:
+            return handle_permission_denied(e)
+
+        except Exception as e:
+            # その他の予期せぬエラー
+            print(f"💥 予期せぬエラー: {e}")
+            return JsonResponse({"error": f"Chat processing error: {e}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
 class ChatHistoryView(APIView):
     """チャット履歴の取得と保存を処理するビュー"""
     authentication_classes = [AzureADJWTAuthentication]
@@ -106,12 +349,20 @@ class ChatHistoryView(APIView):
             user_id = request.user.username
             chat_id = kwargs.get('chat_id')  # ← ここでURLのidパラメータを取得
             history_box_id = request.GET.get('historyBoxId')
+            continuation_token = request.GET.get('continuationToken')
             print(f"🧩 tenant_id: {user_id}, chat_id: {chat_id},historyBoxId: {history_box_id}")
 
+            # pageSize を指定した場合のみページング ({"items", "continuationToken"}) で返す
+            try:
+                page_size = int(request.GET['pageSize']) if request.GET.get('pageSize') else None
+            except ValueError:
+                page_size = 0
+            if page_size is not None and page_size <= 0:
+                return Response({"error": "pageSize must be a positive integer"}, status=status.HTTP_400_BAD_REQUEST)
 
             if chat_id:
                 # 個別チャット取得
-                item = fetch_single_chat_by_id(user_id, history_box_id)
+                item = fetch_single_chat_by_id(user_id, history_box_id, page_size, continuation_token)
                 if item:
                     print("✅ 履歴取得")
                     return Response(item, status=status.HTTP_200_OK)
@@ -120,8 +371,11 @@ class ChatHistoryView(APIView):
                     return Response({"error": "指定されたチャットは見つかりませんでした"}, status=status.HTTP_404_NOT_FOUND)
             else:
                 # 履歴全件取得（従来どおり）
-                history_items = fetch_history_for_user(user_id, history_box_id)
+                history_items = fetch_history_for_user(user_id, history_box_id, page_size, continuation_token)
                 return Response(history_items, status=status.HTTP_200_OK)
+        except InvalidContinuationTokenError as e:
+            print("❌ 継続トークンが不正です:", e)
+            return Response({"error": "continuationToken is invalid or expired"}, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
             print("🔥 get() で例外:", e)
             traceback.print_exc()